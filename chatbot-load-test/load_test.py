@@ -0,0 +1,280 @@
+"""
+Chat load generator for the chatbot templates.
+
+Drives N concurrent simulated users, each holding a multi-turn conversation,
+through a chatbot template's model_serving_utils (or, with --mode streamlit,
+through the full Streamlit script via streamlit.testing), and reports time to
+first token, tokens per second, turn latency, errors and CPU usage.
+
+By default a mock serving endpoint (mock_serving_endpoint.py) is started as a
+subprocess and the template is pointed at it through DATABRICKS_HOST, so no
+Databricks workspace is needed. Use --no-mock with the usual DATABRICKS_*
+variables to target a real workspace instead.
+
+Usage:
+    python load_test.py --app ../e2e-chatbot-app --users 50 --turns 3 \
+        --mock-args="--task agent/v2/chat --tokens-per-second 80"
+"""
+import argparse
+import importlib
+import inspect
+import json
+import os
+import resource
+import shlex
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+PROMPTS = [
+    "What is Databricks?",
+    "How do I create a serving endpoint?",
+    "Summarize the previous answer in one sentence.",
+    "What are the main differences between a cluster and a SQL warehouse?",
+    "Give me an example query.",
+]
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[idx]
+
+
+def _summarize(values):
+    if not values:
+        return {}
+    return {
+        "mean": statistics.fmean(values),
+        "p50": _percentile(values, 50),
+        "p95": _percentile(values, 95),
+        "p99": _percentile(values, 99),
+        "max": max(values),
+    }
+
+
+def _process_cpu_seconds(pid):
+    """CPU seconds (user + system) used so far by another process, Linux only."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def _self_cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_mock(port, mock_args):
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(HERE, "mock_serving_endpoint.py"),
+         "--port", str(port), *shlex.split(mock_args)],
+    )
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/api/2.0/serving-endpoints/probe", timeout=1)
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Mock serving endpoint did not start")
+
+
+def _content_of(chunk):
+    """Extract streamed text from a chat completions, ChatAgent or ResponsesAgent event."""
+    if chunk.get("choices"):
+        return chunk["choices"][0].get("delta", {}).get("content") or ""
+    if "delta" in chunk and isinstance(chunk["delta"], dict):
+        return chunk["delta"].get("content") or ""
+    if chunk.get("type") == "response.output_text.delta":
+        return chunk.get("delta") or ""
+    return ""
+
+
+class UtilsUser:
+    """Simulated user talking to the endpoint through the template's model_serving_utils."""
+
+    def __init__(self, utils, endpoint_name, max_tokens):
+        self.utils = utils
+        self.endpoint_name = endpoint_name
+        self.max_tokens = max_tokens
+        self.streaming = hasattr(utils, "query_endpoint_stream")
+        self.messages = []
+
+    def turn(self, prompt):
+        self.messages.append({"role": "user", "content": prompt})
+        start = time.perf_counter()
+        first_token_at = None
+        tokens = 0
+        if self.streaming:
+            kwargs = {"return_traces": False} if self.max_tokens is None else {"max_tokens": self.max_tokens}
+            parts = []
+            for chunk in self.utils.query_endpoint_stream(self.endpoint_name, self.messages, **kwargs):
+                content = _content_of(chunk)
+                if content:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    tokens += 1
+                    parts.append(content)
+            answer = "".join(parts)
+        else:
+            if self.max_tokens is None:
+                messages, _ = self.utils.query_endpoint(self.endpoint_name, self.messages, False)
+                answer = messages[-1].get("content") or ""
+            else:
+                answer = self.utils.query_endpoint(self.endpoint_name, self.messages, self.max_tokens)["content"]
+            first_token_at = time.perf_counter()
+            tokens = len(answer.split())
+        end = time.perf_counter()
+        self.messages.append({"role": "assistant", "content": answer})
+        return {
+            "ttft": (first_token_at or end) - start,
+            "latency": end - start,
+            "tokens": tokens,
+        }
+
+
+class StreamlitUser:
+    """Simulated user running the whole Streamlit script headlessly with AppTest."""
+
+    def __init__(self, app_dir, timeout):
+        from streamlit.testing.v1 import AppTest
+        self.app = AppTest.from_file(os.path.join(app_dir, "app.py"), default_timeout=timeout)
+        self.app.run()
+
+    def turn(self, prompt):
+        start = time.perf_counter()
+        self.app.chat_input[0].set_value(prompt).run()
+        end = time.perf_counter()
+        if self.app.exception:
+            raise RuntimeError(str(self.app.exception[0].message))
+        # AppTest only exposes the final state of a run, not the stream
+        return {"ttft": None, "latency": end - start, "tokens": None}
+
+
+def run_load_test(make_user, users, turns, ramp_up_seconds):
+    results = []
+    errors = []
+    lock = threading.Lock()
+
+    def simulate(user_idx):
+        time.sleep(ramp_up_seconds * user_idx / max(users, 1))
+        try:
+            user = make_user()
+        except Exception as e:
+            with lock:
+                errors.append(f"setup: {e}")
+            return
+        for turn in range(turns):
+            try:
+                result = user.turn(PROMPTS[(user_idx + turn) % len(PROMPTS)])
+                with lock:
+                    results.append(result)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+
+    threads = [threading.Thread(target=simulate, args=(i,)) for i in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", required=True, help="Path to a chatbot template directory")
+    parser.add_argument("--mode", choices=["utils", "streamlit"], default="utils")
+    parser.add_argument("--endpoint", default="mock-endpoint", help="Serving endpoint name")
+    parser.add_argument("--users", type=int, default=10, help="Concurrent simulated users")
+    parser.add_argument("--turns", type=int, default=3, help="Turns per conversation")
+    parser.add_argument("--ramp-up-seconds", type=float, default=1.0)
+    parser.add_argument("--max-tokens", type=int, default=400,
+                        help="max_tokens passed to the basic chatbot templates")
+    parser.add_argument("--timeout", type=float, default=120, help="Per-turn timeout in streamlit mode")
+    parser.add_argument("--no-mock", action="store_true", help="Use the DATABRICKS_* workspace instead of a mock")
+    parser.add_argument("--mock-args", default="", help="Extra arguments for mock_serving_endpoint.py")
+    parser.add_argument("--json", help="Write the report to this file as JSON")
+    args = parser.parse_args()
+
+    app_dir = os.path.abspath(args.app)
+    os.environ["SERVING_ENDPOINT"] = args.endpoint
+    mock = None
+    if not args.no_mock:
+        port = _free_port()
+        mock = start_mock(port, args.mock_args)
+        for var in ["DATABRICKS_CLIENT_ID", "DATABRICKS_CLIENT_SECRET", "DATABRICKS_CONFIG_PROFILE"]:
+            os.environ.pop(var, None)
+        os.environ["DATABRICKS_HOST"] = f"http://127.0.0.1:{port}"
+        os.environ["DATABRICKS_TOKEN"] = "mock-token"
+
+    try:
+        if args.mode == "streamlit":
+            make_user = lambda: StreamlitUser(app_dir, args.timeout)
+        else:
+            sys.path.insert(0, app_dir)
+            utils = importlib.import_module("model_serving_utils")
+            # The e2e template's query functions take return_traces instead of max_tokens
+            takes_max_tokens = "max_tokens" in inspect.signature(utils.query_endpoint).parameters
+            max_tokens = args.max_tokens if takes_max_tokens else None
+            make_user = lambda: UtilsUser(utils, args.endpoint, max_tokens)
+
+        mock_cpu_start = _process_cpu_seconds(mock.pid) if mock else None
+        self_cpu_start = _self_cpu_seconds()
+        start = time.perf_counter()
+        results, errors = run_load_test(make_user, args.users, args.turns, args.ramp_up_seconds)
+        wall = time.perf_counter() - start
+        self_cpu = _self_cpu_seconds() - self_cpu_start
+        mock_cpu = _process_cpu_seconds(mock.pid) - mock_cpu_start if mock and mock_cpu_start is not None else None
+    finally:
+        if mock:
+            mock.terminate()
+            mock.wait()
+
+    ttfts = [r["ttft"] for r in results if r["ttft"] is not None]
+    rates = [r["tokens"] / (r["latency"] - r["ttft"]) for r in results
+             if r["tokens"] and r["ttft"] is not None and r["latency"] > r["ttft"]]
+    report = {
+        "app": os.path.basename(app_dir),
+        "mode": args.mode,
+        "users": args.users,
+        "turns_completed": len(results),
+        "errors": len(errors),
+        "wall_seconds": wall,
+        "turns_per_second": len(results) / wall if wall else None,
+        "time_to_first_token_seconds": _summarize(ttfts),
+        "turn_latency_seconds": _summarize([r["latency"] for r in results]),
+        "tokens_per_second_per_stream": _summarize(rates),
+        "app_cpu_seconds": self_cpu,
+        "app_cpu_utilization": self_cpu / wall if wall else None,
+        "endpoint_cpu_seconds": mock_cpu,
+    }
+    print(json.dumps(report, indent=2))
+    if errors:
+        print(f"First errors: {errors[:5]}", file=sys.stderr)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
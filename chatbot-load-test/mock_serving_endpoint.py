@@ -0,0 +1,290 @@
+"""
+Local stand-in for a Databricks model serving endpoint.
+
+Serves just enough of the Databricks REST API for the chatbot templates to
+run against it unchanged when DATABRICKS_HOST points at this server:
+
+- GET  /api/2.0/serving-endpoints/<name>                      endpoint metadata
+- POST /serving-endpoints/<name>/invocations                  queries (streaming or not)
+- POST /serving-endpoints/<name>/served-models/feedback/invocations   feedback
+
+Responses follow the chat completions (llm/v1/chat), ChatAgent
+(agent/v2/chat) or ResponsesAgent (agent/v1/responses) formats, with a
+configurable time to first token, token rate and error injection. Answers
+are drawn from a seeded generator, or replayed from a file, so runs are
+repeatable.
+
+Usage:
+    python mock_serving_endpoint.py --task agent/v2/chat --tokens-per-second 50
+"""
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TASK_TYPES = ["llm/v1/chat", "agent/v2/chat", "agent/v1/responses"]
+
+_WORDS = (
+    "databricks lakehouse model serving endpoint streaming token latency agent "
+    "tool query table pipeline notebook cluster warehouse catalog schema vector "
+    "search retrieval answer question context window response feedback"
+).split()
+
+
+class MockConfig:
+    def __init__(self, task="llm/v1/chat", ttft_ms=200, tokens_per_second=50,
+                 response_tokens=100, error_rate=0.0, stream_error_rate=0.0,
+                 tool_calls=False, responses_file=None, seed=0):
+        self.task = task
+        self.ttft_ms = ttft_ms
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = response_tokens
+        self.error_rate = error_rate
+        self.stream_error_rate = stream_error_rate
+        self.tool_calls = tool_calls
+        self.seed = seed
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._replay = None
+        if responses_file:
+            with open(responses_file) as f:
+                self._replay = itertools.cycle([json.loads(line) for line in f if line.strip()])
+
+    def next_response(self):
+        """Return (answer tokens, should fail, should fail mid-stream)."""
+        with self._lock:
+            if self._replay is not None:
+                text = next(self._replay)
+                tokens = [word + " " for word in text.split()]
+            else:
+                tokens = [self._random.choice(_WORDS) + " " for _ in range(self.response_tokens)]
+            fail = self._random.random() < self.error_rate
+            fail_mid_stream = self._random.random() < self.stream_error_rate
+        return tokens, fail, fail_mid_stream
+
+
+class _StreamAborted(Exception):
+    pass
+
+
+def _chat_completion_events(tokens, request_id):
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    for i, token in enumerate(tokens):
+        delta = {"content": token}
+        if i == 0:
+            delta["role"] = "assistant"
+        yield {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": "mock",
+            "choices": [{"index": 0, "delta": delta, "finish_reason": None}],
+        }
+    yield {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": "mock",
+        "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        "databricks_output": {"databricks_request_id": request_id},
+    }
+
+
+def _chat_agent_events(tokens, request_id, tool_calls):
+    if tool_calls:
+        call_id = f"call_{uuid.uuid4().hex[:12]}"
+        yield {"delta": {
+            "role": "assistant", "content": "", "id": str(uuid.uuid4()),
+            "tool_calls": [{"id": call_id, "type": "function",
+                            "function": {"name": "lookup", "arguments": '{"query": "mock"}'}}],
+        }}
+        yield {"delta": {
+            "role": "tool", "content": '{"result": "mock tool output"}',
+            "id": str(uuid.uuid4()), "tool_call_id": call_id, "name": "lookup",
+        }}
+    message_id = str(uuid.uuid4())
+    for token in tokens:
+        yield {"delta": {"role": "assistant", "content": token, "id": message_id}}
+    yield {"delta": {"role": "assistant", "content": "", "id": message_id},
+           "databricks_output": {"databricks_request_id": request_id}}
+
+
+def _responses_agent_events(tokens, request_id, tool_calls):
+    if tool_calls:
+        call_id = f"call_{uuid.uuid4().hex[:12]}"
+        yield {"type": "response.output_item.done", "item": {
+            "type": "function_call", "id": str(uuid.uuid4()), "call_id": call_id,
+            "name": "lookup", "arguments": '{"query": "mock"}',
+        }}
+        yield {"type": "response.output_item.done", "item": {
+            "type": "function_call_output", "call_id": call_id,
+            "output": '{"result": "mock tool output"}',
+        }}
+    item_id = str(uuid.uuid4())
+    for token in tokens:
+        yield {"type": "response.output_text.delta", "item_id": item_id, "delta": token}
+    yield {
+        "type": "response.output_item.done",
+        "item": {
+            "type": "message", "id": item_id, "role": "assistant",
+            "content": [{"type": "output_text", "text": "".join(tokens)}],
+        },
+        "databricks_output": {"databricks_request_id": request_id},
+    }
+
+
+def _events(config, tokens, request_id):
+    if config.task == "agent/v2/chat":
+        return _chat_agent_events(tokens, request_id, config.tool_calls)
+    elif config.task == "agent/v1/responses":
+        return _responses_agent_events(tokens, request_id, config.tool_calls)
+    return _chat_completion_events(tokens, request_id)
+
+
+def _non_streaming_response(config, tokens, request_id):
+    text = "".join(tokens)
+    databricks_output = {"databricks_request_id": request_id}
+    if config.task == "agent/v2/chat":
+        return {"messages": [{"role": "assistant", "content": text, "id": str(uuid.uuid4())}],
+                "databricks_output": databricks_output}
+    elif config.task == "agent/v1/responses":
+        return {"output": [{"type": "message", "id": str(uuid.uuid4()), "role": "assistant",
+                            "content": [{"type": "output_text", "text": text}]}],
+                "databricks_output": databricks_output}
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "model": "mock",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                     "finish_reason": "stop"}],
+        "usage": {"completion_tokens": len(tokens)},
+        "databricks_output": databricks_output,
+    }
+
+
+def make_handler(config):
+    class MockServingHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _write_chunk(self, data):
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+        def do_GET(self):
+            parts = self.path.strip("/").split("/")
+            if parts[:3] == ["api", "2.0", "serving-endpoints"] and len(parts) == 4:
+                self._send_json(200, {
+                    "name": parts[3],
+                    "task": config.task,
+                    "state": {"ready": "READY"},
+                    "config": {"served_entities": [{"name": "mock-model"}]},
+                })
+            else:
+                self._send_json(404, {"error_code": "NOT_FOUND", "message": self.path})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            parts = self.path.strip("/").split("/")
+            if parts[-2:] == ["feedback", "invocations"]:
+                self._send_json(200, {"predictions": []})
+                return
+            if parts[0] != "serving-endpoints" or parts[-1] != "invocations":
+                self._send_json(404, {"error_code": "NOT_FOUND", "message": self.path})
+                return
+
+            tokens, fail, fail_mid_stream = config.next_response()
+            request_id = str(uuid.uuid4())
+            time.sleep(config.ttft_ms / 1000)
+            if fail:
+                self._send_json(503, {"error_code": "TEMPORARILY_UNAVAILABLE",
+                                      "message": "Injected error"})
+                return
+            if not body.get("stream"):
+                time.sleep(len(tokens) / config.tokens_per_second)
+                self._send_json(200, _non_streaming_response(config, tokens, request_id))
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            events = list(_events(config, tokens, request_id))
+            abort_at = len(events) // 2 if fail_mid_stream else None
+            try:
+                for i, event in enumerate(events):
+                    if i == abort_at:
+                        raise _StreamAborted()
+                    if i:
+                        time.sleep(1 / config.tokens_per_second)
+                    self._write_chunk(b"data: " + json.dumps(event).encode() + b"\n\n")
+                self._write_chunk(b"data: [DONE]\n\n")
+                self._write_chunk(b"")
+            except (_StreamAborted, BrokenPipeError, ConnectionResetError):
+                # Drop the connection without terminating the chunked body
+                self.close_connection = True
+
+    return MockServingHandler
+
+
+def serve(config, host="127.0.0.1", port=8900):
+    server = ThreadingHTTPServer((host, port), make_handler(config))
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--task", choices=TASK_TYPES, default="llm/v1/chat")
+    parser.add_argument("--ttft-ms", type=float, default=200, help="Delay before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=50)
+    parser.add_argument("--response-tokens", type=int, default=100)
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Fraction of requests rejected with HTTP 503")
+    parser.add_argument("--stream-error-rate", type=float, default=0.0,
+                        help="Fraction of streams dropped halfway through")
+    parser.add_argument("--tool-calls", action="store_true",
+                        help="Agent formats emit a tool call and tool output before the answer")
+    parser.add_argument("--responses-file",
+                        help="JSON lines file of answer strings to replay in order")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config = MockConfig(
+        task=args.task,
+        ttft_ms=args.ttft_ms,
+        tokens_per_second=args.tokens_per_second,
+        response_tokens=args.response_tokens,
+        error_rate=args.error_rate,
+        stream_error_rate=args.stream_error_rate,
+        tool_calls=args.tool_calls,
+        responses_file=args.responses_file,
+        seed=args.seed,
+    )
+    server = serve(config, args.host, args.port)
+    print(f"Mock {args.task} endpoint listening on http://{args.host}:{args.port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,22 @@
+import time
+import uuid
 import dash
-from dash import html, Input, Output, State, dcc
+from dash import html, Input, Output, State, dcc, Patch
 import dash_bootstrap_components as dbc
-from model_serving_utils import query_endpoint
+from conversation_store import ConversationStore
+from job_queue import job_cancelled
+from model_serving_utils import query_endpoint_stream
+
+# How often the browser polls for streamed output, and the server publishes it
+STREAM_POLL_INTERVAL_MS = 250
+STREAM_PUBLISH_INTERVAL_SECONDS = 0.1
 
 class DatabricksChatbot:
-    def __init__(self, app, endpoint_name, height='600px'):
+    def __init__(self, app, endpoint_name, height='600px', conversation_store=None):
         self.app = app
         self.endpoint_name = endpoint_name
         self.height = height
+        self.conversations = conversation_store or ConversationStore()
         self.layout = self._create_layout()
         self._create_callbacks()
         self._add_custom_css()
@@ -18,11 +27,15 @@ class DatabricksChatbot:
             html.Div([
                 "Note: this is a simple example. See ",
                 html.A("Databricks docs", href="https://docs.databricks.com/aws/en/generative-ai/agent-framework/chat-app", target="_blank"),
-                " for a more comprehensive example, with support for streaming output and more."
+                " for a more comprehensive example, with support for agent tool calls and more."
             ]),
             dbc.Card([
                 dbc.CardBody([
-                    html.Div(id='chat-history', className='chat-history'),
+                    html.Div([
+                        html.Div(id='chat-history', children=[]),
+                        # The reply being streamed, until it is added to the history
+                        html.Div(id='streaming-message'),
+                    ], id='chat-scroll', className='chat-history'),
                 ], className='d-flex flex-column chat-body')
             ], className='chat-card mb-3'),
             dbc.InputGroup([
@@ -31,93 +44,134 @@ class DatabricksChatbot:
                 dbc.Button('Clear', id='clear-button', color='danger', n_clicks=0, className='ms-2'),
             ], className='mb-3'),
             dcc.Store(id='assistant-trigger'),
-            dcc.Store(id='chat-history-store'),
+            # The conversation itself is kept on the server, under this id
+            dcc.Store(id='session-id', storage_type='session'),
             html.Div(id='dummy-output', style={'display': 'none'}),
         ], className='d-flex flex-column chat-container p-3')
 
     def _create_callbacks(self):
         @self.app.callback(
-            Output('chat-history-store', 'data', allow_duplicate=True),
+            Output('session-id', 'data'),
+            Output('chat-history', 'children', allow_duplicate=True),
+            Input('session-id', 'modified_timestamp'),
+            State('session-id', 'data'),
+            prevent_initial_call='initial_duplicate'
+        )
+        def init_session(modified_timestamp, session_id):
+            if session_id is None:
+                return str(uuid.uuid4()), []
+            # On page reload, show the conversation kept for this browser tab
+            return dash.no_update, self._format_chat_display(self.conversations.get(session_id))
+
+        @self.app.callback(
             Output('chat-history', 'children', allow_duplicate=True),
+            Output('streaming-message', 'children'),
             Output('user-input', 'value'),
             Output('assistant-trigger', 'data'),
             Input('send-button', 'n_clicks'),
             Input('user-input', 'n_submit'),
             State('user-input', 'value'),
-            State('chat-history-store', 'data'),
+            State('session-id', 'data'),
             prevent_initial_call=True
         )
-        def update_chat(send_clicks, user_submit, user_input, chat_history):
-            if not user_input:
+        def update_chat(send_clicks, user_submit, user_input, session_id):
+            if not user_input or not session_id:
                 return dash.no_update, dash.no_update, dash.no_update, dash.no_update
 
-            chat_history = chat_history or []
-            chat_history.append({'role': 'user', 'content': user_input})
-            chat_display = self._format_chat_display(chat_history)
-            chat_display.append(self._create_typing_indicator())
+            user_message = {'role': 'user', 'content': user_input}
+            self.conversations.append(session_id, user_message)
+            chat_display_patch = Patch()
+            chat_display_patch.append(self._format_message('user', user_input))
 
-            return chat_history, chat_display, '', {'trigger': True}
+            # The id makes every turn a distinct background job, even if two
+            # conversations are identical so far
+            trigger = {'session_id': session_id, 'id': str(uuid.uuid4())}
+            return chat_display_patch, self._create_typing_indicator(), '', trigger
 
         @self.app.callback(
-            Output('chat-history-store', 'data', allow_duplicate=True),
             Output('chat-history', 'children', allow_duplicate=True),
             Input('assistant-trigger', 'data'),
-            State('chat-history-store', 'data'),
+            # Runs in the background callback manager, publishing the partial
+            # reply through set_progress while tokens arrive
+            background=True,
+            progress=[Output('streaming-message', 'children')],
+            # Cleared when the job ends however it ends, as the reply is then in the history
+            progress_default=[None],
+            interval=STREAM_POLL_INTERVAL_MS,
             prevent_initial_call=True
         )
-        def process_assistant_response(trigger, chat_history):
-            if not trigger or not trigger.get('trigger'):
-                return dash.no_update, dash.no_update
+        def process_assistant_response(set_progress, trigger):
+            if not trigger or not trigger.get('session_id'):
+                return dash.no_update
 
-            chat_history = chat_history or []
-            if (not chat_history or not isinstance(chat_history[-1], dict)
-                    or 'role' not in chat_history[-1]
-                    or chat_history[-1]['role'] != 'user'):
-                return dash.no_update, dash.no_update
+            session_id = trigger['session_id']
+            chat_history = self.conversations.get(session_id)
+            if not chat_history or chat_history[-1]['role'] != 'user':
+                return dash.no_update
 
+            assistant_response = ''
+            stream = self._call_model_endpoint(chat_history)
             try:
-                assistant_response = self._call_model_endpoint(chat_history)
-                chat_history.append({
+                last_published = 0.0
+                for content in stream:
+                    if job_cancelled():
+                        # A newer turn or a page reload replaced this job
+                        stream.close()
+                        return dash.no_update
+                    assistant_response += content
+                    now = time.monotonic()
+                    if now - last_published >= STREAM_PUBLISH_INTERVAL_SECONDS:
+                        set_progress([self._format_message('assistant', assistant_response)])
+                        last_published = now
+                assistant_message = {
                     'role': 'assistant',
                     'content': assistant_response
-                })
+                }
             except Exception as e:
                 error_message = f'Error: {str(e)}'
                 print(error_message)  # Log the error for debugging
-                chat_history.append({
+                if assistant_response:
+                    error_message = f'{assistant_response}\n\n{error_message}'
+                assistant_message = {
                     'role': 'assistant',
                     'content': error_message
-                })
+                }
 
-            chat_display = self._format_chat_display(chat_history)
-            return chat_history, chat_display
+            self.conversations.append(session_id, assistant_message)
+            # Send only the new message to the browser
+            chat_display_patch = Patch()
+            chat_display_patch.append(self._format_message('assistant', assistant_message['content']))
+            return chat_display_patch
 
         @self.app.callback(
-            Output('chat-history-store', 'data', allow_duplicate=True),
             Output('chat-history', 'children', allow_duplicate=True),
             Input('clear-button', 'n_clicks'),
+            State('session-id', 'data'),
             prevent_initial_call=True
         )
-        def clear_chat(n_clicks):
+        def clear_chat(n_clicks, session_id):
             print('Clearing chat')
             if n_clicks:
-                return [], []
-            return dash.no_update, dash.no_update
+                self.conversations.clear(session_id)
+                return []
+            return dash.no_update
 
     def _call_model_endpoint(self, messages, max_tokens=128):
         try:
             print('Calling model endpoint...')
-            return query_endpoint(self.endpoint_name, messages, max_tokens)["content"]
+            yield from query_endpoint_stream(self.endpoint_name, messages, max_tokens)
         except Exception as e:
             print(f'Error calling model endpoint: {str(e)}')
             raise
 
+    def _format_message(self, role, content):
+        return html.Div([
+            html.Div(content, className=f"chat-message {role}-message")
+        ], className=f"message-container {role}-container")
+
     def _format_chat_display(self, chat_history):
         return [
-            html.Div([
-                html.Div(msg['content'],
-                         className=f"chat-message {msg['role']}-message")
-            ], className=f"message-container {msg['role']}-container")
+            self._format_message(msg['role'], msg['content'])
             for msg in chat_history if isinstance(msg, dict) and 'role' in msg
         ]
 
@@ -186,6 +240,7 @@ class DatabricksChatbot:
             border-radius: 20px;
             font-size: 16px;
             line-height: 1.4;
+            white-space: pre-wrap;
         }
         .user-message {
             background-color: #FF3621; /* Databricks Orange 600 */
@@ -246,15 +301,16 @@ class DatabricksChatbot:
 
         self.app.clientside_callback(
             """
-            function(children) {
-                var chatHistory = document.getElementById('chat-history');
-                if(chatHistory) {
-                    chatHistory.scrollTop = chatHistory.scrollHeight;
+            function(children, streamingChildren) {
+                var chatScroll = document.getElementById('chat-scroll');
+                if(chatScroll) {
+                    chatScroll.scrollTop = chatScroll.scrollHeight;
                 }
                 return '';
             }
             """,
             Output('dummy-output', 'children'),
             Input('chat-history', 'children'),
+            Input('streaming-message', 'children'),
             prevent_initial_call=True
         )
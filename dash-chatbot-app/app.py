@@ -1,9 +1,12 @@
 import os
 import dash
 import dash_bootstrap_components as dbc
+import diskcache
 from dash import html
 from DatabricksChatbot import DatabricksChatbot
+from job_queue import ThreadPoolJobManager
 from model_serving_utils import is_endpoint_supported
+from serving_metrics import start_metrics_exporter
 
 # Ensure environment variable is set correctly
 serving_endpoint = os.getenv('SERVING_ENDPOINT')
@@ -17,8 +20,17 @@ assert serving_endpoint, \
 # Check if the endpoint is supported
 endpoint_supported = is_endpoint_supported(serving_endpoint)
 
+# Expose streaming latency metrics on METRICS_PORT, if set
+start_metrics_exporter()
+
+# Background callbacks (used to stream responses) run on a thread pool and
+# share their progress and results with the polling browser through this cache
+background_callback_manager = ThreadPoolJobManager(
+    diskcache.Cache(os.getenv('DASH_CALLBACK_CACHE_DIR', './callback_cache')))
+
 # Initialize the Dash app with a clean theme
-app = dash.Dash(__name__, external_stylesheets=[dbc.themes.FLATLY])
+app = dash.Dash(__name__, external_stylesheets=[dbc.themes.FLATLY],
+                background_callback_manager=background_callback_manager)
 
 # Define the app layout based on endpoint support
 if not endpoint_supported:
@@ -0,0 +1,46 @@
+"""
+Server-side storage for chatbot conversations.
+
+The browser only keeps a session id; the messages of each session are kept
+here, in memory, so callbacks don't upload and download the whole
+conversation on every turn. Up to DASH_MAX_SESSIONS conversations (default
+1000) are kept, evicting the least recently used one.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+DASH_MAX_SESSIONS = int(os.getenv("DASH_MAX_SESSIONS", "1000"))
+
+
+class ConversationStore:
+    """Thread-safe LRU map from session id to that session's list of messages."""
+
+    def __init__(self, max_sessions=DASH_MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        """Return a copy of the messages of `session_id`, oldest first."""
+        with self._lock:
+            messages = self._sessions.get(session_id)
+            if messages is None:
+                return []
+            self._sessions.move_to_end(session_id)
+            return list(messages)
+
+    def append(self, session_id, message):
+        with self._lock:
+            messages = self._sessions.get(session_id)
+            if messages is None:
+                messages = self._sessions[session_id] = []
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            else:
+                self._sessions.move_to_end(session_id)
+            messages.append(message)
+
+    def clear(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
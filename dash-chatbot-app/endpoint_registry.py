@@ -0,0 +1,132 @@
+"""
+Process-wide cache of serving endpoint capabilities.
+
+The task type of an endpoint decides whether this template can query it and
+whether its answers may be cached. It is fetched from the control plane once
+per endpoint and reused for every chat turn; concurrent first lookups share
+a single request. A failed lookup is remembered for
+ENDPOINT_METADATA_ERROR_TTL_SECONDS (default 10) and raised again without a
+request. After ENDPOINT_METADATA_TTL_SECONDS (default 300) a stale entry is
+still returned immediately while a background thread refreshes it. Callers
+invalidate an entry when the endpoint rejects a query with a 4xx error, e.g.
+because it was redeployed with a different task type, so the next lookup
+refetches it.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from functools import lru_cache
+
+from databricks.sdk import WorkspaceClient
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_TASK_TYPES = ["agent/v1/chat", "agent/v2/chat", "llm/v1/chat"]
+
+
+@lru_cache(maxsize=1)
+def _get_workspace_client():
+    return WorkspaceClient()
+
+
+class EndpointRegistry:
+    """Thread-safe cache of endpoint task types with stale-while-revalidate refresh."""
+
+    def __init__(self, ttl_seconds=300, error_ttl_seconds=10):
+        self.ttl_seconds = ttl_seconds
+        self.error_ttl_seconds = error_ttl_seconds
+        self._entries = {}  # endpoint name -> (task type, fetched_at)
+        self._failures = {}  # endpoint name -> (error, failed_at)
+        self._fetching = {}  # endpoint name -> Future of the first lookup in flight
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def _fetch(self, endpoint_name):
+        task_type = _get_workspace_client().serving_endpoints.get(endpoint_name).task
+        with self._lock:
+            self._entries[endpoint_name] = (task_type, time.monotonic())
+        return task_type
+
+    def _refresh_in_background(self, endpoint_name):
+        try:
+            self._fetch(endpoint_name)
+        except Exception as e:
+            logger.warning(f"Failed to refresh task type of endpoint {endpoint_name}: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(endpoint_name)
+
+    def task_type(self, endpoint_name):
+        """Return the task type of `endpoint_name`, fetching it only if it isn't cached."""
+        with self._lock:
+            entry = self._entries.get(endpoint_name)
+            if entry is not None:
+                task_type, fetched_at = entry
+                if (time.monotonic() - fetched_at > self.ttl_seconds
+                        and endpoint_name not in self._refreshing):
+                    self._refreshing.add(endpoint_name)
+                    threading.Thread(
+                        target=self._refresh_in_background, args=(endpoint_name,), daemon=True
+                    ).start()
+                return task_type
+            failure = self._failures.get(endpoint_name)
+            if failure is not None and time.monotonic() - failure[1] <= self.error_ttl_seconds:
+                raise failure[0]
+            future = self._fetching.get(endpoint_name)
+            if future is None:
+                future = self._fetching[endpoint_name] = Future()
+                fetching = True
+            else:
+                fetching = False
+        if not fetching:
+            return future.result()
+
+        try:
+            task_type = self._fetch(endpoint_name)
+        except Exception as e:
+            with self._lock:
+                self._failures[endpoint_name] = (e, time.monotonic())
+                del self._fetching[endpoint_name]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._failures.pop(endpoint_name, None)
+            del self._fetching[endpoint_name]
+        future.set_result(task_type)
+        return task_type
+
+    def is_supported(self, endpoint_name):
+        return self.task_type(endpoint_name) in SUPPORTED_TASK_TYPES
+
+    def invalidate(self, endpoint_name):
+        with self._lock:
+            self._entries.pop(endpoint_name, None)
+            self._failures.pop(endpoint_name, None)
+
+
+def http_status_code(error):
+    """The HTTP status code of a failed serving request, or None if it got no response."""
+    response = getattr(error, "response", None)
+    status_code = getattr(response, "status_code", None) or getattr(error, "status_code", None)
+    return status_code if isinstance(status_code, int) else None
+
+
+def is_client_error(error):
+    """
+    Whether the serving endpoint rejected the request itself with an HTTP 4xx
+    error, which fails the same way every time. Rate limiting (429) is
+    transient, like server and connection errors, so it isn't one.
+    """
+    status_code = http_status_code(error)
+    return status_code is not None and 400 <= status_code < 500 and status_code != 429
+
+
+@lru_cache(maxsize=1)
+def get_endpoint_registry():
+    """Return the endpoint registry shared by all sessions of the app."""
+    return EndpointRegistry(
+        ttl_seconds=float(os.getenv("ENDPOINT_METADATA_TTL_SECONDS", "300")),
+        error_ttl_seconds=float(os.getenv("ENDPOINT_METADATA_ERROR_TTL_SECONDS", "10")),
+    )
@@ -0,0 +1,83 @@
+"""
+Background callback manager that runs jobs on a bounded thread pool.
+
+Dash's DiskcacheManager starts a new process for every background callback
+run. Generating a chat response mostly waits on the serving endpoint, so a
+thread is enough, and much cheaper to start. This manager queues jobs on a
+thread pool of DASH_JOB_WORKERS threads (default 32) in the server process
+and keeps progress and results in diskcache like DiskcacheManager. A Flask
+worker is then only busy for the few milliseconds it takes to submit a job or
+return its progress, so a handful of workers can serve many conversations.
+
+Jobs live in the process that started them, so the app must be served by a
+single (multi-threaded) process, as `app.run()` does.
+"""
+import itertools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from dash import DiskcacheManager
+
+DASH_JOB_WORKERS = int(os.getenv("DASH_JOB_WORKERS", "32"))
+
+_current_job = threading.local()
+
+
+def job_cancelled():
+    """Whether the background job running in this thread was cancelled by the client."""
+    cancelled = getattr(_current_job, "cancelled", None)
+    return cancelled is not None and cancelled.is_set()
+
+
+class ThreadPoolJobManager(DiskcacheManager):
+    def __init__(self, cache=None, max_workers=DASH_JOB_WORKERS, cache_by=None, expire=None):
+        super().__init__(cache, cache_by=cache_by, expire=expire)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="dash-job")
+        self._job_ids = itertools.count(1)
+        # job id -> (future, cancelled event) for queued and running jobs
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def call_job_fn(self, key, job_fn, args, context):
+        job = next(self._job_ids)
+        cancelled = threading.Event()
+
+        def run():
+            _current_job.cancelled = cancelled
+            try:
+                job_fn(key, self._make_progress_key(key), args, context)
+            finally:
+                _current_job.cancelled = None
+                with self._lock:
+                    self._jobs.pop(job, None)
+
+        with self._lock:
+            self._jobs[job] = (self._executor.submit(run), cancelled)
+        return job
+
+    def _get_job(self, job):
+        try:
+            job = int(job)
+        except (TypeError, ValueError):
+            return None
+        with self._lock:
+            return self._jobs.get(job)
+
+    def job_running(self, job):
+        # Queued jobs count as running, so the client keeps polling for them
+        return self._get_job(job) is not None
+
+    def terminate_job(self, job):
+        entry = self._get_job(job)
+        if entry is None:
+            return
+        future, cancelled = entry
+        # A queued job never starts; a running one stops at its next job_cancelled() check
+        cancelled.set()
+        if future.cancel():
+            with self._lock:
+                self._jobs.pop(int(job), None)
+
+    def terminate_unhealthy_job(self, job):
+        return False
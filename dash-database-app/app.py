@@ -1,142 +1,143 @@
-import dash
-from dash import html, dcc, Input, Output, State, callback_context
-import psycopg
-import os
-import time
-from databricks import sdk
-from psycopg import sql
-from psycopg_pool import ConnectionPool
-
-# Database connection setup
-workspace_client = sdk.WorkspaceClient()
-postgres_password = None
-last_password_refresh = 0
-connection_pool = None
-
-def refresh_oauth_token():
-    """Refresh OAuth token if expired."""
-    global postgres_password, last_password_refresh
-    if postgres_password is None or time.time() - last_password_refresh > 900:
-        print("Refreshing PostgreSQL OAuth token")
-        try:
-            postgres_password = workspace_client.config.oauth_token().access_token
-            last_password_refresh = time.time()
-        except Exception as e:
-            print(f"❌ Failed to refresh OAuth token: {str(e)}")
-            return False
-    return True
-
-def get_connection_pool():
-    """Get or create the connection pool."""
-    global connection_pool
-    if connection_pool is None:
-        refresh_oauth_token()
-        conn_string = (
-            f"dbname={os.getenv('PGDATABASE')} "
-            f"user={os.getenv('PGUSER')} "
-            f"password={postgres_password} "
-            f"host={os.getenv('PGHOST')} "
-            f"port={os.getenv('PGPORT')} "
-            f"sslmode={os.getenv('PGSSLMODE', 'require')} "
-            f"application_name={os.getenv('PGAPPNAME')}"
-        )
-        connection_pool = ConnectionPool(conn_string, min_size=2, max_size=10)
-    return connection_pool
-
-def get_connection():
-    """Get a connection from the pool."""
-    global connection_pool
-    
-    # Recreate pool if token expired
-    if postgres_password is None or time.time() - last_password_refresh > 900:
-        if connection_pool:
-            connection_pool.close()
-            connection_pool = None
-    
-    return get_connection_pool().connection()
-
-def get_schema_name():
-    """Get the schema name in the format {PGAPPNAME}_schema_{PGUSER}."""
-    pgappname = os.getenv("PGAPPNAME", "my_app")
-    pguser = os.getenv("PGUSER", "").replace('-', '')
-    return f"{pgappname}_schema_{pguser}"
+import base64
+import io
+import json
 
+import dash
+from dash import html, dcc, Input, Output, State, Patch, callback_context
+from flask import Response
+import db
 def init_database():
     """Initialize database schema and table."""
     try:
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                schema_name = get_schema_name()
-                
-                cur.execute(sql.SQL("CREATE SCHEMA IF NOT EXISTS {}").format(sql.Identifier(schema_name)))
-                cur.execute(sql.SQL("""
-                    CREATE TABLE IF NOT EXISTS {}.todos (
-                        id SERIAL PRIMARY KEY,
-                        task TEXT NOT NULL,
-                        completed BOOLEAN DEFAULT FALSE,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                """).format(sql.Identifier(schema_name)))
-                conn.commit()
-                return True
+        db.init_database()
+        return True
     except Exception as e:
         print(f"Database initialization error: {e}")
         return False
 
 def add_todo(task):
-    """Add a new todo item."""
+    """Add a new todo item and return it, or None on failure."""
     try:
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                schema = get_schema_name()
-                cur.execute(sql.SQL("INSERT INTO {}.todos (task) VALUES (%s)").format(sql.Identifier(schema)), (task.strip(),))
-                conn.commit()
-                return True
+        return db.add_todo(task)
     except Exception as e:
         print(f"Add todo error: {e}")
-        return False
+        return None
 
-def get_todos():
-    """Get all todo items."""
+def get_todos(cursor=None):
+    """Get a page of todo items and the cursor of the next page."""
     try:
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                schema = get_schema_name()
-                cur.execute(sql.SQL("SELECT id, task, completed, created_at FROM {}.todos ORDER BY created_at DESC").format(sql.Identifier(schema)))
-                return cur.fetchall()
+        return db.get_todos(cursor)
     except Exception as e:
         print(f"Get todos error: {e}")
-        return []
+        return [], None
 
-def toggle_todo(todo_id):
-    """Toggle the completed status of a todo item."""
+def set_todo_completed(todo_id, completed):
+    """Set the completed status of a todo item and return it, or None if nothing changed."""
     try:
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                schema = get_schema_name()
-                cur.execute(sql.SQL("UPDATE {}.todos SET completed = NOT completed WHERE id = %s").format(sql.Identifier(schema)), (todo_id,))
-                conn.commit()
-                return True
+        return db.set_todo_completed(todo_id, completed)
     except Exception as e:
         print(f"Toggle todo error: {e}")
-        return False
+        return None
 
 def delete_todo(todo_id):
-    """Delete a todo item."""
+    """Delete a todo item. Returns whether it was deleted."""
     try:
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                schema = get_schema_name()
-                cur.execute(sql.SQL("DELETE FROM {}.todos WHERE id = %s").format(sql.Identifier(schema)), (todo_id,))
-                conn.commit()
-                return True
+        return db.delete_todo(todo_id)
     except Exception as e:
         print(f"Delete todo error: {e}")
         return False
 
+# Comment sent on an idle event stream, so proxies don't close it
+EVENTS_KEEPALIVE_SECONDS = 15
+
+HIDDEN_STYLE = {'display': 'none'}
+BULK_BUTTON_STYLE = {
+    'padding': '6px 12px',
+    'backgroundColor': 'transparent',
+    'border': '1px solid #6c757d',
+    'borderRadius': '4px',
+    'cursor': 'pointer'
+}
+EMPTY_STYLE = {'textAlign': 'center', 'color': '#6c757d', 'fontStyle': 'italic'}
+LOAD_MORE_STYLE = {
+    'display': 'block',
+    'margin': '15px auto 0',
+    'padding': '8px 16px',
+    'backgroundColor': 'transparent',
+    'color': '#007bff',
+    'border': '1px solid #007bff',
+    'borderRadius': '4px',
+    'cursor': 'pointer'
+}
+
+def import_todos(contents):
+    """Add the todos in an uploaded CSV file and return how many were added, or None on failure."""
+    try:
+        data = base64.b64decode(contents.split(',', 1)[1]).decode('utf-8-sig')
+        return db.import_todos(io.StringIO(data, newline=''))
+    except Exception as e:
+        print(f"Import todos error: {e}")
+        return None
+
+def toggle_todos(todo_ids):
+    """Toggle several todo items and return the updated todos, or None on failure."""
+    try:
+        return db.toggle_todos(todo_ids)
+    except Exception as e:
+        print(f"Toggle todos error: {e}")
+        return None
+
+def delete_todos(todo_ids):
+    """Delete several todo items and return the deleted ids, or None on failure."""
+    try:
+        return db.delete_todos(todo_ids)
+    except Exception as e:
+        print(f"Delete todos error: {e}")
+        return None
+
+def complete_all():
+    """Complete all todo items and return the updated todos, or None on failure."""
+    try:
+        return db.complete_all()
+    except Exception as e:
+        print(f"Complete all error: {e}")
+        return None
+
+def clear_completed():
+    """Delete all completed todo items and return their ids, or None on failure."""
+    try:
+        return db.clear_completed()
+    except Exception as e:
+        print(f"Clear completed error: {e}")
+        return None
+
 # Initialize Dash app
 app = dash.Dash(__name__)
 
+@app.server.route('/health')
+def health():
+    """Connection pool statistics, for monitoring."""
+    return db.pool_stats()
+
+@app.server.route('/events')
+def todo_events():
+    """
+    Changes to the todos made by any user, as server-sent events. The
+    browser passes them on to the todo-events store (see assets/todo_events.js).
+    """
+    subscription = db.subscribe()
+
+    def stream():
+        while True:
+            events = subscription.get(timeout=EVENTS_KEEPALIVE_SECONDS)
+            if not events:
+                yield ": keepalive\n\n"
+            for event in events:
+                yield f"data: {json.dumps(event, default=str)}\n\n"
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 # Initialize database
 if not init_database():
     print("Failed to initialize database")
@@ -168,125 +169,300 @@ app.layout = html.Div([
     # Todo list section
     html.Div([
         html.H3("📋 Your Todos"),
-        html.Div(id='todos-container')
+        html.Div([
+            dcc.Upload(
+                html.Button('📥 Import CSV', style=BULK_BUTTON_STYLE),
+                id='import-upload',
+                accept='.csv,text/csv',
+                style={'display': 'inline-block'}
+            ),
+            html.Button('✓ Toggle selected', id='toggle-selected-button', n_clicks=0, style=BULK_BUTTON_STYLE),
+            html.Button('🗑️ Delete selected', id='delete-selected-button', n_clicks=0, style=BULK_BUTTON_STYLE),
+            html.Button('✓ Complete all', id='complete-all-button', n_clicks=0, style=BULK_BUTTON_STYLE),
+            html.Button('🧹 Clear completed', id='clear-completed-button', n_clicks=0, style=BULK_BUTTON_STYLE)
+        ], style={'display': 'flex', 'gap': '10px', 'marginBottom': '15px'}),
+        html.Div(id='todos-container', children=[]),
+        html.Div(
+            "🎉 No todos yet! Add one above to get started.",
+            id='todos-empty',
+            style=HIDDEN_STYLE
+        ),
+        html.Button(
+            'Load more',
+            id='load-more-button',
+            n_clicks=0,
+            style=HIDDEN_STYLE
+        )
     ]),
     
-    # Store for tracking changes
-    dcc.Store(id='todos-store')
+    # Cursor of the next page of todos
+    dcc.Store(id='todos-cursor'),
+    # Changes pushed by the server, and the number of the last one applied
+    dcc.Store(id='todo-events'),
+    dcc.Store(id='todo-events-applied', data=0)
 ], style={'maxWidth': '800px', 'margin': '0 auto', 'padding': '20px'})
 
 @app.callback(
-    Output('todos-store', 'data'),
+    [Output('todos-container', 'children'),
+     Output('todos-empty', 'style'),
+     Output('load-more-button', 'style'),
+     Output('todos-cursor', 'data'),
+     Output('new-todo-input', 'value'),
+     Output('add-todo-message', 'children')],
     [Input('add-todo-button', 'n_clicks'),
      Input('new-todo-input', 'n_submit'),
-     Input({'type': 'todo-checkbox', 'index': dash.ALL}, 'value'),
-     Input({'type': 'delete-button', 'index': dash.ALL}, 'n_clicks')],
-    [State('new-todo-input', 'value')],
+     Input({'type': 'todo-checkbox', 'index': dash.ALL, 'completed': dash.ALL}, 'value'),
+     Input({'type': 'delete-button', 'index': dash.ALL}, 'n_clicks'),
+     Input('load-more-button', 'n_clicks'),
+     Input('import-upload', 'contents'),
+     Input('complete-all-button', 'n_clicks'),
+     Input('clear-completed-button', 'n_clicks')],
+    [State('new-todo-input', 'value'),
+     State('todos-cursor', 'data')],
     prevent_initial_call=False
 )
-def manage_todos_store(add_clicks, submit_clicks, checkbox_values, delete_clicks, new_todo):
-    """Manage todos store - handles initial load, adding, toggling, and deleting todos."""
+def manage_todos(add_clicks, submit_clicks, checkbox_values, delete_clicks, load_more_clicks,
+                 import_contents, complete_all_clicks, clear_completed_clicks, new_todo, next_cursor):
+    """
+    Manage todos - renders the first page on initial load, then patches the
+    rendered list with the rows returned by each add, toggle or delete, and
+    appends the pages loaded with the load more button. Imports render the
+    first page again.
+    """
     ctx = callback_context
+    no_update = dash.no_update
     
     # Initial load - no triggers
     if not ctx.triggered:
-        return get_todos()
+        return first_page() + (no_update, no_update)
     
     triggered_id = ctx.triggered[0]['prop_id'].split('.')[0]
+    triggered_value = ctx.triggered[0]['value']
+    children = Patch()
+    
+    # Append the next page
+    if triggered_id == 'load-more-button':
+        if next_cursor:
+            todos, next_cursor = get_todos(next_cursor)
+            children.extend([render_todo(todo) for todo in todos])
+            return children, no_update, load_more_style(next_cursor), next_cursor, no_update, no_update
     
     # Handle adding new todo (both button click and Enter key)
-    if (triggered_id == 'add-todo-button' or triggered_id == 'new-todo-input') and new_todo and new_todo.strip():
-        if add_todo(new_todo.strip()):
-            return get_todos()
+    elif (triggered_id == 'add-todo-button' or triggered_id == 'new-todo-input') and new_todo and new_todo.strip():
+        todo = add_todo(new_todo.strip())
+        if todo:
+            children.prepend(render_todo(todo))
+            return children, HIDDEN_STYLE, no_update, no_update, "", no_update
+    
+    # Import a CSV file
+    elif triggered_id == 'import-upload' and import_contents:
+        count = import_todos(import_contents)
+        if count is None:
+            return no_update, no_update, no_update, no_update, no_update, "❌ Failed to import todos."
+        return first_page() + (no_update, f"✅ Imported {count} todos!")
+    
+    # Complete all todos, including the ones not loaded yet
+    elif triggered_id == 'complete-all-button':
+        todos = complete_all()
+        if todos is None:
+            return no_update, no_update, no_update, no_update, no_update, "❌ Failed to complete todos."
+        positions = {todo_id: i for i, todo_id in enumerate(rendered_ids(ctx.inputs_list[2]))}
+        for todo in todos:
+            if todo[0] in positions:
+                children[positions[todo[0]]] = render_todo(todo)
+        return children, no_update, no_update, no_update, no_update, ""
+    
+    # Delete all completed todos, including the ones not loaded yet
+    elif triggered_id == 'clear-completed-button':
+        deleted = clear_completed()
+        if deleted is None:
+            return no_update, no_update, no_update, no_update, no_update, "❌ Failed to clear completed todos."
+        deleted = set(deleted)
+        todo_ids = rendered_ids(ctx.inputs_list[3])
+        # Delete from the end so the positions of the remaining rows don't shift
+        for i in reversed(range(len(todo_ids))):
+            if todo_ids[i] in deleted:
+                del children[i]
+        remaining = sum(todo_id not in deleted for todo_id in todo_ids)
+        return children, empty_style(remaining or next_cursor), no_update, no_update, no_update, ""
     
-    # Handle checkbox toggle
+    # Handle checkbox toggle. Rendering a checkbox also triggers this callback,
+    # with the status it was rendered with, which must not be written back as
+    # it may be stale by now; only a click changes the value from its id's.
     elif 'todo-checkbox' in triggered_id:
         import json
         try:
             id_dict = json.loads(triggered_id)
             todo_id = id_dict['index']
-            if toggle_todo(todo_id):
-                return get_todos()
+            if bool(triggered_value) == id_dict['completed']:
+                return no_update, no_update, no_update, no_update, no_update, no_update
+            todo = set_todo_completed(todo_id, bool(triggered_value))
+            if todo:
+                children[todo_position(ctx.inputs_list[2], todo_id)] = render_todo(todo)
+                return children, no_update, no_update, no_update, no_update, no_update
         except:
             pass
     
-    # Handle delete
-    elif 'delete-button' in triggered_id:
+    # Handle delete, only for an actual click
+    elif 'delete-button' in triggered_id and triggered_value:
         import json
         try:
             id_dict = json.loads(triggered_id)
             todo_id = id_dict['index']
             if delete_todo(todo_id):
-                return get_todos()
+                del children[todo_position(ctx.inputs_list[3], todo_id)]
+                remaining = len(ctx.inputs_list[3]) - 1
+                return children, empty_style(remaining or next_cursor), no_update, no_update, no_update, no_update
         except:
             pass
     
-    return dash.no_update
+    return no_update, no_update, no_update, no_update, no_update, no_update
 
 @app.callback(
-    [Output('todos-container', 'children'),
-     Output('add-todo-message', 'children'),
-     Output('new-todo-input', 'value')],
-    [Input('todos-store', 'data'),
-     Input('add-todo-button', 'n_clicks'),
-     Input('new-todo-input', 'n_submit')],
-    [State('new-todo-input', 'value')]
+    [Output('todos-container', 'children', allow_duplicate=True),
+     Output('todos-empty', 'style', allow_duplicate=True),
+     Output('load-more-button', 'style', allow_duplicate=True),
+     Output('todos-cursor', 'data', allow_duplicate=True),
+     Output('todo-events-applied', 'data')],
+    Input('todo-events', 'data'),
+    [State({'type': 'delete-button', 'index': dash.ALL}, 'id'),
+     State('todos-cursor', 'data'),
+     State('todo-events-applied', 'data')],
+    prevent_initial_call=True
 )
-def update_todos_display(todos_data, add_clicks, submit_clicks, new_todo):
-    """Update the display of todos and handle add todo messages."""
-    ctx = callback_context
-    triggered_id = ctx.triggered[0]['prop_id'].split('.')[0] if ctx.triggered else None
+def apply_todo_events(events, rendered, next_cursor, applied):
+    """Patch the rendered todos with the changes pushed by the server, e.g. made by other users."""
+    no_update = dash.no_update
+    events = [event for event in events or [] if event['seq'] > applied]
+    if not events:
+        return no_update, no_update, no_update, no_update, no_update
+    applied = events[-1]['seq']
+    if any(event['op'] == 'RELOAD' for event in events):
+        return first_page() + (applied,)
     
-    # Handle adding new todo message and clear input (both button click and Enter key)
-    if (triggered_id == 'add-todo-button' or triggered_id == 'new-todo-input') and new_todo and new_todo.strip():
-        # Clear the input field after adding
-        return display_todos(todos_data), "", ""
-    
-    return display_todos(todos_data), "", ""
+    # Our own changes come back too, so applying a change twice must be harmless
+    todo_ids = [item['index'] for item in rendered]
+    children = Patch()
+    for event in events:
+        if event['op'] == 'DELETE':
+            for todo_id in event['ids']:
+                if todo_id in todo_ids:
+                    position = todo_ids.index(todo_id)
+                    del children[position]
+                    del todo_ids[position]
+        for todo in event.get('todos', []):
+            if todo[0] in todo_ids:
+                children[todo_ids.index(todo[0])] = render_todo(todo)
+            elif event['op'] == 'INSERT':
+                children.prepend(render_todo(todo))
+                todo_ids.insert(0, todo[0])
+    return children, empty_style(todo_ids or next_cursor), no_update, no_update, applied
 
-def display_todos(todos_data):
-    """Display todos in the UI."""
-    if not todos_data:
-        return html.Div("🎉 No todos yet! Add one above to get started.", 
-                       style={'textAlign': 'center', 'color': '#6c757d', 'fontStyle': 'italic'})
+@app.callback(
+    [Output('todos-container', 'children', allow_duplicate=True),
+     Output('todos-empty', 'style', allow_duplicate=True),
+     Output('add-todo-message', 'children', allow_duplicate=True)],
+    [Input('toggle-selected-button', 'n_clicks'),
+     Input('delete-selected-button', 'n_clicks')],
+    [State({'type': 'todo-select', 'index': dash.ALL}, 'value'),
+     State('todos-cursor', 'data')],
+    prevent_initial_call=True
+)
+def manage_selected_todos(toggle_clicks, delete_clicks, selections, next_cursor):
+    """Toggle or delete the todos selected with their select boxes."""
+    todo_ids = rendered_ids(callback_context.states_list[0])
+    selected = [todo_id for todo_id, value in zip(todo_ids, selections) if value]
+    if not selected:
+        return dash.no_update, dash.no_update, "Please select some todos."
+    children = Patch()
+    
+    if callback_context.triggered_id == 'toggle-selected-button':
+        todos = toggle_todos(selected)
+        if todos is None:
+            return dash.no_update, dash.no_update, "❌ Failed to update todos."
+        for todo in todos:
+            children[todo_ids.index(todo[0])] = render_todo(todo)
+        return children, dash.no_update, f"✅ Updated {len(todos)} todos!"
     
-    todo_items = []
-    for todo_id, task, completed, created_at in todos_data:
-        todo_item = html.Div([
-            html.Div([
-                # Checkbox
+    deleted = delete_todos(selected)
+    if deleted is None:
+        return dash.no_update, dash.no_update, "❌ Failed to delete todos."
+    deleted = set(deleted)
+    # Delete from the end so the positions of the remaining rows don't shift
+    for i in reversed(range(len(todo_ids))):
+        if todo_ids[i] in deleted:
+            del children[i]
+    remaining = sum(todo_id not in deleted for todo_id in todo_ids)
+    return children, empty_style(remaining or next_cursor), f"✅ Deleted {len(deleted)} todos!"
+
+def first_page():
+    """Rendered first page of todos, with the styles and cursor that go with it."""
+    todos, next_cursor = get_todos()
+    return ([render_todo(todo) for todo in todos], empty_style(todos or next_cursor),
+            load_more_style(next_cursor), next_cursor)
+
+def rendered_ids(inputs):
+    """Ids of the rendered todos, in order, from the inputs of their components."""
+    return [item['id']['index'] for item in inputs]
+
+def todo_position(inputs, todo_id):
+    """Position of a todo in the rendered list, from the inputs of its components."""
+    return rendered_ids(inputs).index(todo_id)
+
+def empty_style(has_todos):
+    """Show the empty state message when there are no todos, loaded or not."""
+    return HIDDEN_STYLE if has_todos else EMPTY_STYLE
+
+def load_more_style(next_cursor):
+    """Show the load more button while there are more todos to load."""
+    return LOAD_MORE_STYLE if next_cursor else HIDDEN_STYLE
+
+def render_todo(todo):
+    """Render a todo item."""
+    todo_id, task, completed, created_at = todo
+    return html.Div([
+        html.Div([
+            # Selects the todo for "Toggle selected" and "Delete selected"
+            html.Span(
                 dcc.Checklist(
-                    id={'type': 'todo-checkbox', 'index': todo_id},
-                    options=[{'label': '', 'value': 'completed'}],
-                    value=['completed'] if completed else [],
-                    style={'display': 'inline-block', 'marginRight': '10px'}
-                ),
-                # Task text
-                html.Span(
-                    task,
-                    style={
-                        'textDecoration': 'line-through' if completed else 'none',
-                        'color': '#6c757d' if completed else 'black',
-                        'flex': '1'
-                    }
+                    id={'type': 'todo-select', 'index': todo_id},
+                    options=[{'label': '', 'value': 'selected'}],
+                    value=[]
                 ),
-                # Delete button
-                html.Button(
-                    "🗑️",
-                    id={'type': 'delete-button', 'index': todo_id},
-                    style={
-                        'backgroundColor': 'transparent',
-                        'border': 'none',
-                        'fontSize': '16px',
-                        'cursor': 'pointer',
-                        'marginLeft': '10px'
-                    }
-                )
-            ], style={'display': 'flex', 'alignItems': 'center', 'padding': '10px', 'borderBottom': '1px solid #eee'})
-        ])
-        todo_items.append(todo_item)
-    
-    return todo_items
+                title='Select',
+                style={'display': 'inline-block', 'marginRight': '10px', 'paddingRight': '10px',
+                       'borderRight': '1px solid #eee'}
+            ),
+            # Checkbox, whose id records the status it was rendered with
+            dcc.Checklist(
+                id={'type': 'todo-checkbox', 'index': todo_id, 'completed': completed},
+                options=[{'label': '', 'value': 'completed'}],
+                value=['completed'] if completed else [],
+                style={'display': 'inline-block', 'marginRight': '10px'}
+            ),
+            # Task text
+            html.Span(
+                task,
+                style={
+                    'textDecoration': 'line-through' if completed else 'none',
+                    'color': '#6c757d' if completed else 'black',
+                    'flex': '1'
+                }
+            ),
+            # Delete button
+            html.Button(
+                "🗑️",
+                id={'type': 'delete-button', 'index': todo_id},
+                style={
+                    'backgroundColor': 'transparent',
+                    'border': 'none',
+                    'fontSize': '16px',
+                    'cursor': 'pointer',
+                    'marginLeft': '10px'
+                }
+            )
+        ], style={'display': 'flex', 'alignItems': 'center', 'padding': '10px', 'borderBottom': '1px solid #eee'})
+    ])
 
 if __name__ == '__main__':
-    app.run_server(debug=True)
\ No newline at end of file
+    app.run_server(debug=True)
@@ -0,0 +1,28 @@
+// Push changes to the todos made by any user into the todo-events store, as
+// the server sends them. The latest events are sent again with each new one,
+// numbered, so none is lost if Dash only runs the callback for the latest
+// value of the store; the callback skips the ones it already applied.
+(function () {
+  const MAX_EVENTS = 100;
+  let seq = 0;
+  let events = [];
+  let connected = false;
+
+  function push(event) {
+    event.seq = ++seq;
+    events = events.concat([event]).slice(-MAX_EVENTS);
+    try {
+      window.dash_clientside.set_props("todo-events", { data: events });
+    } catch (error) {
+      // The layout isn't rendered yet; the events are sent with the next one
+    }
+  }
+
+  const source = new EventSource("events");
+  source.onopen = () => {
+    // Changes made while reconnecting were missed
+    if (connected) push({ op: "RELOAD" });
+    connected = true;
+  };
+  source.onmessage = (message) => push(JSON.parse(message.data));
+})();
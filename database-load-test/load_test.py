@@ -0,0 +1,383 @@
+"""
+Load generator for the database app templates.
+
+Runs a Flask or Dash database app in-process against Postgres and drives it
+from N concurrent threads for --duration seconds. Each request lists the
+todos, adds, toggles or deletes one, picked at random with the weights of
+--mix. The Flask app is driven through its routes (/, /add, /toggle/<id>,
+/delete/<id>), the Dash app through its todo callback, like the browser
+does. The report gives throughput, latency percentiles, the time requests
+waited for a pooled connection and the database round trips (statements,
+commits and COPYs) per request, overall and per operation.
+
+The app's WorkspaceClient is replaced with a stub whose oauth_token()
+returns a static token, so no Databricks workspace is needed. With
+--start-postgres a throwaway server is created with initdb and pg_ctl (from
+PATH or --pg-bin; initdb refuses to run as root) whose password is that
+token. Otherwise the PG* variables point at an existing server, and
+--token (default: PGPASSWORD) is its password.
+
+The todos live in the schema of PGAPPNAME (default "load_test"), which is
+emptied and filled with --todos rows before the run.
+
+Usage:
+    python load_test.py --app ../flask-database-app --start-postgres --threads 20 --todos 10000
+    python load_test.py --app ../dash-database-app --threads 50 --mix list=80,add=10,toggle=10
+"""
+import argparse
+import functools
+import importlib
+import json
+import os
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+
+USER = "load_test"
+OPERATIONS = ["list", "add", "toggle", "delete"]
+
+_round_trips = threading.local()
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[idx]
+
+
+def _summarize(values):
+    if not values:
+        return {}
+    return {
+        "mean": statistics.fmean(values),
+        "p50": _percentile(values, 50),
+        "p95": _percentile(values, 95),
+        "p99": _percentile(values, 99),
+        "max": max(values),
+    }
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_postgres(pg_bin, token):
+    """Create and start a Postgres server in a temporary directory; returns a function that removes it."""
+    def tool(name):
+        return os.path.join(pg_bin, name) if pg_bin else name
+
+    base_dir = tempfile.mkdtemp(prefix="database-load-test-")
+    data_dir = os.path.join(base_dir, "data")
+    pwfile = os.path.join(base_dir, "pwfile")
+    with open(pwfile, "w") as f:
+        f.write(token)
+    subprocess.run([tool("initdb"), "-D", data_dir, "-U", USER, "--auth=scram-sha-256", f"--pwfile={pwfile}"],
+                   check=True, stdout=subprocess.DEVNULL)
+    port = _free_port()
+    subprocess.run([tool("pg_ctl"), "-D", data_dir, "-l", os.path.join(base_dir, "postgres.log"), "-w",
+                    "-o", f"-p {port} -k {base_dir} -c listen_addresses='' -c max_connections=200", "start"],
+                   check=True, stdout=subprocess.DEVNULL)
+    os.environ.update({
+        "PGHOST": base_dir,
+        "PGPORT": str(port),
+        "PGUSER": USER,
+        "PGDATABASE": "postgres",
+        "PGSSLMODE": "disable",
+    })
+
+    def stop():
+        subprocess.run([tool("pg_ctl"), "-D", data_dir, "-m", "fast", "stop"], stdout=subprocess.DEVNULL)
+        shutil.rmtree(base_dir, ignore_errors=True)
+
+    return stop
+
+
+def stub_workspace_client(token):
+    """Make the databricks SDK hand out `token` as the OAuth token, without a workspace."""
+    import databricks.sdk
+
+    class StaticTokenWorkspaceClient:
+        def __init__(self, *args, **kwargs):
+            self.config = types.SimpleNamespace(
+                oauth_token=lambda: types.SimpleNamespace(access_token=token))
+
+    databricks.sdk.WorkspaceClient = StaticTokenWorkspaceClient
+
+
+def count_round_trips():
+    """
+    Count the statements, COPYs, commits and rollbacks sent to the server by
+    the current thread. Commits and rollbacks outside a transaction are free
+    and aren't counted.
+    """
+    import psycopg
+    from psycopg.pq import TransactionStatus
+
+    def counted(method, in_transaction_only=False):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not in_transaction_only or self.info.transaction_status != TransactionStatus.IDLE:
+                _round_trips.count = getattr(_round_trips, "count", 0) + 1
+            return method(self, *args, **kwargs)
+        return wrapper
+
+    psycopg.Cursor.execute = counted(psycopg.Cursor.execute)
+    psycopg.Cursor.executemany = counted(psycopg.Cursor.executemany)
+    psycopg.Cursor.copy = counted(psycopg.Cursor.copy)
+    psycopg.Connection.commit = counted(psycopg.Connection.commit, in_transaction_only=True)
+    psycopg.Connection.rollback = counted(psycopg.Connection.rollback, in_transaction_only=True)
+
+
+def seed_todos(db, count):
+    """Empty the todos table, add `count` todos and return their ids."""
+    from psycopg import sql
+
+    with db.get_connection() as conn:
+        conn.execute(sql.SQL("TRUNCATE {}.todos RESTART IDENTITY").format(sql.Identifier(db.get_schema_name())))
+        conn.commit()
+    db.import_todos(f"todo {i},{'true' if i % 3 == 0 else 'false'}" for i in range(count))
+    with db.get_connection() as conn:
+        rows = conn.execute(sql.SQL("SELECT id FROM {}.todos").format(sql.Identifier(db.get_schema_name())))
+        return [todo_id for todo_id, in rows]
+
+
+class TodoIds:
+    """Ids of the todos that exist, to pick the targets of toggles and deletes from."""
+
+    def __init__(self, ids):
+        self._ids = list(ids)
+        self._lock = threading.Lock()
+
+    def pick(self, rng):
+        with self._lock:
+            # Past the end of the dataset, the target doesn't exist
+            return rng.choice(self._ids) if self._ids else 0
+
+    def take(self, rng):
+        with self._lock:
+            if not self._ids:
+                return 0
+            i = rng.randrange(len(self._ids))
+            self._ids[i], self._ids[-1] = self._ids[-1], self._ids[i]
+            return self._ids.pop()
+
+
+class FlaskUser:
+    """Uses the Flask app through its routes, like the HTML page does."""
+
+    def __init__(self, app, ids):
+        # Without cookies, flashed messages don't pile up in the session
+        self.client = app.test_client(use_cookies=False)
+        self.ids = ids
+
+    def request(self, operation, rng):
+        if operation == "list":
+            response = self.client.get("/")
+        elif operation == "add":
+            response = self.client.post("/add", data={"task": f"load test {rng.random()}"})
+        elif operation == "toggle":
+            response = self.client.get(f"/toggle/{self.ids.pick(rng)}")
+        else:
+            response = self.client.get(f"/delete/{self.ids.take(rng)}")
+        return response.status_code
+
+
+class DashUser:
+    """Uses the Dash app through its todo callback, like the browser does."""
+
+    OUTPUTS = [
+        ("todos-container", "children"),
+        ("todos-empty", "style"),
+        ("load-more-button", "style"),
+        ("todos-cursor", "data"),
+        ("new-todo-input", "value"),
+        ("add-todo-message", "children"),
+    ]
+
+    def __init__(self, app, ids):
+        self.client = app.server.test_client(use_cookies=False)
+        self.ids = ids
+
+    def _callback(self, changed=None, add_clicks=None, new_todo=None, todo=None):
+        """
+        Body of a manage_todos call. `todo` is the (id, completed, delete clicks)
+        of the one rendered todo the call sees; `changed` the id and property
+        of the triggering input, if any.
+        """
+        checkboxes, deletes = [], []
+        if todo is not None:
+            todo_id, completed, delete_clicks = todo
+            checkboxes.append({"id": {"index": todo_id, "type": "todo-checkbox"}, "property": "value",
+                               "value": ["completed"] if completed else []})
+            deletes.append({"id": {"index": todo_id, "type": "delete-button"}, "property": "n_clicks",
+                            "value": delete_clicks})
+        return {
+            "output": "..{}..".format("...".join(f"{id_}.{prop}" for id_, prop in self.OUTPUTS)),
+            "outputs": [{"id": id_, "property": prop} for id_, prop in self.OUTPUTS],
+            "inputs": [
+                {"id": "add-todo-button", "property": "n_clicks", "value": add_clicks},
+                {"id": "new-todo-input", "property": "n_submit", "value": None},
+                checkboxes,
+                deletes,
+                {"id": "load-more-button", "property": "n_clicks", "value": None},
+                {"id": "import-upload", "property": "contents", "value": None},
+                {"id": "complete-all-button", "property": "n_clicks", "value": None},
+                {"id": "clear-completed-button", "property": "n_clicks", "value": None},
+            ],
+            "state": [
+                {"id": "new-todo-input", "property": "value", "value": new_todo},
+                {"id": "todos-cursor", "property": "data", "value": None},
+            ],
+            "changedPropIds": [changed] if changed else [],
+        }
+
+    def request(self, operation, rng):
+        if operation == "list":
+            body = self._callback()
+        elif operation == "add":
+            body = self._callback("add-todo-button.n_clicks", add_clicks=1, new_todo=f"load test {rng.random()}")
+        elif operation == "toggle":
+            todo_id = self.ids.pick(rng)
+            completed = rng.random() < 0.5
+            body = self._callback(json.dumps({"index": todo_id, "type": "todo-checkbox"}, separators=(",", ":"))
+                                  + ".value", todo=(todo_id, completed, None))
+        else:
+            todo_id = self.ids.take(rng)
+            body = self._callback(json.dumps({"index": todo_id, "type": "delete-button"}, separators=(",", ":"))
+                                  + ".n_clicks", todo=(todo_id, False, 1))
+        return self.client.post("/_dash-update-component", json=body).status_code
+
+
+def run_load_test(make_user, threads, duration, mix):
+    operations, weights = zip(*mix.items())
+    results = []
+    errors = []
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def simulate(user_idx):
+        rng = random.Random(user_idx)
+        user = make_user()
+        while time.monotonic() < deadline:
+            operation = rng.choices(operations, weights)[0]
+            _round_trips.count = 0
+            start = time.perf_counter()
+            try:
+                status = user.request(operation, rng)
+            except Exception as e:
+                with lock:
+                    errors.append(f"{operation}: {e}")
+                continue
+            latency = time.perf_counter() - start
+            with lock:
+                if status >= 400:
+                    errors.append(f"{operation}: HTTP {status}")
+                else:
+                    results.append({"operation": operation, "latency": latency,
+                                    "round_trips": _round_trips.count})
+
+    workers = [threading.Thread(target=simulate, args=(i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return results, errors
+
+
+def _parse_mix(mix):
+    weights = {}
+    for item in mix.split(","):
+        operation, _, weight = item.partition("=")
+        if operation not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation {operation!r}, expected one of {OPERATIONS}")
+        weights[operation] = float(weight or 1)
+    return weights
+
+
+def _stats(results, wall):
+    return {
+        "requests": len(results),
+        "requests_per_second": len(results) / wall if wall else None,
+        "latency_ms": {k: v * 1000 for k, v in _summarize([r["latency"] for r in results]).items()},
+        "round_trips_per_request": statistics.fmean(r["round_trips"] for r in results) if results else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", required=True, help="Path to the flask-database-app or dash-database-app template")
+    parser.add_argument("--threads", type=int, default=10, help="Concurrent simulated users")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds to run for")
+    parser.add_argument("--todos", type=int, default=1000, help="Todos in the table when the run starts")
+    parser.add_argument("--mix", type=_parse_mix, default="list=70,add=10,toggle=15,delete=5",
+                        help="Weights of the operations, as name=weight pairs")
+    parser.add_argument("--start-postgres", action="store_true",
+                        help="Run a throwaway local Postgres instead of the one the PG* variables point at")
+    parser.add_argument("--pg-bin", help="Directory with initdb and pg_ctl, if they aren't on PATH")
+    parser.add_argument("--token", default=os.getenv("PGPASSWORD", "load-test-token"),
+                        help="Static OAuth token, used as the Postgres password")
+    parser.add_argument("--json", help="Write the report to this file as JSON")
+    args = parser.parse_args()
+
+    app_dir = os.path.abspath(args.app)
+    os.environ.setdefault("PGAPPNAME", "load_test")
+    stop_postgres = start_postgres(args.pg_bin, args.token) if args.start_postgres else None
+    try:
+        stub_workspace_client(args.token)
+        count_round_trips()
+        sys.path.insert(0, app_dir)
+        # Importing the app initializes the database
+        app = importlib.import_module("app").app
+        db = importlib.import_module("db")
+        ids = TodoIds(seed_todos(db, args.todos))
+        user_class = DashUser if hasattr(app, "server") else FlaskUser
+        make_user = lambda: user_class(app, ids)
+
+        stats_start = db.pool_stats()
+        start = time.perf_counter()
+        results, errors = run_load_test(make_user, args.threads, args.duration, args.mix)
+        wall = time.perf_counter() - start
+        stats_end = db.pool_stats()
+    finally:
+        if stop_postgres:
+            stop_postgres()
+
+    pool_wait_ms = stats_end.get("requests_wait_ms", 0) - stats_start.get("requests_wait_ms", 0)
+    report = {
+        "app": os.path.basename(app_dir),
+        "threads": args.threads,
+        "todos": args.todos,
+        "errors": len(errors),
+        "wall_seconds": wall,
+        **_stats(results, wall),
+        "pool_wait_ms_per_request": pool_wait_ms / len(results) if results else None,
+        "pool_requests_queued": stats_end.get("requests_queued", 0) - stats_start.get("requests_queued", 0),
+        "pool_size": stats_end.get("pool_size"),
+        "todo_cache_hits": stats_end.get("todo_cache_hits", 0) - stats_start.get("todo_cache_hits", 0),
+        "todo_cache_misses": stats_end.get("todo_cache_misses", 0) - stats_start.get("todo_cache_misses", 0),
+        "operations": {
+            operation: _stats([r for r in results if r["operation"] == operation], wall)
+            for operation in args.mix
+        },
+    }
+    print(json.dumps(report, indent=2))
+    if errors:
+        print(f"First errors: {errors[:5]}", file=sys.stderr)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
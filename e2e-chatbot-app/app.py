@@ -8,7 +8,11 @@ from model_serving_utils import (
     _get_endpoint_task_type,
 )
 from collections import OrderedDict
+from functools import partial
 from messages import UserMessage, AssistantResponse, render_message
+from chat_history import ChatHistory, context_window_policy_from_env
+from streaming import ChatAgentMessageAccumulator, RenderScheduler, stream_with_recovery
+from serving_metrics import RENDER_SECONDS, start_metrics_exporter
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -23,74 +27,23 @@ assert SERVING_ENDPOINT, \
 
 ENDPOINT_SUPPORTS_FEEDBACK = endpoint_supports_feedback(SERVING_ENDPOINT)
 
-def reduce_chat_agent_chunks(chunks):
-    """
-    Reduce a list of ChatAgentChunk objects corresponding to a particular
-    message into a single ChatAgentMessage
-    """
-    deltas = [chunk.delta for chunk in chunks]
-    first_delta = deltas[0]
-    result_msg = first_delta
-    msg_contents = []
-    
-    # Accumulate tool calls properly
-    tool_call_map = {}  # Map call_id to tool call for accumulation
-    
-    for delta in deltas:
-        # Handle content
-        if delta.content:
-            msg_contents.append(delta.content)
-            
-        # Handle tool calls
-        if hasattr(delta, 'tool_calls') and delta.tool_calls:
-            for tool_call in delta.tool_calls:
-                call_id = getattr(tool_call, 'id', None)
-                tool_type = getattr(tool_call, 'type', "function")
-                function_info = getattr(tool_call, 'function', None)
-                if function_info:
-                    func_name = getattr(function_info, 'name', "")
-                    func_args = getattr(function_info, 'arguments', "")
-                else:
-                    func_name = ""
-                    func_args = ""
-                
-                if call_id:
-                    if call_id not in tool_call_map:
-                        # New tool call
-                        tool_call_map[call_id] = {
-                            "id": call_id,
-                            "type": tool_type,
-                            "function": {
-                                "name": func_name,
-                                "arguments": func_args
-                            }
-                        }
-                    else:
-                        # Accumulate arguments for existing tool call
-                        existing_args = tool_call_map[call_id]["function"]["arguments"]
-                        tool_call_map[call_id]["function"]["arguments"] = existing_args + func_args
-
-                        # Update function name if provided
-                        if func_name:
-                            tool_call_map[call_id]["function"]["name"] = func_name
-
-        # Handle tool call IDs (for tool response messages)
-        if hasattr(delta, 'tool_call_id') and delta.tool_call_id:
-            result_msg = result_msg.model_copy(update={"tool_call_id": delta.tool_call_id})
-    
-    # Convert tool call map back to list
-    if tool_call_map:
-        accumulated_tool_calls = list(tool_call_map.values())
-        result_msg = result_msg.model_copy(update={"tool_calls": accumulated_tool_calls})
-    
-    result_msg = result_msg.model_copy(update={"content": "".join(msg_contents)})
-    return result_msg
-
+# Expose latency metrics on METRICS_PORT, if set
+start_metrics_exporter()
 
+# Number of most recent history elements re-rendered on each rerun
+MAX_RENDERED_MESSAGES = int(os.getenv("MAX_RENDERED_MESSAGES", "100"))
+# Upper bound on UI updates per second while a response is streaming
+STREAM_RENDER_FPS = float(os.getenv("STREAM_RENDER_FPS", "15"))
+# Streaming retries (with exponential backoff) before falling back to a non-streaming query
+STREAM_MAX_RETRIES = int(os.getenv("STREAM_MAX_RETRIES", "3"))
+CONTINUATION_PROMPT = (
+    "Your previous answer was cut off. Continue it exactly where it stopped, "
+    "without repeating any of it."
+)
 
 # --- Init state ---
 if "history" not in st.session_state:
-    st.session_state.history = []
+    st.session_state.history = ChatHistory(policy=context_window_policy_from_env())
 
 st.title("🧱 Chatbot App")
 st.write(f"A basic chatbot using your own serving endpoint.")
@@ -99,8 +52,7 @@ st.write(f"Endpoint name: `{SERVING_ENDPOINT}`")
 
 
 # --- Render chat history ---
-for i, element in enumerate(st.session_state.history):
-    element.render(i)
+st.session_state.history.render(max_rendered=MAX_RENDERED_MESSAGES)
 
 def query_endpoint_and_render(task_type, input_messages):
     """Handle streaming response based on task type."""
@@ -112,49 +64,95 @@ def query_endpoint_and_render(task_type, input_messages):
         return query_chat_completions_endpoint_and_render(input_messages)
 
 
+def stream_and_render(input_messages, handle_event, resume_prefix, status_area):
+    """
+    Stream a response for `input_messages` into `handle_event`, retrying
+    from the received output on errors. Returns False if streaming failed
+    for good and the caller should fall back to a non-streaming query.
+    """
+    def open_stream(prefix):
+        return query_endpoint_stream(
+            endpoint_name=SERVING_ENDPOINT,
+            messages=input_messages + prefix,
+            return_traces=ENDPOINT_SUPPORTS_FEEDBACK
+        )
+
+    def show_retry(attempt, delay, error):
+        status_area.markdown(
+            f"_Connection interrupted, retrying ({attempt}/{STREAM_MAX_RETRIES}) in {delay:.1f}s..._"
+        )
+
+    succeeded = stream_with_recovery(
+        open_stream,
+        handle_event,
+        resume_prefix,
+        max_retries=STREAM_MAX_RETRIES,
+        on_retry=show_retry,
+    )
+    status_area.empty()
+    return succeeded
+
+
+def query_endpoint_without_streaming_and_render(input_messages, response_area):
+    """Last-resort fallback once streaming retries are exhausted."""
+    response_area.markdown("_Ran into an error. Retrying without streaming..._")
+    messages, request_id = query_endpoint(
+        endpoint_name=SERVING_ENDPOINT,
+        messages=input_messages,
+        return_traces=ENDPOINT_SUPPORTS_FEEDBACK
+    )
+    response_area.empty()
+    with response_area.container():
+        for message in messages:
+            render_message(message)
+    return AssistantResponse(messages=messages, request_id=request_id)
+
+
 def query_chat_completions_endpoint_and_render(input_messages):
     """Handle ChatCompletions streaming format."""
     with st.chat_message("assistant"):
         response_area = st.empty()
         response_area.markdown("_Thinking..._")
+        status_area = st.empty()
         
         accumulated_content = ""
         request_id = None
-        
-        try:
-            for chunk in query_endpoint_stream(
-                endpoint_name=SERVING_ENDPOINT,
-                messages=input_messages,
-                return_traces=ENDPOINT_SUPPORTS_FEEDBACK
-            ):
-                if "choices" in chunk and chunk["choices"]:
-                    delta = chunk["choices"][0].get("delta", {})
-                    content = delta.get("content", "")
-                    if content:
-                        accumulated_content += content
-                        response_area.markdown(accumulated_content)
-                
-                if "databricks_output" in chunk:
-                    req_id = chunk["databricks_output"].get("databricks_request_id")
-                    if req_id:
-                        request_id = req_id
+        scheduler = RenderScheduler(max_fps=STREAM_RENDER_FPS)
+
+        def render_content():
+            response_area.markdown(accumulated_content)
+
+        def handle_chunk(chunk):
+            nonlocal accumulated_content, request_id
+            if "choices" in chunk and chunk["choices"]:
+                delta = chunk["choices"][0].get("delta", {})
+                content = delta.get("content", "")
+                if content:
+                    accumulated_content += content
+                    scheduler.update("content", render_content)
             
-            return AssistantResponse(
-                messages=[{"role": "assistant", "content": accumulated_content}],
-                request_id=request_id
-            )
-        except Exception:
-            response_area.markdown("_Ran into an error. Retrying without streaming..._")
-            messages, request_id = query_endpoint(
-                endpoint_name=SERVING_ENDPOINT,
-                messages=input_messages,
-                return_traces=ENDPOINT_SUPPORTS_FEEDBACK
-            )
-            response_area.empty()
-            with response_area.container():
-                for message in messages:
-                    render_message(message)
-            return AssistantResponse(messages=messages, request_id=request_id)
+            if "databricks_output" in chunk:
+                req_id = chunk["databricks_output"].get("databricks_request_id")
+                if req_id:
+                    request_id = req_id
+
+        def resume_prefix():
+            # Ask the model to continue the partial answer rather than regenerate it
+            if not accumulated_content:
+                return []
+            return [
+                {"role": "assistant", "content": accumulated_content},
+                {"role": "user", "content": CONTINUATION_PROMPT},
+            ]
+        
+        if not stream_and_render(input_messages, handle_chunk, resume_prefix, status_area):
+            return query_endpoint_without_streaming_and_render(input_messages, response_area)
+
+        scheduler.flush()
+        return AssistantResponse(
+            messages=[{"role": "assistant", "content": accumulated_content}],
+            request_id=request_id
+        )
 
 
 def query_chat_agent_endpoint_and_render(input_messages):
@@ -164,57 +162,57 @@ def query_chat_agent_endpoint_and_render(input_messages):
     with st.chat_message("assistant"):
         response_area = st.empty()
         response_area.markdown("_Thinking..._")
+        messages_area = st.container()
+        status_area = st.empty()
         
         message_buffers = OrderedDict()
         request_id = None
-        
-        try:
-            for raw_chunk in query_endpoint_stream(
-                endpoint_name=SERVING_ENDPOINT,
-                messages=input_messages,
-                return_traces=ENDPOINT_SUPPORTS_FEEDBACK
-            ):
+        scheduler = RenderScheduler(max_fps=STREAM_RENDER_FPS)
+
+        def render_partial_message(msg_info):
+            with msg_info["render_area"].container():
+                render_message(msg_info["accumulator"].materialize())
+
+        def handle_chunk(raw_chunk):
+            nonlocal request_id
+            chunk = ChatAgentChunk.model_validate(raw_chunk)
+            delta = chunk.delta
+            message_id = delta.id
+
+            req_id = raw_chunk.get("databricks_output", {}).get("databricks_request_id")
+            if req_id:
+                request_id = req_id
+            if not message_buffers:
                 response_area.empty()
-                chunk = ChatAgentChunk.model_validate(raw_chunk)
-                delta = chunk.delta
-                message_id = delta.id
+            if message_id not in message_buffers:
+                message_buffers[message_id] = {
+                    "accumulator": ChatAgentMessageAccumulator(delta),
+                    "render_area": messages_area.empty(),
+                }
+            else:
+                message_buffers[message_id]["accumulator"].add(delta)
 
-                req_id = raw_chunk.get("databricks_output", {}).get("databricks_request_id")
-                if req_id:
-                    request_id = req_id
-                if message_id not in message_buffers:
-                    message_buffers[message_id] = {
-                        "chunks": [],
-                        "render_area": st.empty(),
-                    }
-                message_buffers[message_id]["chunks"].append(chunk)
-                
-                partial_message = reduce_chat_agent_chunks(message_buffers[message_id]["chunks"])
-                render_area = message_buffers[message_id]["render_area"]
-                message_content = partial_message.model_dump_compat(exclude_none=True)
-                with render_area.container():
-                    render_message(message_content)
-            
-            messages = []
-            for msg_id, msg_info in message_buffers.items():
-                messages.append(reduce_chat_agent_chunks(msg_info["chunks"]))
-            
-            return AssistantResponse(
-                messages=[message.model_dump_compat(exclude_none=True) for message in messages],
-                request_id=request_id
-            )
-        except Exception:
-            response_area.markdown("_Ran into an error. Retrying without streaming..._")
-            messages, request_id = query_endpoint(
-                endpoint_name=SERVING_ENDPOINT,
-                messages=input_messages,
-                return_traces=ENDPOINT_SUPPORTS_FEEDBACK
-            )
-            response_area.empty()
-            with response_area.container():
-                for message in messages:
-                    render_message(message)
-            return AssistantResponse(messages=messages, request_id=request_id)
+            scheduler.update(message_id, partial(render_partial_message, message_buffers[message_id]))
+
+        def resume_prefix():
+            # Messages before the last one are complete; the last one may have
+            # been cut off, so drop it and let the agent continue from the rest
+            if message_buffers:
+                message_id, msg_info = message_buffers.popitem()
+                scheduler.discard(message_id)
+                msg_info["render_area"].empty()
+            return [msg_info["accumulator"].materialize() for msg_info in message_buffers.values()]
+        
+        if not stream_and_render(input_messages, handle_chunk, resume_prefix, status_area):
+            for msg_info in message_buffers.values():
+                msg_info["render_area"].empty()
+            return query_endpoint_without_streaming_and_render(input_messages, response_area)
+
+        scheduler.flush()
+        return AssistantResponse(
+            messages=[msg_info["accumulator"].materialize() for msg_info in message_buffers.values()],
+            request_id=request_id
+        )
 
 
 def query_responses_endpoint_and_render(input_messages):
@@ -224,93 +222,90 @@ def query_responses_endpoint_and_render(input_messages):
     with st.chat_message("assistant"):
         response_area = st.empty()
         response_area.markdown("_Thinking..._")
+        status_area = st.empty()
         
         # Track all the messages that need to be rendered in order
         all_messages = []
+        rendered_count = 0
+        messages_container = None
         request_id = None
 
-        try:
-            for raw_event in query_endpoint_stream(
-                endpoint_name=SERVING_ENDPOINT,
-                messages=input_messages,
-                return_traces=ENDPOINT_SUPPORTS_FEEDBACK
-            ):
-                # Extract databricks_output for request_id
-                if "databricks_output" in raw_event:
-                    req_id = raw_event["databricks_output"].get("databricks_request_id")
-                    if req_id:
-                        request_id = req_id
+        def handle_event(raw_event):
+            nonlocal rendered_count, messages_container, request_id
+            # Extract databricks_output for request_id
+            if "databricks_output" in raw_event:
+                req_id = raw_event["databricks_output"].get("databricks_request_id")
+                if req_id:
+                    request_id = req_id
+            
+            # Parse using MLflow streaming event types, similar to ChatAgentChunk
+            if "type" in raw_event:
+                event = ResponsesAgentStreamEvent.model_validate(raw_event)
                 
-                # Parse using MLflow streaming event types, similar to ChatAgentChunk
-                if "type" in raw_event:
-                    event = ResponsesAgentStreamEvent.model_validate(raw_event)
+                if hasattr(event, 'item') and event.item:
+                    item = event.item  # This is a dict, not a parsed object
                     
-                    if hasattr(event, 'item') and event.item:
-                        item = event.item  # This is a dict, not a parsed object
+                    if item.get("type") == "message":
+                        # Extract text content from message if present
+                        content_parts = item.get("content", [])
+                        for content_part in content_parts:
+                            if content_part.get("type") == "output_text":
+                                text = content_part.get("text", "")
+                                if text:
+                                    all_messages.append({
+                                        "role": "assistant",
+                                        "content": text
+                                    })
                         
-                        if item.get("type") == "message":
-                            # Extract text content from message if present
-                            content_parts = item.get("content", [])
-                            for content_part in content_parts:
-                                if content_part.get("type") == "output_text":
-                                    text = content_part.get("text", "")
-                                    if text:
-                                        all_messages.append({
-                                            "role": "assistant",
-                                            "content": text
-                                        })
-                            
-                        elif item.get("type") == "function_call":
-                            # Tool call
-                            call_id = item.get("call_id")
-                            function_name = item.get("name")
-                            arguments = item.get("arguments", "")
-                            
-                            # Add to messages for history
-                            all_messages.append({
-                                "role": "assistant",
-                                "content": "",
-                                "tool_calls": [{
-                                    "id": call_id,
-                                    "type": "function",
-                                    "function": {
-                                        "name": function_name,
-                                        "arguments": arguments
-                                    }
-                                }]
-                            })
-                            
-                        elif item.get("type") == "function_call_output":
-                            # Tool call output/result
-                            call_id = item.get("call_id")
-                            output = item.get("output", "")
-                            
-                            # Add to messages for history
-                            all_messages.append({
-                                "role": "tool",
-                                "content": output,
-                                "tool_call_id": call_id
-                            })
-                
-                # Update the display by rendering all accumulated messages
-                if all_messages:
-                    with response_area.container():
-                        for msg in all_messages:
-                            render_message(msg)
+                    elif item.get("type") == "function_call":
+                        # Tool call
+                        call_id = item.get("call_id")
+                        function_name = item.get("name")
+                        arguments = item.get("arguments", "")
+                        
+                        # Add to messages for history
+                        all_messages.append({
+                            "role": "assistant",
+                            "content": "",
+                            "tool_calls": [{
+                                "id": call_id,
+                                "type": "function",
+                                "function": {
+                                    "name": function_name,
+                                    "arguments": arguments
+                                }
+                            }]
+                        })
+                        
+                    elif item.get("type") == "function_call_output":
+                        # Tool call output/result
+                        call_id = item.get("call_id")
+                        output = item.get("output", "")
+                        
+                        # Add to messages for history
+                        all_messages.append({
+                            "role": "tool",
+                            "content": output,
+                            "tool_call_id": call_id
+                        })
+            
+            # Completed items never change, so only render the new ones
+            if rendered_count < len(all_messages):
+                if messages_container is None:
+                    messages_container = response_area.container()
+                with RENDER_SECONDS.time(), messages_container:
+                    for msg in all_messages[rendered_count:]:
+                        render_message(msg)
+                rendered_count = len(all_messages)
+
+        def resume_prefix():
+            # Output items are only emitted once complete, so all of them can be kept
+            return list(all_messages)
+
+        if not stream_and_render(input_messages, handle_event, resume_prefix, status_area):
+            return query_endpoint_without_streaming_and_render(input_messages, response_area)
 
-            return AssistantResponse(messages=all_messages, request_id=request_id)
-        except Exception:
-            response_area.markdown("_Ran into an error. Retrying without streaming..._")
-            messages, request_id = query_endpoint(
-                endpoint_name=SERVING_ENDPOINT,
-                messages=input_messages,
-                return_traces=ENDPOINT_SUPPORTS_FEEDBACK
-            )
-            response_area.empty()
-            with response_area.container():
-                for message in messages:
-                    render_message(message)
-            return AssistantResponse(messages=messages, request_id=request_id)
+        return AssistantResponse(messages=all_messages, request_id=request_id)
 
 
 
@@ -326,8 +321,8 @@ if prompt:
     st.session_state.history.append(user_msg)
     user_msg.render(len(st.session_state.history) - 1)
 
-    # Convert history to standard chat message format for the query methods
-    input_messages = [msg for elem in st.session_state.history for msg in elem.to_input_messages()]
+    # Standard chat message format for the query methods, bounded by the context-window policy
+    input_messages = st.session_state.history.input_messages()
     
     # Handle the response using the appropriate handler
     assistant_response = query_endpoint_and_render(task_type, input_messages)
@@ -0,0 +1,250 @@
+"""
+Conversation history store for the chatbot application.
+
+Like the message classes, the store lives in its own module so that the
+instance kept in st.session_state remains valid across Streamlit reruns.
+
+The store keeps the flattened list of model input messages up to date as
+turns are appended, records an estimated token count for every message, and
+delegates the choice of which messages are sent to the endpoint to a
+pluggable context-window policy.
+"""
+import os
+from abc import ABC, abstractmethod
+
+import streamlit as st
+
+from messages import UserMessage
+from model_serving_utils import ChatMessage
+
+# Rough heuristic used by most tokenizers for English text; good enough to
+# keep request payloads within a budget without pulling in a tokenizer.
+CHARS_PER_TOKEN = 4
+# Per-message overhead for role markers and separators.
+MESSAGE_TOKEN_OVERHEAD = 4
+
+
+def estimate_tokens(message):
+    """Estimate the number of tokens a chat-format message dict will consume."""
+    chars = len(message.get("content") or "")
+    for call in message.get("tool_calls") or []:
+        function = call.get("function", {})
+        chars += len(function.get("name") or "") + len(function.get("arguments") or "")
+    return MESSAGE_TOKEN_OVERHEAD + (chars + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+class ContextWindowPolicy(ABC):
+    """Decide which turns of the conversation are sent to the endpoint."""
+
+    @abstractmethod
+    def select(self, history):
+        """
+        Return the list of chat-format messages to send for `history`.
+
+        Implementations should only ever cut the conversation at the start of
+        a user turn, so that tool calls and their tool responses stay together.
+        """
+        pass
+
+
+class FullHistoryPolicy(ContextWindowPolicy):
+    """Send the whole conversation (the behaviour without a context window)."""
+
+    def select(self, history):
+        return history.flat_messages()
+
+
+class TruncatePolicy(ContextWindowPolicy):
+    """Send the most recent turns that fit within `max_tokens`."""
+
+    def __init__(self, max_tokens):
+        self.max_tokens = max_tokens
+
+    def select(self, history):
+        start = history.window_start(max_tokens=self.max_tokens)
+        return history.flat_messages(start)
+
+
+class SlidingWindowPolicy(ContextWindowPolicy):
+    """Send only the last `max_turns` user turns and their responses."""
+
+    def __init__(self, max_turns):
+        self.max_turns = max_turns
+
+    def select(self, history):
+        start = history.window_start(max_turns=self.max_turns)
+        return history.flat_messages(start)
+
+
+def extractive_summary(previous_summary, messages, max_chars_per_message=200, max_chars=4000):
+    """
+    Summarize `messages` without calling a model, by keeping the beginning of
+    every user and assistant message. Tool traffic is dropped, and the oldest
+    lines are discarded once the summary exceeds `max_chars`.
+    """
+    lines = [previous_summary] if previous_summary else []
+    for msg in messages:
+        content = (msg.get("content") or "").strip()
+        if msg["role"] not in ("user", "assistant") or not content:
+            continue
+        if len(content) > max_chars_per_message:
+            content = content[:max_chars_per_message].rstrip() + "..."
+        lines.append(f"{msg['role']}: {content}")
+    summary = "\n".join(lines)
+    if len(summary) > max_chars:
+        summary = summary[-max_chars:].split("\n", 1)[-1]
+    return summary
+
+
+class SummarizeOldestPolicy(ContextWindowPolicy):
+    """
+    Keep the most recent turns that fit within `max_tokens` and replace
+    everything older with a single summary message.
+
+    `summarize(previous_summary, messages)` is called only with the turns that
+    fell out of the window since the last call, so each turn is summarized once.
+    """
+
+    def __init__(self, max_tokens, summarize=extractive_summary):
+        self.max_tokens = max_tokens
+        self.summarize = summarize
+        self._summary = ""
+        self._summarized_until = 0
+
+    def select(self, history):
+        summary_budget = estimate_tokens({"content": self._summary})
+        start = history.window_start(max_tokens=max(self.max_tokens - summary_budget, 0))
+        start = max(start, self._summarized_until)
+        if start > self._summarized_until:
+            dropped = history.flat_messages(self._summarized_until, start)
+            self._summary = self.summarize(self._summary, dropped)
+            self._summarized_until = start
+
+        messages = history.flat_messages(start)
+        if not self._summary:
+            return messages
+        summary_message = {
+            "role": "system",
+            "content": f"Summary of the earlier conversation:\n{self._summary}",
+        }
+        return [summary_message] + messages
+
+
+def context_window_policy_from_env():
+    """
+    Build the context-window policy configured through environment variables:
+
+    - CONTEXT_WINDOW_POLICY: one of "truncate" (default), "sliding_window",
+      "summarize_oldest" or "none".
+    - CONTEXT_WINDOW_MAX_TOKENS: token budget for "truncate" and
+      "summarize_oldest" (default 32000).
+    - CONTEXT_WINDOW_MAX_TURNS: number of user turns for "sliding_window"
+      (default 20).
+    """
+    policy = os.getenv("CONTEXT_WINDOW_POLICY", "truncate").lower()
+    max_tokens = int(os.getenv("CONTEXT_WINDOW_MAX_TOKENS", "32000"))
+    max_turns = int(os.getenv("CONTEXT_WINDOW_MAX_TURNS", "20"))
+    if policy == "truncate":
+        return TruncatePolicy(max_tokens)
+    elif policy == "sliding_window":
+        return SlidingWindowPolicy(max_turns)
+    elif policy == "summarize_oldest":
+        return SummarizeOldestPolicy(max_tokens)
+    elif policy == "none":
+        return FullHistoryPolicy()
+    raise ValueError(f"Unknown CONTEXT_WINDOW_POLICY '{policy}'")
+
+
+class ChatHistory:
+    """
+    Append-only store of UserMessage and AssistantResponse elements.
+
+    The flattened chat-format message list and per-message token counts are
+    maintained incrementally, so adding a turn costs O(size of the turn)
+    rather than O(history).
+    """
+
+    def __init__(self, policy=None):
+        self.policy = policy or FullHistoryPolicy()
+        self._elements = []
+        # Flattened model input messages and their estimated token counts
+        self._messages = []
+        self._token_counts = []
+        self._total_tokens = 0
+        # Offset into self._messages at which each element starts
+        self._offsets = []
+
+    def __len__(self):
+        return len(self._elements)
+
+    def __iter__(self):
+        return iter(self._elements)
+
+    def __getitem__(self, idx):
+        return self._elements[idx]
+
+    def append(self, element):
+        """Add a UserMessage or AssistantResponse to the conversation."""
+        self._offsets.append(len(self._messages))
+        self._elements.append(element)
+        for msg in element.to_input_messages():
+            # ChatMessage memoizes the message's ResponsesAgent conversion
+            if not isinstance(msg, ChatMessage):
+                msg = ChatMessage(msg, position=len(self._messages))
+            self._messages.append(msg)
+            tokens = estimate_tokens(msg)
+            self._token_counts.append(tokens)
+            self._total_tokens += tokens
+
+    @property
+    def total_tokens(self):
+        return self._total_tokens
+
+    def token_counts(self):
+        """Return the estimated token count of every flattened message."""
+        return list(self._token_counts)
+
+    def flat_messages(self, start=0, end=None):
+        """Return flattened chat-format messages in [start, end)."""
+        return self._messages[start:end]
+
+    def window_start(self, max_tokens=None, max_turns=None):
+        """
+        Walk back from the newest element and return the message offset of
+        the oldest user turn that still fits within the given limits. The
+        newest user turn is always included.
+        """
+        start = len(self._messages)
+        tokens = 0
+        turns = 0
+        for idx in range(len(self._elements) - 1, -1, -1):
+            offset = self._offsets[idx]
+            end = self._offsets[idx + 1] if idx + 1 < len(self._offsets) else len(self._messages)
+            tokens += sum(self._token_counts[offset:end])
+            if not isinstance(self._elements[idx], UserMessage):
+                continue
+            turns += 1
+            if start < len(self._messages):
+                if max_tokens is not None and tokens > max_tokens:
+                    break
+                if max_turns is not None and turns > max_turns:
+                    break
+            start = offset
+        return start
+
+    def input_messages(self):
+        """Return the messages to send to the endpoint for the next turn."""
+        return self.policy.select(self)
+
+    def render(self, max_rendered=None):
+        """
+        Render the conversation, limited to the `max_rendered` most recent
+        elements. Elements keep their absolute index so feedback widget keys
+        remain stable as older elements are hidden.
+        """
+        first = 0
+        if max_rendered is not None and len(self._elements) > max_rendered:
+            first = len(self._elements) - max_rendered
+            st.caption(f"{first} earlier messages hidden")
+        for i in range(first, len(self._elements)):
+            self._elements[i].render(i)
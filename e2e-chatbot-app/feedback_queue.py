@@ -0,0 +1,139 @@
+"""
+Background queue for submitting feedback on assistant responses.
+
+Rating a response only appends to an in-memory queue and a local spool
+file, so the Streamlit callback returns immediately. A worker thread batches
+queued ratings into one `dataframe_records` request per endpoint, flushing
+every FEEDBACK_FLUSH_INTERVAL_SECONDS or as soon as FEEDBACK_BATCH_SIZE
+ratings are waiting. Failed batches are retried with exponential backoff,
+and ratings still in the spool file when the app restarts are resent.
+"""
+import json
+import logging
+import os
+import threading
+import uuid
+from functools import lru_cache
+
+from model_serving_utils import feedback_record, submit_feedback_records
+
+logger = logging.getLogger(__name__)
+
+FEEDBACK_FLUSH_INTERVAL_SECONDS = float(os.getenv("FEEDBACK_FLUSH_INTERVAL_SECONDS", "5"))
+FEEDBACK_BATCH_SIZE = int(os.getenv("FEEDBACK_BATCH_SIZE", "50"))
+# Ratings are dropped after this many failed submissions
+FEEDBACK_MAX_ATTEMPTS = int(os.getenv("FEEDBACK_MAX_ATTEMPTS", "10"))
+FEEDBACK_SPOOL_PATH = os.getenv("FEEDBACK_SPOOL_PATH", "feedback_spool.jsonl")
+MAX_BACKOFF_SECONDS = 300
+
+
+class FeedbackQueue:
+    def __init__(self, submit=submit_feedback_records, spool_path=FEEDBACK_SPOOL_PATH,
+                 flush_interval=FEEDBACK_FLUSH_INTERVAL_SECONDS, batch_size=FEEDBACK_BATCH_SIZE,
+                 max_attempts=FEEDBACK_MAX_ATTEMPTS):
+        self._submit = submit
+        self._spool_path = spool_path
+        self._flush_interval = flush_interval
+        self._batch_size = batch_size
+        self._max_attempts = max_attempts
+        self._condition = threading.Condition()
+        # Entries are {"id", "endpoint", "record", "attempts"}, oldest first
+        self._pending = self._load_spool()
+        self._consecutive_failures = 0
+        self._worker = threading.Thread(target=self._run, name="feedback-queue", daemon=True)
+        self._worker.start()
+
+    def _load_spool(self):
+        if not self._spool_path or not os.path.exists(self._spool_path):
+            return []
+        entries = []
+        with open(self._spool_path) as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # A partially written last line from a crash
+                    continue
+        if entries:
+            logger.info(f"Resending {len(entries)} spooled feedback ratings")
+        return entries
+
+    def _rewrite_spool(self):
+        """Replace the spool file with the pending entries. Caller holds the lock."""
+        if not self._spool_path:
+            return
+        tmp_path = f"{self._spool_path}.tmp"
+        with open(tmp_path, "w") as f:
+            for entry in self._pending:
+                f.write(json.dumps(entry) + "\n")
+        os.replace(tmp_path, self._spool_path)
+
+    def put(self, endpoint, request_id, rating):
+        """Queue a rating for submission; never blocks on the network."""
+        entry = {
+            "id": str(uuid.uuid4()),
+            "endpoint": endpoint,
+            "record": feedback_record(request_id, rating),
+            "attempts": 0,
+        }
+        with self._condition:
+            self._pending.append(entry)
+            if self._spool_path:
+                with open(self._spool_path, "a") as f:
+                    f.write(json.dumps(entry) + "\n")
+            if len(self._pending) >= self._batch_size:
+                self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                backoff = min(self._flush_interval * 2 ** self._consecutive_failures, MAX_BACKOFF_SECONDS)
+                self._condition.wait(timeout=backoff)
+            self.flush()
+
+    def flush(self):
+        """Submit all pending ratings, one batched request per endpoint."""
+        with self._condition:
+            pending = list(self._pending)
+        if not pending:
+            return
+
+        batches = []
+        by_endpoint = {}
+        for entry in pending:
+            by_endpoint.setdefault(entry["endpoint"], []).append(entry)
+        for endpoint, entries in by_endpoint.items():
+            for i in range(0, len(entries), self._batch_size):
+                batches.append((endpoint, entries[i:i + self._batch_size]))
+
+        done = set()
+        failed = set()
+        for endpoint, entries in batches:
+            try:
+                self._submit(endpoint, [entry["record"] for entry in entries])
+                done.update(entry["id"] for entry in entries)
+            except Exception as e:
+                logger.warning(f"Failed to submit {len(entries)} feedback ratings to {endpoint}: {e}")
+                failed.update(entry["id"] for entry in entries)
+
+        with self._condition:
+            remaining = []
+            for entry in self._pending:
+                if entry["id"] in done:
+                    continue
+                if entry["id"] in failed:
+                    entry["attempts"] += 1
+                    if entry["attempts"] >= self._max_attempts:
+                        logger.error(f"Dropping feedback for request {entry['record']['request_id']} "
+                                     f"after {entry['attempts']} attempts")
+                        continue
+                remaining.append(entry)
+            self._pending = remaining
+            self._consecutive_failures = self._consecutive_failures + 1 if failed else 0
+            self._rewrite_spool()
+
+
+@lru_cache(maxsize=1)
+def get_feedback_queue():
+    """Return the feedback queue shared by all sessions of the app."""
+    return FeedbackQueue()
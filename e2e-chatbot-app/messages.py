@@ -10,6 +10,8 @@ from abc import ABC, abstractmethod
 
 
 class Message(ABC):
+    __slots__ = ()
+
     def __init__(self):
         pass
 
@@ -25,6 +27,8 @@ class Message(ABC):
 
 
 class UserMessage(Message):
+    __slots__ = ("content",)
+
     def __init__(self, content):
         super().__init__()
         self.content = content
@@ -41,6 +45,8 @@ class UserMessage(Message):
 
 
 class AssistantResponse(Message):
+    __slots__ = ("messages", "request_id")
+
     def __init__(self, messages, request_id):
         super().__init__()
         self.messages = messages
@@ -80,13 +86,14 @@ def render_message(msg):
 @st.fragment
 def render_assistant_message_feedback(i, request_id):
     """Render feedback UI for assistant messages."""
-    from model_serving_utils import submit_feedback
+    from feedback_queue import get_feedback_queue
     import os
     
     def save_feedback(index):
         serving_endpoint = os.getenv('SERVING_ENDPOINT')
         if serving_endpoint:
-            submit_feedback(
+            # Submitted in the background so the click doesn't wait on the network
+            get_feedback_queue().put(
                 endpoint=serving_endpoint,
                 request_id=request_id,
                 rating=st.session_state[f"feedback_{index}"]
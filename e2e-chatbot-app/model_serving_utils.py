@@ -1,82 +1,275 @@
 from mlflow.deployments import get_deploy_client
 from databricks.sdk import WorkspaceClient
+from functools import lru_cache
 import json
+import os
+import threading
+import time
 import uuid
+from concurrent.futures import Future
 
 import logging
 
+from response_cache import get_response_cache
+from serving_metrics import ENDPOINT_LOOKUP_SECONDS, instrument_stream
+
 logging.basicConfig(
     format="%(levelname)s [%(asctime)s] %(name)s - %(message)s",
     datefmt="%Y-%m-%d %H:%M:%S",
     level=logging.DEBUG
 )
 
+logger = logging.getLogger(__name__)
+
+# Streaming transport: "async" uses the pooled asyncio client in serving_client,
+# "mlflow" uses the MLflow deployments client's blocking predict_stream
+SERVING_STREAM_CLIENT = os.getenv("SERVING_STREAM_CLIENT", "async").lower()
+
+# How long endpoint metadata is served from cache before it is refreshed
+ENDPOINT_METADATA_TTL_SECONDS = float(os.getenv("ENDPOINT_METADATA_TTL_SECONDS", "300"))
+# How long a failed lookup is remembered, so an unreachable control plane isn't asked on every request
+ENDPOINT_METADATA_ERROR_TTL_SECONDS = float(os.getenv("ENDPOINT_METADATA_ERROR_TTL_SECONDS", "10"))
+
+@lru_cache(maxsize=1)
+def _get_workspace_client() -> WorkspaceClient:
+    """Return the WorkspaceClient shared by all sessions of the app."""
+    return WorkspaceClient()
+
+@lru_cache(maxsize=1)
+def _get_deploy_client():
+    """Return the MLflow deployments client shared by all sessions of the app."""
+    return get_deploy_client("databricks")
+
+class _EndpointMetadataCache:
+    """
+    Cache of serving endpoint metadata (task type and served entity names).
+
+    The first lookup for an endpoint fetches synchronously; threads that
+    miss while it is in flight wait for its result instead of fetching too.
+    A failed first lookup is remembered for `error_ttl_seconds` and raised
+    again without a request. After that, a stale entry is still returned
+    immediately while a background thread refreshes it, so the chat hot path
+    never waits on the control plane.
+    """
+
+    def __init__(self, ttl_seconds, error_ttl_seconds=ENDPOINT_METADATA_ERROR_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.error_ttl_seconds = error_ttl_seconds
+        self._entries = {}  # endpoint name -> (metadata, fetched_at)
+        self._failures = {}  # endpoint name -> (error, failed_at)
+        self._fetching = {}  # endpoint name -> Future of the first lookup in flight
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def _fetch(self, endpoint_name):
+        ep = _get_workspace_client().serving_endpoints.get(endpoint_name)
+        served_entities = ep.config.served_entities if ep.config and ep.config.served_entities else []
+        metadata = {
+            "task": ep.task,
+            "served_entity_names": [entity.name for entity in served_entities],
+        }
+        with self._lock:
+            self._entries[endpoint_name] = (metadata, time.monotonic())
+        return metadata
+
+    def _refresh_in_background(self, endpoint_name):
+        try:
+            self._fetch(endpoint_name)
+        except Exception as e:
+            logger.warning(f"Failed to refresh metadata for endpoint {endpoint_name}: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(endpoint_name)
+
+    def get(self, endpoint_name):
+        """Return the metadata dict for `endpoint_name`."""
+        with self._lock:
+            entry = self._entries.get(endpoint_name)
+            if entry is not None:
+                metadata, fetched_at = entry
+                if (time.monotonic() - fetched_at > self.ttl_seconds
+                        and endpoint_name not in self._refreshing):
+                    self._refreshing.add(endpoint_name)
+                    threading.Thread(
+                        target=self._refresh_in_background, args=(endpoint_name,), daemon=True
+                    ).start()
+                return metadata
+            failure = self._failures.get(endpoint_name)
+            if failure is not None and time.monotonic() - failure[1] <= self.error_ttl_seconds:
+                raise failure[0]
+            future = self._fetching.get(endpoint_name)
+            if future is None:
+                future = self._fetching[endpoint_name] = Future()
+                fetching = True
+            else:
+                fetching = False
+        if not fetching:
+            return future.result()
+
+        try:
+            metadata = self._fetch(endpoint_name)
+        except Exception as e:
+            with self._lock:
+                self._failures[endpoint_name] = (e, time.monotonic())
+                del self._fetching[endpoint_name]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._failures.pop(endpoint_name, None)
+            del self._fetching[endpoint_name]
+        future.set_result(metadata)
+        return metadata
+
+    def invalidate(self, endpoint_name):
+        with self._lock:
+            self._entries.pop(endpoint_name, None)
+            self._failures.pop(endpoint_name, None)
+
+_endpoint_metadata_cache = _EndpointMetadataCache(ENDPOINT_METADATA_TTL_SECONDS)
+
 def _get_endpoint_task_type(endpoint_name: str) -> str:
     """Get the task type of a serving endpoint."""
     try:
-        w = WorkspaceClient()
-        ep = w.serving_endpoints.get(endpoint_name)
-        return ep.task if ep.task else "chat/completions"
+        task = _endpoint_metadata_cache.get(endpoint_name)["task"]
+        return task if task else "chat/completions"
     except Exception:
         return "chat/completions"
 
-def _convert_to_responses_format(messages):
-    """Convert chat messages to ResponsesAgent API format."""
-    input_messages = []
-    for msg in messages:
-        if msg["role"] == "user":
-            input_messages.append({"role": "user", "content": msg["content"]})
-        elif msg["role"] == "assistant":
-            # Handle assistant messages with tool calls
-            if msg.get("tool_calls"):
-                # Add function calls
-                for tool_call in msg["tool_calls"]:
-                    input_messages.append({
-                        "type": "function_call",
-                        "id": tool_call["id"],
-                        "call_id": tool_call["id"],
-                        "name": tool_call["function"]["name"],
-                        "arguments": tool_call["function"]["arguments"]
-                    })
-                # Add assistant message if it has content
-                if msg.get("content"):
-                    input_messages.append({
-                        "type": "message",
-                        "id": msg.get("id", str(uuid.uuid4())),
-                        "content": [{"type": "output_text", "text": msg["content"]}],
-                        "role": "assistant"
-                    })
-            else:
-                # Regular assistant message
-                input_messages.append({
+# Namespace for deterministic ids of assistant messages that don't carry one
+_MESSAGE_ID_NAMESPACE = uuid.UUID("6f0d8a4e-2a7b-4c1e-9a51-3f1b6c2d9e70")
+
+class ChatMessage(dict):
+    """
+    A chat-format message dict that lazily memoizes its ResponsesAgent view.
+
+    Messages kept in the conversation history are stored as ChatMessage with
+    their position in the full history, so each one is converted to the
+    ResponsesAgent input format once, with an id that does not change as the
+    context window slides. The message must not be mutated after conversion.
+    """
+    __slots__ = ("position", "responses_items")
+
+    def __init__(self, message, position=None):
+        super().__init__(message)
+        self.position = position
+        self.responses_items = None
+
+def _stable_message_id(msg, position):
+    """Id for an assistant message, derived from its position and content if it has none."""
+    if msg.get("id"):
+        return msg["id"]
+    return str(uuid.uuid5(_MESSAGE_ID_NAMESPACE, f"{position}:{msg['role']}:{msg.get('content')}"))
+
+def _message_to_responses_items(msg, position):
+    """Convert one chat message to a list of ResponsesAgent input items."""
+    if msg["role"] in ("user", "system"):
+        return [{"role": msg["role"], "content": msg["content"]}]
+    elif msg["role"] == "assistant":
+        items = []
+        # Handle assistant messages with tool calls
+        if msg.get("tool_calls"):
+            # Add function calls
+            for tool_call in msg["tool_calls"]:
+                items.append({
+                    "type": "function_call",
+                    "id": tool_call["id"],
+                    "call_id": tool_call["id"],
+                    "name": tool_call["function"]["name"],
+                    "arguments": tool_call["function"]["arguments"]
+                })
+            # Add assistant message if it has content
+            if msg.get("content"):
+                items.append({
                     "type": "message",
-                    "id": msg.get("id", str(uuid.uuid4())),
+                    "id": _stable_message_id(msg, position),
                     "content": [{"type": "output_text", "text": msg["content"]}],
                     "role": "assistant"
                 })
-        elif msg["role"] == "tool":
-            input_messages.append({
-                "type": "function_call_output",
-                "call_id": msg.get("tool_call_id"),
-                "output": msg["content"]
+        else:
+            # Regular assistant message
+            items.append({
+                "type": "message",
+                "id": _stable_message_id(msg, position),
+                "content": [{"type": "output_text", "text": msg["content"]}],
+                "role": "assistant"
             })
+        return items
+    elif msg["role"] == "tool":
+        return [{
+            "type": "function_call_output",
+            "call_id": msg.get("tool_call_id"),
+            "output": msg["content"]
+        }]
+    return []
+
+def _convert_to_responses_format(messages):
+    """Convert chat messages to ResponsesAgent API format."""
+    input_messages = []
+    for position, msg in enumerate(messages):
+        if isinstance(msg, ChatMessage):
+            if msg.responses_items is None:
+                msg.responses_items = _message_to_responses_items(
+                    msg, position if msg.position is None else msg.position)
+            input_messages.extend(msg.responses_items)
+        else:
+            input_messages.extend(_message_to_responses_items(msg, position))
     return input_messages
 
+def _predict_stream(endpoint_name, inputs):
+    """Stream raw events from a serving endpoint using the configured transport."""
+    if SERVING_STREAM_CLIENT == "async":
+        from serving_client import stream_endpoint
+        return stream_endpoint(endpoint_name, inputs, _get_workspace_client())
+    return _get_deploy_client().predict_stream(endpoint=endpoint_name, inputs=inputs)
+
 def _throw_unexpected_endpoint_format():
     raise Exception("This app can only run against ChatModel, ChatAgent, or ResponsesAgent endpoints")
 
 def query_endpoint_stream(endpoint_name: str, messages: list[dict[str, str]], return_traces: bool):
+    lookup_start = time.perf_counter()
     task_type = _get_endpoint_task_type(endpoint_name)
+    lookup_seconds = time.perf_counter() - lookup_start
+    ENDPOINT_LOOKUP_SECONDS.observe(lookup_seconds)
     
     if task_type == "agent/v1/responses":
-        return _query_responses_endpoint_stream(endpoint_name, messages, return_traces)
+        events = _query_responses_endpoint_stream(endpoint_name, messages, return_traces)
+    elif _use_response_cache(task_type):
+        events = _query_chat_endpoint_stream_cached(endpoint_name, messages, return_traces)
     else:
-        return _query_chat_endpoint_stream(endpoint_name, messages, return_traces)
+        events = _query_chat_endpoint_stream(endpoint_name, messages, return_traces)
+    return instrument_stream(events, endpoint_name, task_type, lookup_seconds)
+
+def _use_response_cache(task_type):
+    # Agents may call tools, so their answers are never served from cache
+    return get_response_cache() is not None and not task_type.startswith("agent/")
+
+def _has_tool_calls(messages):
+    return any(msg.get("tool_calls") for msg in messages)
+
+def _query_chat_endpoint_stream_cached(endpoint_name, messages, return_traces):
+    """Stream a chat completions response, answering from the response cache when possible."""
+    cache = get_response_cache()
+    cached_messages = cache.get(endpoint_name, messages)
+    if cached_messages is not None:
+        content = "".join(msg.get("content") or "" for msg in cached_messages)
+        yield {"choices": [{"delta": {"role": "assistant", "content": content}}]}
+        return
+
+    content_parts = []
+    cacheable = True
+    for chunk in _query_chat_endpoint_stream(endpoint_name, messages, return_traces):
+        for choice in chunk.get("choices") or []:
+            delta = choice.get("delta") or {}
+            if delta.get("tool_calls"):
+                cacheable = False
+            if delta.get("content"):
+                content_parts.append(delta["content"])
+        yield chunk
+    if cacheable and content_parts:
+        cache.put(endpoint_name, messages, [{"role": "assistant", "content": "".join(content_parts)}])
 
 def _query_chat_endpoint_stream(endpoint_name: str, messages: list[dict[str, str]], return_traces: bool):
     """Invoke an endpoint that implements either chat completions or ChatAgent and stream the response"""
-    client = get_deploy_client("databricks")
-
     # Prepare input payload
     inputs = {
         "messages": messages,
@@ -84,7 +277,7 @@ def _query_chat_endpoint_stream(endpoint_name: str, messages: list[dict[str, str
     if return_traces:
         inputs["databricks_options"] = {"return_trace": True}
 
-    for chunk in client.predict_stream(endpoint=endpoint_name, inputs=inputs):
+    for chunk in _predict_stream(endpoint_name, inputs):
         if "choices" in chunk:
             yield chunk
         elif "delta" in chunk:
@@ -93,9 +286,7 @@ def _query_chat_endpoint_stream(endpoint_name: str, messages: list[dict[str, str
             _throw_unexpected_endpoint_format()
 
 def _query_responses_endpoint_stream(endpoint_name: str, messages: list[dict[str, str]], return_traces: bool):
-    """Stream responses from agent/v1/responses endpoints using MLflow deployments client."""
-    client = get_deploy_client("databricks")
-    
+    """Stream responses from agent/v1/responses endpoints."""
     input_messages = _convert_to_responses_format(messages)
     
     # Prepare input payload for ResponsesAgent
@@ -107,7 +298,7 @@ def _query_responses_endpoint_stream(endpoint_name: str, messages: list[dict[str
     if return_traces:
         inputs["databricks_options"] = {"return_trace": True}
 
-    for event_data in client.predict_stream(endpoint=endpoint_name, inputs=inputs):
+    for event_data in _predict_stream(endpoint_name, inputs):
         # Just yield the raw event data, let app.py handle the parsing
         yield event_data
 
@@ -120,6 +311,16 @@ def query_endpoint(endpoint_name, messages, return_traces):
     
     if task_type == "agent/v1/responses":
         return _query_responses_endpoint(endpoint_name, messages, return_traces)
+    elif _use_response_cache(task_type):
+        cache = get_response_cache()
+        cached_messages = cache.get(endpoint_name, messages)
+        if cached_messages is not None:
+            # Cached answers have no request ID, so they can't receive feedback
+            return cached_messages, None
+        result_messages, request_id = _query_chat_endpoint(endpoint_name, messages, return_traces)
+        if not _has_tool_calls(result_messages):
+            cache.put(endpoint_name, messages, result_messages)
+        return result_messages, request_id
     else:
         return _query_chat_endpoint(endpoint_name, messages, return_traces)
 
@@ -129,7 +330,7 @@ def _query_chat_endpoint(endpoint_name, messages, return_traces):
     if return_traces:
         inputs['databricks_options'] = {'return_trace': True}
     
-    res = get_deploy_client('databricks').predict(
+    res = _get_deploy_client().predict(
         endpoint=endpoint_name,
         inputs=inputs,
     )
@@ -142,7 +343,7 @@ def _query_chat_endpoint(endpoint_name, messages, return_traces):
 
 def _query_responses_endpoint(endpoint_name, messages, return_traces):
     """Query agent/v1/responses endpoints using MLflow deployments client."""
-    client = get_deploy_client("databricks")
+    client = _get_deploy_client()
     
     input_messages = _convert_to_responses_format(messages)
     
@@ -215,8 +416,8 @@ def _query_responses_endpoint(endpoint_name, messages, return_traces):
     
     return result_messages or [{"role": "assistant", "content": "No response found"}], request_id
 
-def submit_feedback(endpoint, request_id, rating):
-    """Submit feedback to the agent."""
+def feedback_record(request_id, rating):
+    """Build the feedback record for one rated response."""
     rating_string = "positive" if rating == 1 else "negative"
     text_assessments = [] if rating is None else [{
         "ratings": {
@@ -225,28 +426,31 @@ def submit_feedback(endpoint, request_id, rating):
         "free_text_comment": None
     }]
 
-    proxy_payload = {
-        "dataframe_records": [
-            {
-                "source": json.dumps({
-                    "id": "e2e-chatbot-app",  # Or extract from auth
-                    "type": "human"
-                }),
-                "request_id": request_id,
-                "text_assessments": json.dumps(text_assessments),
-                "retrieval_assessments": json.dumps([]),
-            }
-        ]
+    return {
+        "source": json.dumps({
+            "id": "e2e-chatbot-app",  # Or extract from auth
+            "type": "human"
+        }),
+        "request_id": request_id,
+        "text_assessments": json.dumps(text_assessments),
+        "retrieval_assessments": json.dumps([]),
     }
-    w = WorkspaceClient()
+
+
+def submit_feedback_records(endpoint, records):
+    """Submit a batch of feedback records to the agent in a single request."""
+    w = _get_workspace_client()
     return w.api_client.do(
         method='POST',
         path=f"/serving-endpoints/{endpoint}/served-models/feedback/invocations",
-        body=proxy_payload,
+        body={"dataframe_records": records},
     )
 
 
+def submit_feedback(endpoint, request_id, rating):
+    """Submit feedback to the agent."""
+    return submit_feedback_records(endpoint, [feedback_record(request_id, rating)])
+
+
 def endpoint_supports_feedback(endpoint_name):
-    w = WorkspaceClient()
-    endpoint = w.serving_endpoints.get(endpoint_name)
-    return "feedback" in [entity.name for entity in endpoint.config.served_entities]
+    return "feedback" in _endpoint_metadata_cache.get(endpoint_name)["served_entity_names"]
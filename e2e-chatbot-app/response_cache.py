@@ -0,0 +1,232 @@
+"""
+Opt-in cache of chatbot responses for repeated, FAQ-style prompts.
+
+Lookups go through two layers:
+
+1. Exact match on a hash of the endpoint and the normalized conversation.
+2. Semantic match: the last user message is embedded and compared (cosine
+   similarity, brute force with NumPy) against cached prompts that were
+   asked after the same preceding conversation and have the same content
+   words. Only filler words such as articles may differ, so prompts that
+   differ in a number, a name or a negation never match, however similar
+   they are otherwise.
+
+Entries expire after a TTL and the least recently used entries are evicted
+once the cache is full. Callers are responsible for bypassing the cache for
+tool-calling agents, whose answers depend on tool results.
+
+Configured through environment variables:
+
+- RESPONSE_CACHE_ENABLED: "true" to enable the cache (default "false").
+- RESPONSE_CACHE_MAX_ENTRIES: maximum number of cached responses (default 1000).
+- RESPONSE_CACHE_TTL_SECONDS: lifetime of a cached response (default 3600).
+- RESPONSE_CACHE_SIMILARITY_THRESHOLD: minimum cosine similarity for a
+  semantic hit (default 0.92); set to a value above 1 to only use exact matches.
+- RESPONSE_CACHE_EMBEDDING_ENDPOINT: optional embeddings serving endpoint;
+  by default prompts are embedded locally with a hashed bag of words.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
+
+HASHING_EMBEDDING_DIM = 1024
+_WORD_RE = re.compile(r"\w+")
+# Words that may differ between prompts served the same cached answer.
+# Anything that can change the meaning (negations, tenses, question words,
+# prepositions) is deliberately left out.
+FILLER_WORDS = frozenset(["a", "an", "the", "do", "does", "can", "could", "would",
+                          "i", "me", "my", "you", "your", "please"])
+
+
+def _normalize_text(text):
+    return " ".join((text or "").lower().split())
+
+
+def _normalize_messages(messages):
+    """Keep only the role and whitespace/case-normalized content of each message."""
+    return [(msg.get("role"), _normalize_text(msg.get("content"))) for msg in messages]
+
+
+def _hash(value):
+    return hashlib.sha256(json.dumps(value).encode()).hexdigest()
+
+
+def content_words(text):
+    """The distinct words of `text` other than filler words, sorted."""
+    return sorted(set(_WORD_RE.findall(_normalize_text(text))) - FILLER_WORDS)
+
+
+def hashing_embedding(text, dim=HASHING_EMBEDDING_DIM):
+    """
+    Embed `text` locally as an L2-normalized signed hash of its word unigrams
+    and bigrams. Cheap and deterministic, and good enough to match rephrasings
+    that share most of their words.
+    """
+    words = _WORD_RE.findall(_normalize_text(text))
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    vector = np.zeros(dim, dtype=np.float32)
+    for feature in features:
+        h = zlib.crc32(feature.encode())
+        vector[h % dim] += 1.0 if (h >> 31) & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def endpoint_embedding(endpoint_name):
+    """Return an embedding function backed by a Databricks embeddings endpoint."""
+    from mlflow.deployments import get_deploy_client
+    client = get_deploy_client("databricks")
+
+    def embed(text):
+        res = client.predict(endpoint=endpoint_name, inputs={"input": [text]})
+        vector = np.asarray(res["data"][0]["embedding"], dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    return embed
+
+
+class _SemanticIndex:
+    """Brute-force cosine-similarity index over the prompts of one context."""
+
+    def __init__(self):
+        self.keys = []
+        self.vectors = []
+        self._matrix = None
+
+    def add(self, key, vector):
+        self.keys.append(key)
+        self.vectors.append(vector)
+        self._matrix = None
+
+    def remove(self, key):
+        idx = self.keys.index(key)
+        del self.keys[idx]
+        del self.vectors[idx]
+        self._matrix = None
+
+    def nearest(self, vector):
+        """Return (key, similarity) of the closest prompt, or (None, -1)."""
+        if not self.keys:
+            return None, -1.0
+        if self._matrix is None:
+            self._matrix = np.vstack(self.vectors)
+        similarities = self._matrix @ vector
+        idx = int(np.argmax(similarities))
+        return self.keys[idx], float(similarities[idx])
+
+
+class ResponseCache:
+    """Thread-safe exact-match and semantic cache of endpoint responses."""
+
+    def __init__(self, max_entries=1000, ttl_seconds=3600, similarity_threshold=0.92,
+                 embed=hashing_embedding):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.embed = embed
+        # exact key -> {"value", "expires_at", "index_key"}, in LRU order
+        self._entries = OrderedDict()
+        # index key -> _SemanticIndex of the prompts that may match each other
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self.stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0}
+
+    @staticmethod
+    def _keys(endpoint_name, messages):
+        normalized = _normalize_messages(messages)
+        exact_key = _hash([endpoint_name, normalized])
+        # Semantic matches only apply to the last user message, and only
+        # between prompts that follow the same conversation and have the
+        # same content words
+        last_words = content_words(normalized[-1][1]) if normalized else []
+        index_key = _hash([endpoint_name, normalized[:-1], last_words])
+        return exact_key, index_key
+
+    def _remove(self, exact_key):
+        entry = self._entries.pop(exact_key)
+        index = self._indexes.get(entry["index_key"])
+        if index is not None and exact_key in index.keys:
+            index.remove(exact_key)
+            if not index.keys:
+                del self._indexes[entry["index_key"]]
+
+    def _live_entry(self, exact_key, now):
+        entry = self._entries.get(exact_key)
+        if entry is None:
+            return None
+        if entry["expires_at"] < now:
+            self._remove(exact_key)
+            return None
+        self._entries.move_to_end(exact_key)
+        return entry
+
+    def _use_semantic_layer(self, messages):
+        return (self.similarity_threshold <= 1.0 and messages
+                and messages[-1].get("role") == "user")
+
+    def get(self, endpoint_name, messages):
+        """Return the cached response for this conversation, or None."""
+        exact_key, index_key = self._keys(endpoint_name, messages)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._live_entry(exact_key, now)
+            if entry is not None:
+                self.stats["exact_hits"] += 1
+                return entry["value"]
+            has_candidates = index_key in self._indexes
+
+        if has_candidates and self._use_semantic_layer(messages):
+            vector = self.embed(messages[-1].get("content") or "")
+            with self._lock:
+                index = self._indexes.get(index_key)
+                if index is not None:
+                    key, similarity = index.nearest(vector)
+                    if key is not None and similarity >= self.similarity_threshold:
+                        entry = self._live_entry(key, now)
+                        if entry is not None:
+                            self.stats["semantic_hits"] += 1
+                            return entry["value"]
+
+        with self._lock:
+            self.stats["misses"] += 1
+        return None
+
+    def put(self, endpoint_name, messages, value):
+        """Cache `value` as the response to this conversation."""
+        exact_key, index_key = self._keys(endpoint_name, messages)
+        vector = self.embed(messages[-1].get("content") or "") if self._use_semantic_layer(messages) else None
+        with self._lock:
+            if exact_key in self._entries:
+                self._remove(exact_key)
+            self._entries[exact_key] = {
+                "value": value,
+                "expires_at": time.monotonic() + self.ttl_seconds,
+                "index_key": index_key,
+            }
+            if vector is not None:
+                self._indexes.setdefault(index_key, _SemanticIndex()).add(exact_key, vector)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+
+@lru_cache(maxsize=1)
+def get_response_cache():
+    """Return the process-wide response cache, or None if it is disabled."""
+    if os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() != "true":
+        return None
+    embedding_endpoint = os.getenv("RESPONSE_CACHE_EMBEDDING_ENDPOINT")
+    return ResponseCache(
+        max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000")),
+        ttl_seconds=float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600")),
+        similarity_threshold=float(os.getenv("RESPONSE_CACHE_SIMILARITY_THRESHOLD", "0.92")),
+        embed=endpoint_embedding(embedding_endpoint) if embedding_endpoint else hashing_embedding,
+    )
@@ -0,0 +1,176 @@
+"""
+Asyncio-native streaming client for Databricks model serving endpoints.
+
+All streams in the process share one event loop running on a background
+thread and one pooled HTTP client (HTTP/2 when the `h2` package is
+installed, keep-alive HTTP/1.1 otherwise), so many concurrent chat sessions
+can stream without each holding its own connection.
+
+`stream_endpoint` is the synchronous adapter used by the Streamlit app: it
+yields parsed server-sent events from a bounded queue, which applies
+backpressure to the network reader, and cancels the underlying request when
+the consumer stops iterating (e.g. the user navigates away and Streamlit
+stops the script run).
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from functools import lru_cache
+
+import httpx
+from databricks.sdk import WorkspaceClient
+
+from serving_metrics import CONNECT_SECONDS
+
+# Maximum number of parsed events buffered between the network reader and
+# the consuming session thread
+STREAM_QUEUE_SIZE = int(os.getenv("SERVING_STREAM_QUEUE_SIZE", "64"))
+MAX_CONNECTIONS = int(os.getenv("SERVING_MAX_CONNECTIONS", "200"))
+CONNECT_TIMEOUT_SECONDS = float(os.getenv("SERVING_CONNECT_TIMEOUT_SECONDS", "10"))
+# Maximum time to wait between two chunks of a streamed response
+READ_TIMEOUT_SECONDS = float(os.getenv("SERVING_READ_TIMEOUT_SECONDS", "300"))
+
+_END_OF_STREAM = object()
+
+
+class ServingEndpointError(Exception):
+    """Raised when a serving endpoint answers with a non-success status."""
+
+    def __init__(self, status_code, message):
+        super().__init__(f"Serving endpoint returned HTTP {status_code}: {message}")
+        self.status_code = status_code
+
+
+async def _iter_sse_events(lines):
+    """Parse server-sent events from an async iterator of lines into dicts."""
+    data_lines = []
+    async for line in lines:
+        if line.startswith("data:"):
+            data_lines.append(line[5:].lstrip())
+        elif line == "" and data_lines:
+            data = "\n".join(data_lines)
+            data_lines = []
+            if data == "[DONE]":
+                return
+            yield json.loads(data)
+        # Comments (":"), "event:", "id:" and "retry:" fields carry nothing we use
+    if data_lines:
+        data = "\n".join(data_lines)
+        if data != "[DONE]":
+            yield json.loads(data)
+
+
+class AsyncServingClient:
+    """Stream predictions from serving endpoints over a pooled HTTP client."""
+
+    def __init__(self, workspace_client=None):
+        self._workspace_client = workspace_client or WorkspaceClient()
+        try:
+            import h2  # noqa: F401
+            http2 = True
+        except ImportError:
+            http2 = False
+        self._http = httpx.AsyncClient(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_CONNECTIONS,
+            ),
+            timeout=httpx.Timeout(READ_TIMEOUT_SECONDS, connect=CONNECT_TIMEOUT_SECONDS),
+        )
+
+    def _url(self, endpoint_name):
+        host = self._workspace_client.config.host.rstrip("/")
+        return f"{host}/serving-endpoints/{endpoint_name}/invocations"
+
+    async def stream(self, endpoint_name, inputs):
+        """Yield the parsed events of a streaming invocation of `endpoint_name`."""
+        # authenticate() returns fresh headers and may block to refresh an
+        # OAuth token, so keep it off the event loop
+        headers = await asyncio.to_thread(self._workspace_client.config.authenticate)
+        headers["Accept"] = "text/event-stream"
+        payload = {**inputs, "stream": True}
+        start = time.perf_counter()
+        async with self._http.stream(
+            "POST", self._url(endpoint_name), json=payload, headers=headers
+        ) as response:
+            CONNECT_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint_name)
+            if response.status_code >= 400:
+                body = await response.aread()
+                raise ServingEndpointError(response.status_code, body.decode(errors="replace"))
+            async for event in _iter_sse_events(response.aiter_lines()):
+                yield event
+
+    async def aclose(self):
+        await self._http.aclose()
+
+
+class _EventLoopThread:
+    """An asyncio event loop running forever on a daemon thread."""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self.loop.run_forever, name="serving-client-loop", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+
+@lru_cache(maxsize=1)
+def _get_event_loop_thread():
+    return _EventLoopThread()
+
+
+@lru_cache(maxsize=1)
+def get_async_serving_client(workspace_client=None):
+    """Return the AsyncServingClient shared by all sessions of the app."""
+    loop_thread = _get_event_loop_thread()
+
+    async def create():
+        # httpx clients must be created on the loop they are used from
+        return AsyncServingClient(workspace_client)
+
+    return loop_thread.submit(create()).result()
+
+
+def stream_endpoint(endpoint_name, inputs, workspace_client=None):
+    """
+    Synchronously yield the events of a streaming invocation of
+    `endpoint_name`, driven by the shared background event loop.
+    """
+    loop_thread = _get_event_loop_thread()
+    client = get_async_serving_client(workspace_client)
+
+    async def create_queue():
+        return asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+
+    queue = loop_thread.submit(create_queue()).result()
+
+    async def produce():
+        try:
+            async for event in client.stream(endpoint_name, inputs):
+                # Blocks when the consumer falls behind, which stops reading
+                # from the socket until it catches up
+                await queue.put(event)
+        except Exception as e:
+            await queue.put(e)
+            return
+        await queue.put(_END_OF_STREAM)
+
+    producer = loop_thread.submit(produce())
+    try:
+        while True:
+            item = loop_thread.submit(queue.get()).result()
+            if item is _END_OF_STREAM:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # Cancels the HTTP request if the consumer stopped early
+        producer.cancel()
@@ -0,0 +1,191 @@
+"""
+Helpers for consuming streamed endpoint output in the chatbot application.
+"""
+import logging
+import random
+import time
+from collections import OrderedDict
+
+import httpx
+
+from serving_metrics import RENDER_SECONDS, STREAM_RECOVERY_EVENTS
+
+logger = logging.getLogger(__name__)
+
+
+class ChatAgentMessageAccumulator:
+    """
+    Incrementally fold ChatAgentChunk deltas belonging to one message id.
+
+    Each delta is folded in O(size of the delta): content and tool-call
+    arguments are appended to buffers, and the full message is only built
+    when `materialize()` is called, e.g. when a render is due.
+    """
+
+    def __init__(self, first_delta):
+        # Fields of the first delta (id, role, name, ...) seed the message,
+        # matching how the chunks were reduced before.
+        self._base = first_delta.model_dump_compat(exclude_none=True)
+        self._content_parts = []
+        self._tool_call_id = None
+        # call_id -> {"id", "type", "name", "argument_parts"}, in arrival order
+        self._tool_calls = {}
+        self.add(first_delta)
+
+    def add(self, delta):
+        """Fold a single ChatAgentMessage delta into the accumulated message."""
+        if delta.content:
+            self._content_parts.append(delta.content)
+
+        for tool_call in getattr(delta, 'tool_calls', None) or []:
+            call_id = getattr(tool_call, 'id', None)
+            if not call_id:
+                continue
+            function_info = getattr(tool_call, 'function', None)
+            func_name = getattr(function_info, 'name', "") if function_info else ""
+            func_args = getattr(function_info, 'arguments', "") if function_info else ""
+
+            existing = self._tool_calls.get(call_id)
+            if existing is None:
+                self._tool_calls[call_id] = {
+                    "id": call_id,
+                    "type": getattr(tool_call, 'type', "function"),
+                    "name": func_name,
+                    "argument_parts": [func_args] if func_args else [],
+                }
+            else:
+                if func_args:
+                    existing["argument_parts"].append(func_args)
+                if func_name:
+                    existing["name"] = func_name
+
+        # Tool call IDs identify tool response messages
+        tool_call_id = getattr(delta, 'tool_call_id', None)
+        if tool_call_id:
+            self._tool_call_id = tool_call_id
+
+    def materialize(self):
+        """Build the accumulated message as a chat-format dict."""
+        message = dict(self._base)
+        if self._tool_call_id:
+            message["tool_call_id"] = self._tool_call_id
+        if self._tool_calls:
+            message["tool_calls"] = [
+                {
+                    "id": call["id"],
+                    "type": call["type"],
+                    "function": {
+                        "name": call["name"],
+                        "arguments": "".join(call["argument_parts"]),
+                    },
+                }
+                for call in self._tool_calls.values()
+            ]
+        # Join once and keep the result, so repeated materializations only
+        # pay for the parts that arrived since the last one.
+        if len(self._content_parts) > 1:
+            self._content_parts = ["".join(self._content_parts)]
+        message["content"] = self._content_parts[0] if self._content_parts else ""
+        return message
+
+
+class RenderScheduler:
+    """
+    Coalesce streamed UI updates to at most `max_fps` renders per second.
+
+    Handlers register the latest render callback for a key (e.g. a message
+    id) with `update()`. Callbacks only run when a frame is due, and only the
+    most recent callback per key runs, so render work and websocket traffic
+    are bounded by the frame rate rather than by the number of chunks.
+    """
+
+    def __init__(self, max_fps=15, clock=time.monotonic):
+        self.interval = 1.0 / max_fps if max_fps > 0 else 0.0
+        self._clock = clock
+        self._last_flush = None
+        self._pending = OrderedDict()
+
+    def update(self, key, render):
+        """Schedule `render()` for `key`, replacing any pending render for it."""
+        self._pending[key] = render
+        self._pending.move_to_end(key)
+        now = self._clock()
+        if self._last_flush is None or now - self._last_flush >= self.interval:
+            self.flush()
+
+    def discard(self, key):
+        """Drop any pending render for `key`."""
+        self._pending.pop(key, None)
+
+    def flush(self):
+        """Run all pending renders now, e.g. once the stream has finished."""
+        pending, self._pending = self._pending, OrderedDict()
+        for render in pending.values():
+            with RENDER_SECONDS.time():
+                render()
+        self._last_flush = self._clock()
+
+
+def backoff_delay(attempt, base_delay=0.5, max_delay=8.0):
+    """Exponential backoff with full jitter for the given 1-based retry attempt."""
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+
+
+def http_status_code(error):
+    """The HTTP status code of a failed serving request, or None if it got no response."""
+    response = getattr(error, "response", None)
+    status_code = getattr(response, "status_code", None) or getattr(error, "status_code", None)
+    return status_code if isinstance(status_code, int) else None
+
+
+def is_retryable_error(error):
+    """
+    Whether a failed stream may succeed if retried: connection errors and
+    timeouts, rate limiting (HTTP 429) and server errors (5xx). Other client
+    errors (4xx), unexpected endpoint formats and errors raised while
+    handling events fail the same way every time.
+    """
+    status_code = http_status_code(error)
+    if status_code is not None:
+        return status_code == 429 or status_code >= 500
+    # OSError covers the connection and timeout errors of the mlflow client (requests)
+    return isinstance(error, (OSError, httpx.TransportError))
+
+
+def stream_with_recovery(open_stream, handle_event, resume_prefix, max_retries=3,
+                         base_delay=0.5, max_delay=8.0, on_retry=None, sleep=time.sleep):
+    """
+    Consume a stream, retrying with bounded exponential backoff if it fails.
+
+    `open_stream(prefix)` starts a stream whose input is extended with the
+    `prefix` messages, and every event is passed to `handle_event`. Before
+    each retry, `resume_prefix()` returns the messages that continue the
+    conversation from the output received so far (an empty list restarts the
+    response), so a transient error doesn't discard what was already streamed.
+    `on_retry(attempt, delay, error)` is called before sleeping. Only
+    errors for which `is_retryable_error` holds are retried.
+
+    Returns True if the stream completed, False if it failed for good.
+    """
+    prefix = []
+    for attempt in range(max_retries + 1):
+        try:
+            for event in open_stream(prefix):
+                handle_event(event)
+            if attempt:
+                STREAM_RECOVERY_EVENTS.inc(event="recovered")
+            return True
+        except Exception as e:
+            logger.warning(f"Streaming attempt {attempt + 1} failed: {e}")
+            if attempt == max_retries or not is_retryable_error(e):
+                break
+            STREAM_RECOVERY_EVENTS.inc(event="retry")
+            delay = backoff_delay(attempt + 1, base_delay, max_delay)
+            if on_retry:
+                on_retry(attempt + 1, delay, e)
+            sleep(delay)
+            prefix = resume_prefix()
+            if prefix:
+                STREAM_RECOVERY_EVENTS.inc(event="resumed")
+    STREAM_RECOVERY_EVENTS.inc(event="failed")
+    return False
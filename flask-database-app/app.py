@@ -1,138 +1,93 @@
-from flask import Flask, render_template, request, redirect, url_for, flash
-import psycopg
+from flask import Flask, Response, render_template, request, redirect, url_for, flash, jsonify, stream_with_context
+import io
+import json
 import os
-import time
-from databricks import sdk
-from psycopg import sql
-from psycopg_pool import ConnectionPool
-
-# Database connection setup
-workspace_client = sdk.WorkspaceClient()
-postgres_password = None
-last_password_refresh = 0
-connection_pool = None
-
-def refresh_oauth_token():
-    """Refresh OAuth token if expired."""
-    global postgres_password, last_password_refresh
-    if postgres_password is None or time.time() - last_password_refresh > 900:
-        print("Refreshing PostgreSQL OAuth token")
-        try:
-            postgres_password = workspace_client.config.oauth_token().access_token
-            last_password_refresh = time.time()
-        except Exception as e:
-            print(f"❌ Failed to refresh OAuth token: {str(e)}")
-            return False
-    return True
-
-def get_connection_pool():
-    """Get or create the connection pool."""
-    global connection_pool
-    if connection_pool is None:
-        refresh_oauth_token()
-        conn_string = (
-            f"dbname={os.getenv('PGDATABASE')} "
-            f"user={os.getenv('PGUSER')} "
-            f"password={postgres_password} "
-            f"host={os.getenv('PGHOST')} "
-            f"port={os.getenv('PGPORT')} "
-            f"sslmode={os.getenv('PGSSLMODE', 'require')} "
-            f"application_name={os.getenv('PGAPPNAME')}"
-        )
-        connection_pool = ConnectionPool(conn_string, min_size=2, max_size=10)
-    return connection_pool
-
-def get_connection():
-    """Get a connection from the pool."""
-    global connection_pool
-    
-    # Recreate pool if token expired
-    if postgres_password is None or time.time() - last_password_refresh > 900:
-        if connection_pool:
-            connection_pool.close()
-            connection_pool = None
-    
-    return get_connection_pool().connection()
-
-def get_schema_name():
-    """Get the schema name in the format {PGAPPNAME}_schema_{PGUSER}."""
-    pgappname = os.getenv("PGAPPNAME", "my_app")
-    pguser = os.getenv("PGUSER", "").replace('-', '')
-    return f"{pgappname}_schema_{pguser}"
+import db
 
 def init_database():
     """Initialize database schema and table."""
     try:
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                schema_name = get_schema_name()
-                
-                cur.execute(sql.SQL("CREATE SCHEMA IF NOT EXISTS {}").format(sql.Identifier(schema_name)))
-                cur.execute(sql.SQL("""
-                    CREATE TABLE IF NOT EXISTS {}.todos (
-                        id SERIAL PRIMARY KEY,
-                        task TEXT NOT NULL,
-                        completed BOOLEAN DEFAULT FALSE,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                """).format(sql.Identifier(schema_name)))
-                conn.commit()
-                return True
+        db.init_database()
+        return True
     except Exception as e:
         print(f"Database initialization error: {e}")
         return False
 
 def add_todo(task):
-    """Add a new todo item."""
+    """Add a new todo item and return it, or None on failure."""
     try:
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                schema = get_schema_name()
-                cur.execute(sql.SQL("INSERT INTO {}.todos (task) VALUES (%s)").format(sql.Identifier(schema)), (task.strip(),))
-                conn.commit()
-                return True
+        return db.add_todo(task)
     except Exception as e:
         print(f"Add todo error: {e}")
-        return False
+        return None
 
-def get_todos():
-    """Get all todo items."""
+def get_todos(cursor=None):
+    """Get a page of todo items and the cursor of the next page."""
     try:
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                schema = get_schema_name()
-                cur.execute(sql.SQL("SELECT id, task, completed, created_at FROM {}.todos ORDER BY created_at DESC").format(sql.Identifier(schema)))
-                return cur.fetchall()
+        return db.get_todos(cursor)
     except Exception as e:
         print(f"Get todos error: {e}")
-        return []
+        return [], None
 
 def toggle_todo(todo_id):
-    """Toggle the completed status of a todo item."""
+    """Toggle the completed status of a todo item and return it, or None on failure."""
     try:
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                schema = get_schema_name()
-                cur.execute(sql.SQL("UPDATE {}.todos SET completed = NOT completed WHERE id = %s").format(sql.Identifier(schema)), (todo_id,))
-                conn.commit()
-                return True
+        return db.toggle_todo(todo_id)
     except Exception as e:
         print(f"Toggle todo error: {e}")
-        return False
+        return None
 
 def delete_todo(todo_id):
-    """Delete a todo item."""
+    """Delete a todo item. Returns whether it was deleted."""
     try:
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                schema = get_schema_name()
-                cur.execute(sql.SQL("DELETE FROM {}.todos WHERE id = %s").format(sql.Identifier(schema)), (todo_id,))
-                conn.commit()
-                return True
+        return db.delete_todo(todo_id)
     except Exception as e:
         print(f"Delete todo error: {e}")
         return False
 
+def import_todos(lines):
+    """Add the todos in a CSV file and return how many were added, or None on failure."""
+    try:
+        return db.import_todos(lines)
+    except Exception as e:
+        print(f"Import todos error: {e}")
+        return None
+
+def toggle_todos(todo_ids):
+    """Toggle several todo items and return the updated todos, or None on failure."""
+    try:
+        return db.toggle_todos(todo_ids)
+    except Exception as e:
+        print(f"Toggle todos error: {e}")
+        return None
+
+def delete_todos(todo_ids):
+    """Delete several todo items and return the deleted ids, or None on failure."""
+    try:
+        return db.delete_todos(todo_ids)
+    except Exception as e:
+        print(f"Delete todos error: {e}")
+        return None
+
+def complete_all():
+    """Complete all todo items and return the updated todos, or None on failure."""
+    try:
+        return db.complete_all()
+    except Exception as e:
+        print(f"Complete all error: {e}")
+        return None
+
+def clear_completed():
+    """Delete all completed todo items and return their ids, or None on failure."""
+    try:
+        return db.clear_completed()
+    except Exception as e:
+        print(f"Clear completed error: {e}")
+        return None
+
+# Comment sent on an idle event stream, so proxies don't close it
+EVENTS_KEEPALIVE_SECONDS = 15
+
 # Initialize Flask app
 app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY', 'dev-secret-key')
@@ -143,9 +98,15 @@ if not init_database():
 
 @app.route('/')
 def index():
-    """Main page showing all todos."""
-    todos = get_todos()
-    return render_template('index.html', todos=todos)
+    """Main page showing the first page of todos, or the page after `cursor`."""
+    todos, next_cursor = get_todos(request.args.get('cursor'))
+    return render_template('index.html', todos=todos, next_cursor=next_cursor)
+
+@app.route('/todos')
+def todos_page():
+    """The page of todos after `cursor`, as HTML to append to the list."""
+    todos, next_cursor = get_todos(request.args.get('cursor'))
+    return render_template('_todo_items.html', todos=todos, next_cursor=next_cursor)
 
 @app.route('/add', methods=['POST'])
 def add_todo_route():
@@ -178,5 +139,121 @@ def delete_todo_route(todo_id):
         flash('Failed to delete todo.', 'error')
     return redirect(url_for('index'))
 
+@app.route('/import', methods=['POST'])
+def import_todos_route():
+    """Add the todos in an uploaded CSV file."""
+    file = request.files.get('file')
+    if not file or not file.filename:
+        flash('Please choose a CSV file.', 'error')
+        return redirect(url_for('index'))
+    count = import_todos(io.TextIOWrapper(file.stream, encoding='utf-8-sig', newline=''))
+    if count is None:
+        flash('Failed to import todos.', 'error')
+    else:
+        flash(f'Imported {count} todos!', 'success')
+    return redirect(url_for('index'))
+
+@app.route('/bulk', methods=['POST'])
+def bulk_todos_route():
+    """Toggle or delete the selected todo items, complete them all, or clear the completed ones."""
+    action = request.form.get('action')
+    todo_ids = request.form.getlist('todo_ids', type=int)
+    if action == 'complete_all':
+        result = complete_all()
+        message = 'Completed {} todos!'
+    elif action == 'clear_completed':
+        result = clear_completed()
+        message = 'Deleted {} completed todos!'
+    elif not todo_ids:
+        flash('Please select some todos.', 'error')
+        return redirect(url_for('index'))
+    elif action == 'toggle':
+        result = toggle_todos(todo_ids)
+        message = 'Updated {} todos!'
+    elif action == 'delete':
+        result = delete_todos(todo_ids)
+        message = 'Deleted {} todos!'
+    else:
+        flash('Unknown action.', 'error')
+        return redirect(url_for('index'))
+    if result is None:
+        flash('Failed to update todos.', 'error')
+    else:
+        flash(message.format(len(result)), 'success')
+    return redirect(url_for('index'))
+
+def todo_response(todo):
+    """JSON for a todo, with its rendered list item to patch into the page."""
+    todo_id, task, completed, created_at = todo
+    return jsonify(
+        todo={'id': todo_id, 'task': task, 'completed': completed, 'created_at': created_at.isoformat()},
+        html=render_template('_todo_item.html', todo=todo)
+    )
+
+@app.route('/api/todos', methods=['POST'])
+def add_todo_api():
+    """Add a new todo item and return it."""
+    task = request.form.get('task', '').strip()
+    if not task:
+        return jsonify(error='Please enter a task.'), 400
+    todo = add_todo(task)
+    if todo is None:
+        return jsonify(error='Failed to add todo.'), 500
+    return todo_response(todo), 201
+
+@app.route('/api/todos/<int:todo_id>/toggle', methods=['POST'])
+def toggle_todo_api(todo_id):
+    """Toggle the completed status of a todo item and return it."""
+    # Calls db directly to tell a missing todo (404) from a failure (500)
+    try:
+        todo = db.toggle_todo(todo_id)
+    except Exception as e:
+        print(f"Toggle todo error: {e}")
+        return jsonify(error='Failed to update todo.'), 500
+    if todo is None:
+        return jsonify(error='Todo not found.'), 404
+    return todo_response(todo)
+
+@app.route('/api/todos/<int:todo_id>', methods=['DELETE'])
+def delete_todo_api(todo_id):
+    """Delete a todo item."""
+    try:
+        deleted = db.delete_todo(todo_id)
+    except Exception as e:
+        print(f"Delete todo error: {e}")
+        return jsonify(error='Failed to delete todo.'), 500
+    if not deleted:
+        return jsonify(error='Todo not found.'), 404
+    return jsonify(id=todo_id)
+
+@app.route('/events')
+def todo_events():
+    """
+    Changes to the todos made by any user, as server-sent events. Changed
+    todos are sent with their rendered list item, deleted ones by id.
+    """
+    subscription = db.subscribe()
+
+    def stream():
+        while True:
+            events = subscription.get(timeout=EVENTS_KEEPALIVE_SECONDS)
+            if not events:
+                yield ": keepalive\n\n"
+            for event in events:
+                if 'todos' in event:
+                    event['todos'] = [
+                        {'id': todo[0], 'html': render_template('_todo_item.html', todo=todo)}
+                        for todo in event['todos']
+                    ]
+                yield f"data: {json.dumps(event)}\n\n"
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/health')
+def health():
+    """Connection pool statistics, for monitoring."""
+    return jsonify(db.pool_stats())
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=int(os.getenv('PORT', 8080))) 
\ No newline at end of file
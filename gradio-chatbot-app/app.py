@@ -1,7 +1,8 @@
 import gradio as gr
 import logging
 import os
-from model_serving_utils import query_endpoint, is_endpoint_supported
+from model_serving_utils import query_endpoint_stream, is_endpoint_supported
+from serving_metrics import start_metrics_exporter
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -19,14 +20,19 @@ assert SERVING_ENDPOINT,\
 # Check if the endpoint is supported
 endpoint_supported = is_endpoint_supported(SERVING_ENDPOINT)
 
+# Expose streaming latency metrics on METRICS_PORT, if set
+start_metrics_exporter()
+
 def query_llm(message, history):
     """
-    Query the LLM with the given message and chat history.
+    Query the LLM with the given message and chat history, streaming the reply.
     `message`: str - the latest user input.
     `history`: list of dicts - OpenAI-style messages.
+    Yields the reply received so far, which Gradio renders as it grows.
     """
     if not message.strip():
-        return "ERROR: The question should not be empty"
+        yield "ERROR: The question should not be empty"
+        return
 
     # Convert from Gradio-style history to OpenAI-style messages
     message_history = []
@@ -37,17 +43,19 @@ def query_llm(message, history):
     # Add the latest user message
     message_history.append({"role": "user", "content": message})
 
+    response = ""
     try:
         logger.info(f"Sending request to model endpoint: {SERVING_ENDPOINT}")
-        response = query_endpoint(
+        for content in query_endpoint_stream(
             endpoint_name=SERVING_ENDPOINT,
             messages=message_history,
             max_tokens=400
-        )
-        return response["content"]
+        ):
+            response += content
+            yield response
     except Exception as e:
         logger.error(f"Error querying model: {str(e)}", exc_info=True)
-        return f"Error: {str(e)}"
+        yield f"{response}\n\nError: {str(e)}" if response else f"Error: {str(e)}"
 
 # Create Gradio interface based on endpoint support
 if not endpoint_supported:
@@ -73,7 +81,7 @@ else:
         description=(
             "Note: this is a simple example. See "
             "[Databricks docs](https://docs.databricks.com/aws/en/generative-ai/agent-framework/chat-app) "
-            "for a more comprehensive example, with support for streaming output and more."
+            "for a more comprehensive example, with support for agent tool calls and more."
         ),
         examples=[
             "What is machine learning?",
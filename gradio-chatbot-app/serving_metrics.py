@@ -0,0 +1,260 @@
+"""
+Latency metrics for querying serving endpoints and rendering their output.
+
+Metrics are process-wide, so they aggregate over all sessions of the app, and
+are exposed in two optional ways:
+
+- METRICS_PORT: serve the Prometheus text format on http://0.0.0.0:<port>/metrics.
+- METRICS_LOG_PATH: append one JSON record per streamed response to this file.
+
+Both are off by default; the metrics are still collected in memory and can be
+read with `REGISTRY.render_prometheus()` or `REGISTRY.snapshot()`.
+"""
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+GAP_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _label_str(labelnames, key):
+    if not labelnames:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(labelnames, key))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    """A monotonically increasing count, optionally split by labels."""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        return self._values.get(key, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_str(self.labelnames, key)} {value}")
+        return lines
+
+    def snapshot(self):
+        with self._lock:
+            return {",".join(key) or "": value for key, value in self._values.items()}
+
+
+class Histogram:
+    """Distribution of observed values in cumulative buckets, optionally split by labels."""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label key -> [per-bucket counts (+Inf last), sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][idx] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the enclosed block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    labels = _label_str(self.labelnames + ("le",), key + (le,))
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _label_str(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {total}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                ",".join(key) or "": {"count": count, "sum": total}
+                for key, (_, total, count) in self._values.items()
+            }
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render_prometheus(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        return {metric.name: metric.snapshot() for metric in self._metrics}
+
+
+REGISTRY = MetricsRegistry()
+
+ENDPOINT_LOOKUP_SECONDS = REGISTRY.histogram(
+    "chatbot_endpoint_lookup_seconds", "Time to resolve the endpoint task type.")
+CONNECT_SECONDS = REGISTRY.histogram(
+    "chatbot_stream_connect_seconds", "Time until the endpoint returned response headers.",
+    ["endpoint"])
+TIME_TO_FIRST_TOKEN_SECONDS = REGISTRY.histogram(
+    "chatbot_time_to_first_token_seconds", "Time from sending a query to its first streamed chunk.",
+    ["endpoint"])
+INTER_TOKEN_SECONDS = REGISTRY.histogram(
+    "chatbot_inter_token_seconds", "Gap between consecutive streamed chunks.",
+    ["endpoint"], buckets=GAP_BUCKETS)
+STREAM_SECONDS = REGISTRY.histogram(
+    "chatbot_stream_seconds", "Total duration of a streamed response.", ["endpoint"])
+STREAM_TOKENS = REGISTRY.counter(
+    "chatbot_stream_tokens_total", "Streamed chunks received, roughly one token each.", ["endpoint"])
+STREAMS = REGISTRY.counter(
+    "chatbot_streams_total", "Streamed responses by outcome (completed, cancelled or error).",
+    ["endpoint", "outcome"])
+RENDER_SECONDS = REGISTRY.histogram(
+    "chatbot_render_seconds", "Time spent in a single UI update while streaming.",
+    buckets=GAP_BUCKETS)
+STREAM_RECOVERY_EVENTS = REGISTRY.counter(
+    "chatbot_stream_recovery_events_total",
+    "Stream error handling: retry, resumed, recovered, or failed (fell back to a non-streaming query).",
+    ["event"])
+
+_log_lock = threading.Lock()
+
+
+def _log_stream_record(record):
+    path = os.getenv("METRICS_LOG_PATH")
+    if not path:
+        return
+    with _log_lock:
+        with open(path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+
+def instrument_stream(events, endpoint_name, task_type, lookup_seconds=None):
+    """
+    Wrap an iterator of streamed events, recording time to first token,
+    inter-token gaps, token count and total duration for the stream.
+    """
+    start = time.perf_counter()
+    first_at = None
+    last_at = None
+    max_gap = 0.0
+    tokens = 0
+    outcome = "error"
+    try:
+        for event in events:
+            now = time.perf_counter()
+            if first_at is None:
+                first_at = now
+                TIME_TO_FIRST_TOKEN_SECONDS.observe(now - start, endpoint=endpoint_name)
+            else:
+                gap = now - last_at
+                max_gap = max(max_gap, gap)
+                INTER_TOKEN_SECONDS.observe(gap, endpoint=endpoint_name)
+            last_at = now
+            tokens += 1
+            yield event
+        outcome = "completed"
+    except GeneratorExit:
+        # The consumer stopped reading, e.g. the user navigated away
+        outcome = "cancelled"
+        raise
+    finally:
+        total = time.perf_counter() - start
+        STREAM_SECONDS.observe(total, endpoint=endpoint_name)
+        STREAM_TOKENS.inc(tokens, endpoint=endpoint_name)
+        STREAMS.inc(endpoint=endpoint_name, outcome=outcome)
+        _log_stream_record({
+            "timestamp": time.time(),
+            "endpoint": endpoint_name,
+            "task_type": task_type,
+            "outcome": outcome,
+            "endpoint_lookup_seconds": lookup_seconds,
+            "time_to_first_token_seconds": first_at - start if first_at is not None else None,
+            "max_inter_token_seconds": max_gap,
+            "tokens": tokens,
+            "total_seconds": total,
+        })
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_exporter_lock = threading.Lock()
+_exporter = None
+
+
+def start_metrics_exporter():
+    """Serve /metrics on METRICS_PORT, once per process. No-op if unset."""
+    global _exporter
+    port = os.getenv("METRICS_PORT")
+    if not port:
+        return
+    with _exporter_lock:
+        if _exporter is not None:
+            return
+        _exporter = ThreadingHTTPServer(("0.0.0.0", int(port)), _MetricsHandler)
+        _exporter.daemon_threads = True
+        threading.Thread(target=_exporter.serve_forever, name="metrics-exporter", daemon=True).start()
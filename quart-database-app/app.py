@@ -0,0 +1,271 @@
+from quart import Quart, render_template, request, redirect, url_for, flash, jsonify, make_response, stream_with_context
+import io
+import json
+import os
+import db
+
+async def init_database():
+    """Open the connection pool and initialize database schema and table."""
+    try:
+        await db.open_pool()
+        await db.init_database()
+        return True
+    except Exception as e:
+        print(f"Database initialization error: {e}")
+        return False
+
+async def add_todo(task):
+    """Add a new todo item and return it, or None on failure."""
+    try:
+        return await db.add_todo(task)
+    except Exception as e:
+        print(f"Add todo error: {e}")
+        return None
+
+async def get_todos(cursor=None):
+    """Get a page of todo items and the cursor of the next page."""
+    try:
+        return await db.get_todos(cursor)
+    except Exception as e:
+        print(f"Get todos error: {e}")
+        return [], None
+
+async def toggle_todo(todo_id):
+    """Toggle the completed status of a todo item and return it, or None on failure."""
+    try:
+        return await db.toggle_todo(todo_id)
+    except Exception as e:
+        print(f"Toggle todo error: {e}")
+        return None
+
+async def delete_todo(todo_id):
+    """Delete a todo item. Returns whether it was deleted."""
+    try:
+        return await db.delete_todo(todo_id)
+    except Exception as e:
+        print(f"Delete todo error: {e}")
+        return False
+
+async def import_todos(lines):
+    """Add the todos in a CSV file and return how many were added, or None on failure."""
+    try:
+        return await db.import_todos(lines)
+    except Exception as e:
+        print(f"Import todos error: {e}")
+        return None
+
+async def toggle_todos(todo_ids):
+    """Toggle several todo items and return the updated todos, or None on failure."""
+    try:
+        return await db.toggle_todos(todo_ids)
+    except Exception as e:
+        print(f"Toggle todos error: {e}")
+        return None
+
+async def delete_todos(todo_ids):
+    """Delete several todo items and return the deleted ids, or None on failure."""
+    try:
+        return await db.delete_todos(todo_ids)
+    except Exception as e:
+        print(f"Delete todos error: {e}")
+        return None
+
+async def complete_all():
+    """Complete all todo items and return the updated todos, or None on failure."""
+    try:
+        return await db.complete_all()
+    except Exception as e:
+        print(f"Complete all error: {e}")
+        return None
+
+async def clear_completed():
+    """Delete all completed todo items and return their ids, or None on failure."""
+    try:
+        return await db.clear_completed()
+    except Exception as e:
+        print(f"Clear completed error: {e}")
+        return None
+
+# Comment sent on an idle event stream, so proxies don't close it
+EVENTS_KEEPALIVE_SECONDS = 15
+
+# Initialize Quart app
+app = Quart(__name__)
+app.secret_key = os.getenv('SECRET_KEY', 'dev-secret-key')
+
+@app.before_serving
+async def startup():
+    # The pool and its background tasks live on the server's event loop
+    if not await init_database():
+        print("Failed to initialize database")
+
+@app.after_serving
+async def shutdown():
+    await db.close_pool()
+
+@app.route('/')
+async def index():
+    """Main page showing the first page of todos, or the page after `cursor`."""
+    todos, next_cursor = await get_todos(request.args.get('cursor'))
+    return await render_template('index.html', todos=todos, next_cursor=next_cursor)
+
+@app.route('/todos')
+async def todos_page():
+    """The page of todos after `cursor`, as HTML to append to the list."""
+    todos, next_cursor = await get_todos(request.args.get('cursor'))
+    return await render_template('_todo_items.html', todos=todos, next_cursor=next_cursor)
+
+@app.route('/add', methods=['POST'])
+async def add_todo_route():
+    """Add a new todo item."""
+    task = (await request.form).get('task', '').strip()
+    if task:
+        if await add_todo(task):
+            await flash('Todo added successfully!', 'success')
+        else:
+            await flash('Failed to add todo.', 'error')
+    else:
+        await flash('Please enter a task.', 'error')
+    return redirect(url_for('index'))
+
+@app.route('/toggle/<int:todo_id>')
+async def toggle_todo_route(todo_id):
+    """Toggle the completed status of a todo item."""
+    if await toggle_todo(todo_id):
+        await flash('Todo updated successfully!', 'success')
+    else:
+        await flash('Failed to update todo.', 'error')
+    return redirect(url_for('index'))
+
+@app.route('/delete/<int:todo_id>')
+async def delete_todo_route(todo_id):
+    """Delete a todo item."""
+    if await delete_todo(todo_id):
+        await flash('Todo deleted successfully!', 'success')
+    else:
+        await flash('Failed to delete todo.', 'error')
+    return redirect(url_for('index'))
+
+@app.route('/import', methods=['POST'])
+async def import_todos_route():
+    """Add the todos in an uploaded CSV file."""
+    file = (await request.files).get('file')
+    if not file or not file.filename:
+        await flash('Please choose a CSV file.', 'error')
+        return redirect(url_for('index'))
+    count = await import_todos(io.TextIOWrapper(file.stream, encoding='utf-8-sig', newline=''))
+    if count is None:
+        await flash('Failed to import todos.', 'error')
+    else:
+        await flash(f'Imported {count} todos!', 'success')
+    return redirect(url_for('index'))
+
+@app.route('/bulk', methods=['POST'])
+async def bulk_todos_route():
+    """Toggle or delete the selected todo items, complete them all, or clear the completed ones."""
+    form = await request.form
+    action = form.get('action')
+    todo_ids = form.getlist('todo_ids', type=int)
+    if action == 'complete_all':
+        result = await complete_all()
+        message = 'Completed {} todos!'
+    elif action == 'clear_completed':
+        result = await clear_completed()
+        message = 'Deleted {} completed todos!'
+    elif not todo_ids:
+        await flash('Please select some todos.', 'error')
+        return redirect(url_for('index'))
+    elif action == 'toggle':
+        result = await toggle_todos(todo_ids)
+        message = 'Updated {} todos!'
+    elif action == 'delete':
+        result = await delete_todos(todo_ids)
+        message = 'Deleted {} todos!'
+    else:
+        await flash('Unknown action.', 'error')
+        return redirect(url_for('index'))
+    if result is None:
+        await flash('Failed to update todos.', 'error')
+    else:
+        await flash(message.format(len(result)), 'success')
+    return redirect(url_for('index'))
+
+async def todo_response(todo):
+    """JSON for a todo, with its rendered list item to patch into the page."""
+    todo_id, task, completed, created_at = todo
+    return jsonify(
+        todo={'id': todo_id, 'task': task, 'completed': completed, 'created_at': created_at.isoformat()},
+        html=await render_template('_todo_item.html', todo=todo)
+    )
+
+@app.route('/api/todos', methods=['POST'])
+async def add_todo_api():
+    """Add a new todo item and return it."""
+    task = (await request.form).get('task', '').strip()
+    if not task:
+        return jsonify(error='Please enter a task.'), 400
+    todo = await add_todo(task)
+    if todo is None:
+        return jsonify(error='Failed to add todo.'), 500
+    return await todo_response(todo), 201
+
+@app.route('/api/todos/<int:todo_id>/toggle', methods=['POST'])
+async def toggle_todo_api(todo_id):
+    """Toggle the completed status of a todo item and return it."""
+    # Calls db directly to tell a missing todo (404) from a failure (500)
+    try:
+        todo = await db.toggle_todo(todo_id)
+    except Exception as e:
+        print(f"Toggle todo error: {e}")
+        return jsonify(error='Failed to update todo.'), 500
+    if todo is None:
+        return jsonify(error='Todo not found.'), 404
+    return await todo_response(todo)
+
+@app.route('/api/todos/<int:todo_id>', methods=['DELETE'])
+async def delete_todo_api(todo_id):
+    """Delete a todo item."""
+    try:
+        deleted = await db.delete_todo(todo_id)
+    except Exception as e:
+        print(f"Delete todo error: {e}")
+        return jsonify(error='Failed to delete todo.'), 500
+    if not deleted:
+        return jsonify(error='Todo not found.'), 404
+    return jsonify(id=todo_id)
+
+@app.route('/events')
+async def todo_events():
+    """
+    Changes to the todos made by any user, as server-sent events. Changed
+    todos are sent with their rendered list item, deleted ones by id.
+    """
+    subscription = db.subscribe()
+
+    @stream_with_context
+    async def stream():
+        while True:
+            events = await subscription.get(timeout=EVENTS_KEEPALIVE_SECONDS)
+            if not events:
+                yield ": keepalive\n\n"
+            for event in events:
+                if 'todos' in event:
+                    event['todos'] = [
+                        {'id': todo[0], 'html': await render_template('_todo_item.html', todo=todo)}
+                        for todo in event['todos']
+                    ]
+                yield f"data: {json.dumps(event)}\n\n"
+
+    response = await make_response(stream(), {
+        'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # The stream stays open for as long as the page does
+    response.timeout = None
+    return response
+
+@app.route('/health')
+async def health():
+    """Connection pool statistics, for monitoring."""
+    return jsonify(db.pool_stats())
+
+if __name__ == '__main__':
+    app.run(debug=True, host='0.0.0.0', port=int(os.getenv('PORT', 8080)))
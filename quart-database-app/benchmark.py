@@ -0,0 +1,216 @@
+"""
+Throughput benchmark of the async (Quart) todo app against the sync (Flask) one.
+
+For each concurrency level, keeps that many requests in flight against each
+server for --duration seconds and reports requests per second, latency
+percentiles, errors and the time requests spent waiting for a pooled
+connection (from the apps' /health endpoint).
+
+By default both apps are started as subprocesses on free ports, the sync one
+with Flask's threaded server and the async one with hypercorn, using the
+usual PG* variables (and the Databricks credentials that provide the OAuth
+token). Pass --sync-url and --async-url to benchmark servers that are
+already running instead. The python running this script needs the
+requirements of both apps. Write requests add todos named "benchmark N";
+they are left in the table.
+
+Usage:
+    python benchmark.py --concurrency 1,10,50,100,200 --duration 10 --scenario mixed
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.parse
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SYNC_APP_DIR = os.path.join(HERE, "..", "flask-database-app")
+
+# One request in WRITE_EVERY is a write in the mixed scenario
+WRITE_EVERY = 5
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[idx]
+
+
+def _summarize(values):
+    if not values:
+        return {}
+    return {
+        "mean": statistics.fmean(values),
+        "p50": _percentile(values, 50),
+        "p95": _percentile(values, 95),
+        "p99": _percentile(values, 99),
+        "max": max(values),
+    }
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _get_json(url):
+    with urllib.request.urlopen(url, timeout=10) as response:
+        return json.load(response)
+
+
+def start_server(command, app_dir, url, env):
+    process = subprocess.Popen(command, cwd=app_dir, env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            # The async app only opens its pool once it serves, so wait for it
+            if _get_json(f"{url}/health"):
+                return process
+        except OSError:
+            pass
+        time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"{' '.join(command)} did not start")
+
+
+async def _request(host, port, method, path, body=None):
+    """Send one HTTP/1.1 request on a new connection and return the status code."""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        head = f"{method} {path} HTTP/1.1\r\nHost: {host}:{port}\r\nConnection: close\r\n"
+        data = b""
+        if body is not None:
+            data = urllib.parse.urlencode(body).encode()
+            head += f"Content-Type: application/x-www-form-urlencoded\r\nContent-Length: {len(data)}\r\n"
+        writer.write(head.encode() + b"\r\n" + data)
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        # The server closes the connection after the response
+        while await reader.read(65536):
+            pass
+        return status
+    finally:
+        writer.close()
+
+
+async def run_level(url, scenario, concurrency, duration):
+    parsed = urllib.parse.urlsplit(url)
+    host, port = parsed.hostname, parsed.port or 80
+    counter = itertools.count()
+    latencies = []
+    errors = []
+    deadline = time.monotonic() + duration
+
+    async def worker():
+        while time.monotonic() < deadline:
+            n = next(counter)
+            if scenario == "write" or (scenario == "mixed" and n % WRITE_EVERY == 0):
+                request = ("POST", "/api/todos", {"task": f"benchmark {n}"})
+            else:
+                request = ("GET", "/", None)
+            start = time.perf_counter()
+            try:
+                status = await _request(host, port, *request)
+            except Exception as e:
+                errors.append(str(e))
+                continue
+            if status >= 400:
+                errors.append(f"HTTP {status} from {request[0]} {request[1]}")
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - start
+
+
+def benchmark(name, url, scenario, levels, duration):
+    results = []
+    for concurrency in levels:
+        before = _get_json(f"{url}/health")
+        latencies, errors, wall = asyncio.run(run_level(url, scenario, concurrency, duration))
+        after = _get_json(f"{url}/health")
+        checkouts = after.get("requests_num", 0) - before.get("requests_num", 0)
+        pool_wait_ms = after.get("requests_wait_ms", 0) - before.get("requests_wait_ms", 0)
+        result = {
+            "server": name,
+            "concurrency": concurrency,
+            "requests": len(latencies),
+            "errors": len(errors),
+            "requests_per_second": len(latencies) / wall if wall else None,
+            "latency_ms": {k: v * 1000 for k, v in _summarize(latencies).items()},
+            "pool_wait_ms_per_checkout": pool_wait_ms / checkouts if checkouts else None,
+        }
+        results.append(result)
+        print(f"{name:>5} c={concurrency:<4} {result['requests_per_second']:8.1f} req/s  "
+              f"p50 {result['latency_ms'].get('p50', 0):7.1f} ms  "
+              f"p99 {result['latency_ms'].get('p99', 0):7.1f} ms  errors {len(errors)}", file=sys.stderr)
+        if errors:
+            print(f"First errors: {errors[:3]}", file=sys.stderr)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default="1,10,50,100,200",
+                        help="Comma-separated numbers of requests kept in flight")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds per concurrency level and server")
+    parser.add_argument("--scenario", choices=["read", "write", "mixed"], default="mixed",
+                        help=f"GET /, POST /api/todos, or one write in {WRITE_EVERY} requests")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Disable the todo page cache of the started servers, so every read queries Postgres")
+    parser.add_argument("--sync-url", help="URL of a running sync app instead of starting one")
+    parser.add_argument("--async-url", help="URL of a running async app instead of starting one")
+    parser.add_argument("--json", help="Write the report to this file as JSON")
+    args = parser.parse_args()
+
+    levels = [int(level) for level in args.concurrency.split(",")]
+    env = dict(os.environ)
+    if args.no_cache:
+        env["TODO_CACHE_MAX_PAGES"] = "0"
+    processes = []
+    try:
+        sync_url = args.sync_url
+        if not sync_url:
+            port = _free_port()
+            sync_url = f"http://127.0.0.1:{port}"
+            processes.append(start_server(
+                [sys.executable, "-m", "flask", "--app", "app", "run", "--port", str(port)],
+                SYNC_APP_DIR, sync_url, env))
+        async_url = args.async_url
+        if not async_url:
+            port = _free_port()
+            async_url = f"http://127.0.0.1:{port}"
+            processes.append(start_server(
+                [sys.executable, "-m", "hypercorn", "app:app", "--bind", f"127.0.0.1:{port}"],
+                HERE, async_url, env))
+
+        report = {
+            "scenario": args.scenario,
+            "duration_seconds": args.duration,
+            "results": (benchmark("sync", sync_url, args.scenario, levels, args.duration)
+                        + benchmark("async", async_url, args.scenario, levels, args.duration)),
+        }
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
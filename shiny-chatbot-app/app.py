@@ -1,7 +1,9 @@
 # Shiny for Python LLM Chat Example with Databricks
+import asyncio
 import os
 from shiny import App, ui, reactive
-from model_serving_utils import query_endpoint, is_endpoint_supported
+from model_serving_utils import query_endpoint_stream, is_endpoint_supported
+from serving_metrics import start_metrics_exporter
 
 # Ensure environment variable is set correctly
 SERVING_ENDPOINT = os.getenv("SERVING_ENDPOINT")
@@ -15,6 +17,20 @@ assert SERVING_ENDPOINT, \
 # Check if the endpoint is supported
 endpoint_supported = is_endpoint_supported(SERVING_ENDPOINT)
 
+# Expose streaming latency metrics on METRICS_PORT, if set
+start_metrics_exporter()
+
+
+async def stream_in_thread(chunks):
+    """Iterate a blocking generator in a worker thread so the event loop can serve other sessions."""
+    done = object()
+    while True:
+        chunk = await asyncio.to_thread(next, chunks, done)
+        if chunk is done:
+            return
+        yield chunk
+
+
 if not endpoint_supported:
     app_ui = ui.page_fillable(
         ui.panel_title(ui.h1("Databricks LLM Chat")),
@@ -41,7 +57,7 @@ else:
         ui.markdown(
             "Note: this is a simple example. See "
             "[Databricks docs](https://docs.databricks.com/aws/en/generative-ai/agent-framework/chat-app) "
-            "for a more comprehensive example, with support for streaming output and more."
+            "for a more comprehensive example, with support for agent tool calls and more."
         ),
         ui.panel_title(
             ui.row(
@@ -67,12 +83,12 @@ def server(input, output, session):
         @chat.on_user_submit
         async def _():
             messages = chat.messages(format="openai")
-            response = query_endpoint(
+            response = query_endpoint_stream(
                 endpoint_name=SERVING_ENDPOINT,
                 messages=messages,
                 max_tokens=400
             )
-            await chat.append_message(response)
+            await chat.append_message_stream(stream_in_thread(response))
 
 app = App(app_ui, server)
 
@@ -1,17 +1,16 @@
+import time
 from mlflow.deployments import get_deploy_client
-from databricks.sdk import WorkspaceClient
+from endpoint_registry import get_endpoint_registry, is_client_error
+from response_cache import get_response_cache
+from serving_metrics import ENDPOINT_LOOKUP_SECONDS, instrument_stream
 
 def _get_endpoint_task_type(endpoint_name: str) -> str:
-    """Get the task type of a serving endpoint."""
-    w = WorkspaceClient()
-    ep = w.serving_endpoints.get(endpoint_name)
-    return ep.task
+    """Get the task type of a serving endpoint, cached across chat turns."""
+    return get_endpoint_registry().task_type(endpoint_name)
 
 def is_endpoint_supported(endpoint_name: str) -> bool:
     """Check if the endpoint has a supported task type."""
-    task_type = _get_endpoint_task_type(endpoint_name)
-    supported_task_types = ["agent/v1/chat", "agent/v2/chat", "llm/v1/chat"]
-    return task_type in supported_task_types
+    return get_endpoint_registry().is_supported(endpoint_name)
 
 def _validate_endpoint_task_type(endpoint_name: str) -> None:
     """Validate that the endpoint has a supported task type."""
@@ -27,10 +26,16 @@ def _query_endpoint(endpoint_name: str, messages: list[dict[str, str]], max_toke
     """Calls a model serving endpoint."""
     _validate_endpoint_task_type(endpoint_name)
     
-    res = get_deploy_client('databricks').predict(
-        endpoint=endpoint_name,
-        inputs={'messages': messages, "max_tokens": max_tokens},
-    )
+    try:
+        res = get_deploy_client('databricks').predict(
+            endpoint=endpoint_name,
+            inputs={'messages': messages, "max_tokens": max_tokens},
+        )
+    except Exception as e:
+        # The endpoint may have been redeployed; look up its task type again next time
+        if is_client_error(e):
+            get_endpoint_registry().invalidate(endpoint_name)
+        raise
     if "messages" in res:
         return res["messages"]
     elif "choices" in res:
@@ -41,5 +46,98 @@ def _query_endpoint(endpoint_name: str, messages: list[dict[str, str]], max_toke
                     "in https://docs.databricks.com/aws/en/generative-ai/agent-framework/author-agent")
 
 
+def _reply_message(messages):
+    """
+    The assistant's reply among the messages of a response. Agents may answer
+    with several assistant messages, whose text is joined as _stream_content
+    joins it, so a reply reads the same whether or not it was streamed.
+    """
+    if len(messages) == 1:
+        return messages[0]
+    contents = [message["content"] for message in messages
+                if message.get("role") == "assistant" and message.get("content")]
+    if not contents:
+        return messages[-1]
+    return {"role": "assistant", "content": "\n\n".join(contents)}
+
 def query_endpoint(endpoint_name, messages, max_tokens):
-    return _query_endpoint(endpoint_name, messages, max_tokens)[-1]
+    cache = get_response_cache()
+    # Only cache plain chat models; agents may call tools, so their answers vary
+    if cache is None or _get_endpoint_task_type(endpoint_name) != "llm/v1/chat":
+        return _reply_message(_query_endpoint(endpoint_name, messages, max_tokens))
+
+    cache_endpoint = f"{endpoint_name}:max_tokens={max_tokens}"
+    cached_message = cache.get(cache_endpoint, messages)
+    if cached_message is not None:
+        return cached_message
+    message = _reply_message(_query_endpoint(endpoint_name, messages, max_tokens))
+    if not message.get("tool_calls"):
+        cache.put(cache_endpoint, messages, message)
+    return message
+
+def _stream_content(endpoint_name, messages, max_tokens):
+    """Yield the assistant text of a streamed chat completions or ChatAgent response."""
+    stream = get_deploy_client('databricks').predict_stream(
+        endpoint=endpoint_name,
+        inputs={'messages': messages, "max_tokens": max_tokens},
+    )
+    message_id = None
+    for chunk in stream:
+        if chunk.get("choices"):
+            content = chunk["choices"][0].get("delta", {}).get("content")
+        elif "delta" in chunk:
+            delta = chunk["delta"]
+            if delta.get("role") != "assistant":
+                continue
+            content = delta.get("content")
+            if not content:
+                continue
+            # Agents may stream several assistant messages; separate them as _reply_message does
+            if message_id is not None and delta.get("id") != message_id:
+                yield "\n\n"
+            message_id = delta.get("id")
+        else:
+            continue
+        if content:
+            yield content
+
+def query_endpoint_stream(endpoint_name, messages, max_tokens):
+    """
+    Query a chat-completions or agent serving endpoint, yielding the assistant's
+    reply as text chunks as soon as they are generated.
+    Falls back to a single chunk with the whole reply if the endpoint can't stream.
+    Streams from the endpoint are timed with serving_metrics.
+    """
+    lookup_start = time.perf_counter()
+    _validate_endpoint_task_type(endpoint_name)
+    task_type = _get_endpoint_task_type(endpoint_name)
+    lookup_seconds = time.perf_counter() - lookup_start
+    ENDPOINT_LOOKUP_SECONDS.observe(lookup_seconds)
+
+    cache = get_response_cache()
+    # Only cache plain chat models; agents may call tools, so their answers vary
+    if cache is not None and task_type != "llm/v1/chat":
+        cache = None
+    cache_endpoint = f"{endpoint_name}:max_tokens={max_tokens}"
+    if cache is not None:
+        cached_message = cache.get(cache_endpoint, messages)
+        if cached_message is not None:
+            yield cached_message["content"]
+            return
+
+    parts = []
+    try:
+        stream = _stream_content(endpoint_name, messages, max_tokens)
+        for content in instrument_stream(stream, endpoint_name, task_type, lookup_seconds):
+            parts.append(content)
+            yield content
+    except Exception as e:
+        if is_client_error(e):
+            get_endpoint_registry().invalidate(endpoint_name)
+        if parts:
+            raise
+        # Nothing was streamed yet, so retry without streaming
+        yield query_endpoint(endpoint_name, messages, max_tokens)["content"]
+        return
+    if cache is not None:
+        cache.put(cache_endpoint, messages, {"role": "assistant", "content": "".join(parts)})
@@ -1,17 +1,14 @@
 from mlflow.deployments import get_deploy_client
-from databricks.sdk import WorkspaceClient
+from endpoint_registry import get_endpoint_registry, is_client_error
+from response_cache import get_response_cache
 
 def _get_endpoint_task_type(endpoint_name: str) -> str:
-    """Get the task type of a serving endpoint."""
-    w = WorkspaceClient()
-    ep = w.serving_endpoints.get(endpoint_name)
-    return ep.task
+    """Get the task type of a serving endpoint, cached across chat turns."""
+    return get_endpoint_registry().task_type(endpoint_name)
 
 def is_endpoint_supported(endpoint_name: str) -> bool:
     """Check if the endpoint has a supported task type."""
-    task_type = _get_endpoint_task_type(endpoint_name)
-    supported_task_types = ["agent/v1/chat", "agent/v2/chat", "llm/v1/chat"]
-    return task_type in supported_task_types
+    return get_endpoint_registry().is_supported(endpoint_name)
 
 def _validate_endpoint_task_type(endpoint_name: str) -> None:
     """Validate that the endpoint has a supported task type."""
@@ -27,10 +24,16 @@ def _query_endpoint(endpoint_name: str, messages: list[dict[str, str]], max_toke
     """Calls a model serving endpoint."""
     _validate_endpoint_task_type(endpoint_name)
     
-    res = get_deploy_client('databricks').predict(
-        endpoint=endpoint_name,
-        inputs={'messages': messages, "max_tokens": max_tokens},
-    )
+    try:
+        res = get_deploy_client('databricks').predict(
+            endpoint=endpoint_name,
+            inputs={'messages': messages, "max_tokens": max_tokens},
+        )
+    except Exception as e:
+        # The endpoint may have been redeployed; look up its task type again next time
+        if is_client_error(e):
+            get_endpoint_registry().invalidate(endpoint_name)
+        raise
     if "messages" in res:
         return res["messages"]
     elif "choices" in res:
@@ -46,4 +49,16 @@ def query_endpoint(endpoint_name, messages, max_tokens):
     If querying an agent serving endpoint that returns multiple messages, this method
     returns the last message
     ."""
-    return _query_endpoint(endpoint_name, messages, max_tokens)[-1]
+    cache = get_response_cache()
+    # Only cache plain chat models; agents may call tools, so their answers vary
+    if cache is None or _get_endpoint_task_type(endpoint_name) != "llm/v1/chat":
+        return _query_endpoint(endpoint_name, messages, max_tokens)[-1]
+
+    cache_endpoint = f"{endpoint_name}:max_tokens={max_tokens}"
+    cached_message = cache.get(cache_endpoint, messages)
+    if cached_message is not None:
+        return cached_message
+    message = _query_endpoint(endpoint_name, messages, max_tokens)[-1]
+    if not message.get("tool_calls"):
+        cache.put(cache_endpoint, messages, message)
+    return message
@@ -1,131 +1,147 @@
-import streamlit as st
-import psycopg
-import os
-import time
-import re
-from databricks import sdk
-from psycopg import sql
-from psycopg_pool import ConnectionPool
+import io
 
-# Database connection setup
-workspace_client = sdk.WorkspaceClient()
-postgres_password = None
-last_password_refresh = 0
-connection_pool = None
+import streamlit as st
+from db import (add_todo, get_todos, toggle_todo, delete_todo, toggle_todos, delete_todos, complete_all,
+                clear_completed, import_todos, subscribe, pool_stats)
+import db
 
-def refresh_oauth_token():
-    """Refresh OAuth token if expired."""
-    global postgres_password, last_password_refresh
-    if postgres_password is None or time.time() - last_password_refresh > 900:
-        print("Refreshing PostgreSQL OAuth token")
-        try:
-            postgres_password = workspace_client.config.oauth_token().access_token
-            last_password_refresh = time.time()
-        except Exception as e:
-            st.error(f"❌ Failed to refresh OAuth token: {str(e)}")
-            st.stop()
+# How often each session checks for changes pushed by the database
+TODO_EVENTS_CHECK_SECONDS = 1
 
-def get_connection_pool():
-    """Get or create the connection pool."""
-    global connection_pool
-    if connection_pool is None:
-        refresh_oauth_token()
-        conn_string = (
-            f"dbname={os.getenv('PGDATABASE')} "
-            f"user={os.getenv('PGUSER')} "
-            f"password={postgres_password} "
-            f"host={os.getenv('PGHOST')} "
-            f"port={os.getenv('PGPORT')} "
-            f"sslmode={os.getenv('PGSSLMODE', 'require')} "
-            f"application_name={os.getenv('PGAPPNAME')}"
-        )
-        connection_pool = ConnectionPool(conn_string, min_size=2, max_size=10)
-    return connection_pool
-
-def get_connection():
-    """Get a connection from the pool."""
-    global connection_pool
-    
-    # Recreate pool if token expired
-    if postgres_password is None or time.time() - last_password_refresh > 900:
-        if connection_pool:
-            connection_pool.close()
-            connection_pool = None
-    
-    return get_connection_pool().connection()
-
-def get_schema_name():
-    """Get the schema name in the format {PGAPPNAME}_schema_{PGUSER}."""
-    pgappname = os.getenv("PGAPPNAME", "my_app")
-    pguser = os.getenv("PGUSER", "").replace('-', '')
-    return f"{pgappname}_schema_{pguser}"
+@st.cache_resource
+def _init_database_once():
+    # Failures aren't cached, so they are retried on the next run
+    db.init_database()
 
 def init_database():
     """Initialize database schema and table."""
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            schema_name = get_schema_name()
-            
-            cur.execute(sql.SQL("CREATE SCHEMA IF NOT EXISTS {}").format(sql.Identifier(schema_name)))
-            cur.execute(sql.SQL("""
-                CREATE TABLE IF NOT EXISTS {}.todos (
-                    id SERIAL PRIMARY KEY,
-                    task TEXT NOT NULL,
-                    completed BOOLEAN DEFAULT FALSE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """).format(sql.Identifier(schema_name)))
-            conn.commit()
-            return True
+    try:
+        _init_database_once()
+        return True
+    except Exception as e:
+        st.error(f"❌ Failed to initialize database: {str(e)}")
+        return False
 
-def add_todo(task):
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            schema = get_schema_name()
-            cur.execute(sql.SQL("INSERT INTO {}.todos (task) VALUES (%s)").format(sql.Identifier(schema)), (task.strip(),))
-            conn.commit()
+def replace_todo(todo):
+    """Replace a todo in the loaded list with its updated row."""
+    todos = st.session_state.todos
+    for i, (todo_id, *_) in enumerate(todos):
+        if todo_id == todo[0]:
+            todos[i] = todo
+            break
 
-def get_todos():
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            schema = get_schema_name()
-            cur.execute(sql.SQL("SELECT id, task, completed, created_at FROM {}.todos ORDER BY created_at DESC").format(sql.Identifier(schema)))
-            return cur.fetchall()
+def replace_todos(todos):
+    """Replace the loaded ones of several todos with their updated rows."""
+    updated = {todo[0]: todo for todo in todos}
+    st.session_state.todos = [updated.get(todo[0], todo) for todo in st.session_state.todos]
+    for todo_id, *_ in st.session_state.todos:
+        if todo_id in updated:
+            # Let the checkbox show the new status instead of its own state
+            st.session_state.pop(f"check_{todo_id}", None)
 
-def toggle_todo(todo_id):
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            schema = get_schema_name()
-            cur.execute(sql.SQL("UPDATE {}.todos SET completed = NOT completed WHERE id = %s").format(sql.Identifier(schema)), (todo_id,))
-            conn.commit()
+def remove_todos(todo_ids):
+    """Remove todos from the loaded list."""
+    todo_ids = set(todo_ids)
+    st.session_state.todos = [todo for todo in st.session_state.todos if todo[0] not in todo_ids]
 
+def apply_todo_event(event):
+    """
+    Apply a change pushed by the database to the loaded todos. Returns whether
+    they changed, which they don't for this session's own writes, as those
+    were applied already.
+    """
+    if event["op"] == "RELOAD":
+        st.session_state.pop("todos", None)
+        return True
+    changed = False
+    if event["op"] == "DELETE":
+        count = len(st.session_state.todos)
+        remove_todos(event["ids"])
+        changed = len(st.session_state.todos) != count
+    loaded = {todo[0]: todo for todo in st.session_state.todos}
+    for todo in event.get("todos", []):
+        if todo[0] in loaded:
+            if loaded[todo[0]] != todo:
+                replace_todo(todo)
+                # Let the checkbox show the new status instead of its own state
+                st.session_state.pop(f"check_{todo[0]}", None)
+                changed = True
+        elif event["op"] == "INSERT":
+            st.session_state.todos.insert(0, todo)
+            changed = True
+    return changed
 
-def delete_todo(todo_id):
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            schema = get_schema_name()
-            cur.execute(sql.SQL("DELETE FROM {}.todos WHERE id = %s").format(sql.Identifier(schema)), (todo_id,))
-            conn.commit()
+@st.fragment(run_every=TODO_EVENTS_CHECK_SECONDS)
+def watch_todo_events():
+    """
+    Apply the changes pushed by the database, e.g. made by other users, to
+    the loaded todos. Streamlit can only update a session from a script run,
+    so this fragment checks on a timer. Checking only looks at this session's
+    subscription, not the database, and the app reruns only when the loaded
+    todos changed.
+    """
+    if "todo_events" not in st.session_state:
+        st.session_state.todo_events = subscribe()
+        return
+    events = st.session_state.todo_events.get(timeout=0)
+    if not events or "todos" not in st.session_state:
+        return
+    # Our own changes come back too, so applying a change twice must be harmless
+    changed = False
+    for event in events:
+        if "todos" not in st.session_state:
+            break
+        changed = apply_todo_event(event) or changed
+    if changed:
+        st.rerun()
 
 @st.fragment
 def display_todos():
     st.subheader("📋 Your Todos")
     
-    todos = get_todos()
+    # The loaded todos are kept in session state and updated with the row
+    # returned by each write, instead of being queried again on every rerun
+    if "todos" not in st.session_state:
+        st.session_state.todos, st.session_state.next_cursor = get_todos()
+    todos = st.session_state.todos
     
-    if not todos:
+    if not todos and st.session_state.next_cursor is None:
         st.info("🎉 No todos yet! Add one above to get started.")
     else:
+        selected = [todo_id for todo_id, *_ in todos if st.session_state.get(f"select_{todo_id}")]
+        col1, col2, col3, col4, _ = st.columns([0.2, 0.2, 0.2, 0.2, 0.2])
+        with col1:
+            if st.button("✓ Toggle selected", key="toggle_selected", disabled=not selected):
+                replace_todos(toggle_todos(selected))
+                st.rerun(scope="fragment")
+        with col2:
+            if st.button("🗑️ Delete selected", key="delete_selected", disabled=not selected):
+                remove_todos(delete_todos(selected))
+                st.rerun(scope="fragment")
+        with col3:
+            # Completes the todos not loaded yet too
+            if st.button("✓ Complete all", key="complete_all"):
+                replace_todos(complete_all())
+                st.rerun(scope="fragment")
+        with col4:
+            if st.button("🧹 Clear completed", key="clear_completed"):
+                remove_todos(clear_completed())
+                st.rerun(scope="fragment")
+        
         for todo_id, task, completed, created_at in todos:
-            col1, col2, col3 = st.columns([0.1, 0.7, 0.2])
+            col0, col1, col2, col3 = st.columns([0.05, 0.05, 0.7, 0.2])
+            
+            with col0:
+                # Selects the todo for "Toggle selected" and "Delete selected"
+                st.checkbox("Select", key=f"select_{todo_id}", label_visibility="collapsed")
             
             with col1:
-                if st.checkbox("", value=completed, key=f"check_{todo_id}"):
-                    if not completed:
-                        toggle_todo(todo_id)
-                        st.rerun(scope="fragment")
-                elif completed:
-                    toggle_todo(todo_id)
+                if st.checkbox("", value=completed, key=f"check_{todo_id}") != completed:
+                    todo = toggle_todo(todo_id)
+                    if todo:
+                        replace_todo(todo)
+                    else:
+                        remove_todos([todo_id])
                     st.rerun(scope="fragment")
             
             with col2:
@@ -135,7 +151,13 @@ def display_todos():
             with col3:
                 if st.button("🗑️", key=f"delete_{todo_id}"):
                     delete_todo(todo_id)
+                    remove_todos([todo_id])
                     st.rerun(scope="fragment")
+        
+        if st.session_state.next_cursor is not None and st.button("Load more", key="load_more"):
+            page, st.session_state.next_cursor = get_todos(st.session_state.next_cursor)
+            st.session_state.todos += page
+            st.rerun(scope="fragment")
 
 
 # Streamlit UI
@@ -160,12 +182,29 @@ def main():
         submitted = st.form_submit_button("Add Todo", type="primary")
         
         if submitted and new_task.strip():
-            if add_todo(new_task.strip()):
+            todo = add_todo(new_task.strip())
+            if todo:
+                if "todos" in st.session_state:
+                    st.session_state.todos.insert(0, todo)
                 st.success("✅ Todo added successfully!")
     
+    with st.form("import_todos_form", clear_on_submit=True):
+        csv_file = st.file_uploader("Import from CSV (task, completed):", type="csv")
+        
+        if st.form_submit_button("Import") and csv_file is not None:
+            count = import_todos(io.StringIO(csv_file.getvalue().decode("utf-8-sig"), newline=""))
+            # Load the first page again to show the imported todos
+            st.session_state.pop("todos", None)
+            st.success(f"✅ Imported {count} todos!")
+    
     st.markdown("---")
     
+    # Subscribe before the todos are first loaded, so no change is missed
+    watch_todo_events()
     display_todos()
 
+    with st.sidebar.expander("Connection pool"):
+        st.json(pool_stats())
+
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,620 @@
+"""
+Database access for the todo app templates.
+
+This module is shared by the Dash, Flask and Streamlit database apps, with an
+identical copy in each app. It owns a single connection pool per process,
+created lazily under a lock so concurrent requests can't race to build it.
+New connections authenticate with an OAuth token that a background thread
+refreshes ahead of expiry. Pooled connections are replaced gradually after
+PG_POOL_MAX_LIFETIME_SECONDS, and idle connections are checked periodically
+so broken ones are replaced before a request gets them.
+
+The pool is configured through environment variables:
+
+- PG_POOL_MIN_SIZE: connections kept open (default 2).
+- PG_POOL_MAX_SIZE: maximum number of connections (default 10).
+- PG_POOL_TIMEOUT_SECONDS: how long a request waits for a connection (default 30).
+- PG_POOL_MAX_LIFETIME_SECONDS: age at which a connection is replaced (default 1800).
+- PG_POOL_CHECK_INTERVAL_SECONDS: how often idle connections are checked (default 60).
+
+Todos are listed a page of TODO_PAGE_SIZE (default 50) at a time, newest
+first, using keyset pagination on (created_at, id). Bulk operations take one
+statement each: imports stream rows with COPY, and bulk toggles and deletes
+match an array of ids.
+
+Triggers installed by init_database() send a notification whenever the
+todos change, with the changed rows when there are few enough of them. A
+listener thread with its own connection receives them, so every replica sees
+writes from the others within milliseconds without polling. It passes them
+on to subscribers (see subscribe()), which push them to the UIs, and clears
+the cache of todo pages. Up to TODO_CACHE_MAX_PAGES pages (default 256, 0
+disables the cache) are cached in the process, and only while the listener
+is connected.
+
+Data access functions raise on errors; each app decides how to report them.
+"""
+import csv
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict, deque
+from datetime import datetime
+from functools import lru_cache
+
+import psycopg
+from databricks import sdk
+from psycopg import sql
+from psycopg_pool import ConnectionPool
+
+logger = logging.getLogger(__name__)
+
+TOKEN_REFRESH_INTERVAL = 900
+TOKEN_RETRY_INTERVAL = 30
+POOL_MIN_SIZE = int(os.getenv("PG_POOL_MIN_SIZE", "2"))
+POOL_MAX_SIZE = int(os.getenv("PG_POOL_MAX_SIZE", "10"))
+POOL_TIMEOUT = float(os.getenv("PG_POOL_TIMEOUT_SECONDS", "30"))
+POOL_MAX_LIFETIME = float(os.getenv("PG_POOL_MAX_LIFETIME_SECONDS", "1800"))
+POOL_CHECK_INTERVAL = float(os.getenv("PG_POOL_CHECK_INTERVAL_SECONDS", "60"))
+TODO_PAGE_SIZE = int(os.getenv("TODO_PAGE_SIZE", "50"))
+TODO_CACHE_MAX_PAGES = int(os.getenv("TODO_CACHE_MAX_PAGES", "256"))
+# How long the listener waits for a notification before checking its connection
+LISTENER_HEARTBEAT_INTERVAL = 30
+LISTENER_RETRY_INTERVAL = 5
+# Changes queued for a subscriber that doesn't keep up, before it is asked to reload instead
+SUBSCRIPTION_MAX_EVENTS = 1000
+
+_workspace_client = None
+_postgres_password = None
+_last_password_refresh = 0
+_token_lock = threading.Lock()
+
+_connection_pool = None
+_conninfo = None
+_pool_lock = threading.Lock()
+# Open connections, to report their age
+_connections = weakref.WeakSet()
+
+
+def refresh_oauth_token():
+    """Fetch a new OAuth token to authenticate new connections with."""
+    global _workspace_client, _postgres_password, _last_password_refresh
+    with _token_lock:
+        if _workspace_client is None:
+            _workspace_client = sdk.WorkspaceClient()
+        _postgres_password = _workspace_client.config.oauth_token().access_token
+        _last_password_refresh = time.time()
+
+
+def _refresh_oauth_token_periodically():
+    """Keep the OAuth token fresh so opening a connection never waits for it."""
+    while True:
+        time.sleep(max(_last_password_refresh + TOKEN_REFRESH_INTERVAL - time.time(), TOKEN_RETRY_INTERVAL))
+        try:
+            refresh_oauth_token()
+        except Exception as e:
+            # Keep using the current token and retry shortly
+            logger.warning(f"Failed to refresh OAuth token: {e}")
+
+
+def _check_pool_periodically(pool):
+    """Replace idle connections that were closed by the server or the network."""
+    while not pool.closed:
+        time.sleep(POOL_CHECK_INTERVAL)
+        try:
+            pool.check()
+        except Exception as e:
+            logger.warning(f"Connection pool check failed: {e}")
+
+
+class TodoCache:
+    """
+    Thread-safe LRU cache of todo pages, keyed by (cursor, limit). A page read
+    from the database is only stored if the cache wasn't cleared while it
+    was being read, so a read racing with a write can't store stale rows.
+    """
+
+    def __init__(self, max_pages=TODO_CACHE_MAX_PAGES):
+        self.max_pages = max_pages
+        self.listening = False
+        self.hits = 0
+        self.misses = 0
+        self._pages = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.listening and self.max_pages > 0
+
+    def get(self, key):
+        """Return (page, generation); page is None on a miss."""
+        with self._lock:
+            page = self._pages.get(key)
+            if page is None:
+                self.misses += 1
+                return None, self._generation
+            self.hits += 1
+            self._pages.move_to_end(key)
+            todos, next_cursor = page
+            # Callers may modify the list they get
+            return (list(todos), next_cursor), self._generation
+
+    def put(self, key, page, generation):
+        todos, next_cursor = page
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._pages[key] = (tuple(todos), next_cursor)
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.max_pages:
+                self._pages.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+            self._generation += 1
+
+
+_todo_cache = TodoCache()
+
+
+class TodoSubscription:
+    """
+    Changes to the todos, queued for one subscriber. Each change is a dict
+    with an "op" of:
+
+    - "INSERT" or "UPDATE", with the changed rows in "todos" as
+      (id, task, completed, created_at) tuples, oldest first.
+    - "DELETE", with the deleted ids in "ids".
+    - "RELOAD" when the changes are too large to send, or may have been
+      missed, so the subscriber should list the todos again.
+    """
+
+    def __init__(self, max_events=SUBSCRIPTION_MAX_EVENTS):
+        self.max_events = max_events
+        self._events = deque()
+        self._condition = threading.Condition()
+
+    def put(self, event):
+        with self._condition:
+            if len(self._events) >= self.max_events:
+                self._events.clear()
+                event = {"op": "RELOAD"}
+            self._events.append(event)
+            self._condition.notify_all()
+
+    def get(self, timeout=None):
+        """Wait up to `timeout` seconds for changes and return them, oldest first."""
+        with self._condition:
+            self._condition.wait_for(lambda: self._events, timeout)
+            events = list(self._events)
+            self._events.clear()
+            return events
+
+
+# Subscriptions are dropped once their subscriber no longer references them
+_subscriptions = weakref.WeakSet()
+_subscriptions_lock = threading.Lock()
+
+
+def subscribe():
+    """
+    Subscribe to changes to the todos made by any replica, including this
+    one. The listener is started if it isn't running yet.
+    """
+    get_connection_pool()
+    subscription = TodoSubscription()
+    with _subscriptions_lock:
+        _subscriptions.add(subscription)
+    return subscription
+
+
+def _publish(event):
+    with _subscriptions_lock:
+        subscriptions = list(_subscriptions)
+    for subscription in subscriptions:
+        subscription.put(event)
+
+
+def _parse_notification(payload):
+    try:
+        event = json.loads(payload)
+    except ValueError:
+        return {"op": "RELOAD"}
+    if "todos" in event:
+        event["todos"] = [(todo_id, task, completed, datetime.fromisoformat(created_at))
+                          for todo_id, task, completed, created_at in event["todos"]]
+    return event
+
+
+def _listen_for_changes():
+    """
+    Publish the changes to the todos made on any replica, and clear the todo
+    cache when they arrive. The cache is disabled while the listener is
+    disconnected, and subscribers are asked to reload after a reconnection,
+    since notifications may have been missed.
+    """
+    channel = get_notify_channel()
+    reconnecting = False
+    while True:
+        try:
+            with OAuthConnection.connect(_conninfo, autocommit=True) as conn:
+                conn.execute(sql.SQL("LISTEN {}").format(sql.Identifier(channel)))
+                # Writes made before LISTEN aren't notified
+                _todo_cache.clear()
+                _todo_cache.listening = True
+                if reconnecting:
+                    _publish({"op": "RELOAD"})
+                while True:
+                    for notify in conn.notifies(timeout=LISTENER_HEARTBEAT_INTERVAL):
+                        _todo_cache.clear()
+                        _publish(_parse_notification(notify.payload))
+                    # Fail on a dead connection instead of waiting on it forever
+                    conn.execute("SELECT 1")
+        except Exception as e:
+            logger.warning(f"Todo change listener disconnected: {e}")
+        finally:
+            _todo_cache.listening = False
+            _todo_cache.clear()
+        reconnecting = True
+        time.sleep(LISTENER_RETRY_INTERVAL)
+
+
+class OAuthConnection(psycopg.Connection):
+    """Connection that authenticates with the current OAuth token."""
+
+    @classmethod
+    def connect(cls, conninfo="", **kwargs):
+        kwargs["password"] = _postgres_password
+        conn = super().connect(conninfo, **kwargs)
+        conn.created_at = time.monotonic()
+        _connections.add(conn)
+        return conn
+
+
+def get_connection_pool():
+    """Get the connection pool, creating it on first use."""
+    global _connection_pool, _conninfo
+    if _connection_pool is None:
+        with _pool_lock:
+            if _connection_pool is None:
+                refresh_oauth_token()
+                threading.Thread(target=_refresh_oauth_token_periodically, daemon=True).start()
+                conn_string = (
+                    f"dbname={os.getenv('PGDATABASE')} "
+                    f"user={os.getenv('PGUSER')} "
+                    f"host={os.getenv('PGHOST')} "
+                    f"port={os.getenv('PGPORT')} "
+                    f"sslmode={os.getenv('PGSSLMODE', 'require')} "
+                    f"application_name={os.getenv('PGAPPNAME')}"
+                )
+                _conninfo = conn_string
+                pool = ConnectionPool(
+                    conn_string,
+                    connection_class=OAuthConnection,
+                    min_size=POOL_MIN_SIZE,
+                    max_size=POOL_MAX_SIZE,
+                    timeout=POOL_TIMEOUT,
+                    max_lifetime=POOL_MAX_LIFETIME,
+                    open=True,
+                )
+                threading.Thread(target=_check_pool_periodically, args=(pool,), daemon=True).start()
+                threading.Thread(target=_listen_for_changes, daemon=True).start()
+                _connection_pool = pool
+    return _connection_pool
+
+
+def get_connection():
+    """Get a connection from the pool, to use as a context manager."""
+    return get_connection_pool().connection()
+
+
+def pool_stats():
+    """
+    Statistics of the connection pool: psycopg_pool's counters (e.g.
+    requests_waiting, requests_wait_ms, usage_ms, pool_size, pool_available)
+    plus the age of the open connections and of the OAuth token.
+    """
+    if _connection_pool is None:
+        return {}
+    stats = dict(_connection_pool.get_stats())
+    now = time.monotonic()
+    ages = [now - conn.created_at for conn in list(_connections) if not conn.closed]
+    stats["connections_open"] = len(ages)
+    stats["connection_age_max_seconds"] = round(max(ages), 1) if ages else 0
+    stats["connection_age_avg_seconds"] = round(sum(ages) / len(ages), 1) if ages else 0
+    stats["token_age_seconds"] = round(time.time() - _last_password_refresh, 1)
+    stats["todo_cache_enabled"] = _todo_cache.enabled
+    stats["todo_cache_hits"] = _todo_cache.hits
+    stats["todo_cache_misses"] = _todo_cache.misses
+    return stats
+
+
+@lru_cache(maxsize=1)
+def get_schema_name():
+    """Get the schema name in the format {PGAPPNAME}_schema_{PGUSER}."""
+    pgappname = os.getenv("PGAPPNAME", "my_app")
+    pguser = os.getenv("PGUSER", "").replace('-', '')
+    return f"{pgappname}_schema_{pguser}"
+
+
+def get_notify_channel():
+    """Channel on which changes to the todos are notified."""
+    # Channel names are limited to 63 bytes, like identifiers
+    return f"{get_schema_name()}_todos".encode()[:63].decode(errors="ignore")
+
+
+_queries = None
+
+
+def _todo_queries(conn):
+    """
+    SQL of the todo operations for the app's schema, composed and rendered
+    once. Statements are run with prepare=True, so each connection parses
+    and plans them once and later calls only bind and execute.
+    """
+    global _queries
+    if _queries is None:
+        todos = sql.SQL("{}.todos").format(sql.Identifier(get_schema_name()))
+        queries = {
+            "add": sql.SQL("INSERT INTO {} (task) VALUES (%s) RETURNING id, task, completed, created_at"),
+            "list": sql.SQL(
+                "SELECT id, task, completed, created_at FROM {} "
+                "ORDER BY created_at DESC, id DESC LIMIT %s"),
+            "list_after": sql.SQL(
+                "SELECT id, task, completed, created_at FROM {} "
+                "WHERE (created_at, id) < (%s, %s) "
+                "ORDER BY created_at DESC, id DESC LIMIT %s"),
+            "toggle": sql.SQL(
+                "UPDATE {} SET completed = NOT completed WHERE id = %s "
+                "RETURNING id, task, completed, created_at"),
+            "set_completed": sql.SQL(
+                "UPDATE {} SET completed = %s WHERE id = %s AND completed IS DISTINCT FROM %s "
+                "RETURNING id, task, completed, created_at"),
+            "delete": sql.SQL("DELETE FROM {} WHERE id = %s RETURNING id"),
+            "toggle_many": sql.SQL(
+                "UPDATE {} SET completed = NOT completed WHERE id = ANY(%s) "
+                "RETURNING id, task, completed, created_at"),
+            "delete_many": sql.SQL("DELETE FROM {} WHERE id = ANY(%s) RETURNING id"),
+            "complete_all": sql.SQL(
+                "UPDATE {} SET completed = TRUE WHERE NOT completed "
+                "RETURNING id, task, completed, created_at"),
+            "clear_completed": sql.SQL("DELETE FROM {} WHERE completed RETURNING id"),
+            "import": sql.SQL("COPY {} (task, completed) FROM STDIN"),
+        }
+        _queries = {name: query.format(todos).as_string(conn) for name, query in queries.items()}
+    return _queries
+
+
+def init_database():
+    """Initialize database schema and table."""
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            schema_name = get_schema_name()
+
+            cur.execute(sql.SQL("CREATE SCHEMA IF NOT EXISTS {}").format(sql.Identifier(schema_name)))
+            cur.execute(sql.SQL("""
+                CREATE TABLE IF NOT EXISTS {}.todos (
+                    id SERIAL PRIMARY KEY,
+                    task TEXT NOT NULL,
+                    completed BOOLEAN DEFAULT FALSE,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """).format(sql.Identifier(schema_name)))
+            # Serves the keyset pagination in get_todos, scanned backwards
+            cur.execute(sql.SQL("CREATE INDEX IF NOT EXISTS todos_created_at_id_idx ON {}.todos (created_at, id)")
+                        .format(sql.Identifier(schema_name)))
+            # Notify every replica of changes, once per statement. Statements
+            # changing up to 100 rows send the rows; larger ones, and those
+            # whose rows don't fit in a notification, send a RELOAD.
+            cur.execute(sql.SQL("""
+                CREATE OR REPLACE FUNCTION {}.notify_todos_changed() RETURNS trigger
+                LANGUAGE plpgsql AS $$
+                DECLARE
+                    changed integer;
+                    payload text;
+                BEGIN
+                    IF TG_OP = 'DELETE' THEN
+                        SELECT count(*) INTO changed FROM old_rows;
+                        IF changed = 0 THEN
+                            RETURN NULL;
+                        ELSIF changed <= 100 THEN
+                            SELECT json_build_object('op', TG_OP, 'ids', json_agg(id))::text
+                            INTO payload FROM old_rows;
+                        END IF;
+                    ELSIF TG_OP IN ('INSERT', 'UPDATE') THEN
+                        SELECT count(*) INTO changed FROM new_rows;
+                        IF changed = 0 THEN
+                            RETURN NULL;
+                        ELSIF changed <= 100 THEN
+                            SELECT json_build_object('op', TG_OP, 'todos', json_agg(
+                                json_build_array(id, task, completed, created_at) ORDER BY created_at, id))::text
+                            INTO payload FROM new_rows;
+                        END IF;
+                    END IF;
+                    IF payload IS NULL OR octet_length(payload) > 7900 THEN
+                        payload := json_build_object('op', 'RELOAD')::text;
+                    END IF;
+                    PERFORM pg_notify(TG_ARGV[0], payload);
+                    RETURN NULL;
+                END
+                $$
+            """).format(sql.Identifier(schema_name)))
+            # One trigger per operation, each given the rows it changed
+            for name, event, referencing in [
+                ("todos_notify_insert", "INSERT", "REFERENCING NEW TABLE AS new_rows"),
+                ("todos_notify_update", "UPDATE", "REFERENCING NEW TABLE AS new_rows"),
+                ("todos_notify_delete", "DELETE", "REFERENCING OLD TABLE AS old_rows"),
+                ("todos_notify_truncate", "TRUNCATE", ""),
+            ]:
+                cur.execute(sql.SQL("""
+                    CREATE OR REPLACE TRIGGER {name} AFTER {event} ON {schema}.todos {referencing}
+                    FOR EACH STATEMENT EXECUTE FUNCTION {schema}.notify_todos_changed({channel})
+                """).format(name=sql.Identifier(name), event=sql.SQL(event), referencing=sql.SQL(referencing),
+                            schema=sql.Identifier(schema_name), channel=sql.Literal(get_notify_channel())))
+            conn.commit()
+
+
+def add_todo(task):
+    """Add a new todo item and return it as an (id, task, completed, created_at) tuple."""
+    with get_connection() as conn:
+        todo = conn.execute(_todo_queries(conn)["add"], (task.strip(),), prepare=True).fetchone()
+        conn.commit()
+    _todo_cache.clear()
+    return todo
+
+
+def _encode_cursor(todo):
+    todo_id, _, _, created_at = todo
+    return f"{created_at.isoformat()}|{todo_id}"
+
+
+def _decode_cursor(cursor):
+    created_at, todo_id = cursor.rsplit("|", 1)
+    return datetime.fromisoformat(created_at), int(todo_id)
+
+
+def get_todos(cursor=None, limit=TODO_PAGE_SIZE):
+    """
+    Get a page of todo items, newest first, as (id, task, completed, created_at)
+    tuples. Returns (todos, next_cursor); pass next_cursor back to get the
+    following page. It is None on the last page.
+    """
+    if _todo_cache.enabled:
+        page, generation = _todo_cache.get((cursor, limit))
+        if page is not None:
+            return page
+        page = _get_todos(cursor, limit)
+        _todo_cache.put((cursor, limit), page, generation)
+        return page
+    return _get_todos(cursor, limit)
+
+
+def _get_todos(cursor, limit):
+    with get_connection() as conn:
+        queries = _todo_queries(conn)
+        # Fetch one extra row to know whether there is another page
+        if cursor is None:
+            todos = conn.execute(queries["list"], (limit + 1,), prepare=True).fetchall()
+        else:
+            created_at, todo_id = _decode_cursor(cursor)
+            todos = conn.execute(queries["list_after"], (created_at, todo_id, limit + 1), prepare=True).fetchall()
+    if len(todos) > limit:
+        todos = todos[:limit]
+        return todos, _encode_cursor(todos[-1])
+    return todos, None
+
+
+def toggle_todo(todo_id):
+    """Toggle the completed status of a todo item and return the updated todo, or None if it doesn't exist."""
+    with get_connection() as conn:
+        todo = conn.execute(_todo_queries(conn)["toggle"], (todo_id,), prepare=True).fetchone()
+        conn.commit()
+    if todo is not None:
+        _todo_cache.clear()
+    return todo
+
+
+def set_todo_completed(todo_id, completed):
+    """
+    Set the completed status of a todo item. Returns the updated todo, or None
+    if it doesn't exist or already had that status, so repeating a call is harmless.
+    """
+    with get_connection() as conn:
+        todo = conn.execute(_todo_queries(conn)["set_completed"], (completed, todo_id, completed),
+                            prepare=True).fetchone()
+        conn.commit()
+    if todo is not None:
+        _todo_cache.clear()
+    return todo
+
+
+def delete_todo(todo_id):
+    """Delete a todo item. Returns whether it existed."""
+    with get_connection() as conn:
+        deleted = conn.execute(_todo_queries(conn)["delete"], (todo_id,), prepare=True).fetchone()
+        conn.commit()
+    if deleted is not None:
+        _todo_cache.clear()
+    return deleted is not None
+
+
+def toggle_todos(todo_ids):
+    """Toggle the completed status of several todo items and return the updated todos."""
+    if not todo_ids:
+        return []
+    with get_connection() as conn:
+        todos = conn.execute(_todo_queries(conn)["toggle_many"], (list(todo_ids),), prepare=True).fetchall()
+        conn.commit()
+    if todos:
+        _todo_cache.clear()
+    return todos
+
+
+def delete_todos(todo_ids):
+    """Delete several todo items and return the ids that were deleted."""
+    if not todo_ids:
+        return []
+    with get_connection() as conn:
+        deleted = conn.execute(_todo_queries(conn)["delete_many"], (list(todo_ids),), prepare=True).fetchall()
+        conn.commit()
+    if deleted:
+        _todo_cache.clear()
+    return [todo_id for todo_id, in deleted]
+
+
+def complete_all():
+    """Mark all todo items as completed and return the ones that weren't yet."""
+    with get_connection() as conn:
+        todos = conn.execute(_todo_queries(conn)["complete_all"], prepare=True).fetchall()
+        conn.commit()
+    if todos:
+        _todo_cache.clear()
+    return todos
+
+
+def clear_completed():
+    """Delete all completed todo items and return their ids."""
+    with get_connection() as conn:
+        deleted = conn.execute(_todo_queries(conn)["clear_completed"], prepare=True).fetchall()
+        conn.commit()
+    if deleted:
+        _todo_cache.clear()
+    return [todo_id for todo_id, in deleted]
+
+
+def _read_todo_csv(lines):
+    """
+    Yield (task, completed) rows from CSV lines with a task column and an
+    optional completed column. A header row starting with "task" is skipped
+    and rows without a task are ignored.
+    """
+    for i, row in enumerate(csv.reader(lines)):
+        if not row or not row[0].strip():
+            continue
+        if i == 0 and row[0].strip().lower() == "task":
+            continue
+        completed = len(row) > 1 and row[1].strip().lower() in ("true", "t", "yes", "y", "1", "x")
+        yield row[0].strip(), completed
+
+
+def import_todos(lines):
+    """
+    Add the todos in a CSV file, given as an iterable of lines (e.g. an open
+    text file), streaming them to the server with a single COPY. Returns the
+    number of todos added.
+    """
+    count = 0
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            with cur.copy(_todo_queries(conn)["import"]) as copy:
+                for row in _read_todo_csv(lines):
+                    copy.write_row(row)
+                    count += 1
+        conn.commit()
+    if count:
+        _todo_cache.clear()
+    return count